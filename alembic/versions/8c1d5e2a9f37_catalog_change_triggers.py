@@ -0,0 +1,68 @@
+"""catalog change triggers
+
+Revision ID: 8c1d5e2a9f37
+Revises: 3f9a2c7d1b84
+Create Date: 2026-10-18 14:03:27.502931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1d5e2a9f37'
+down_revision: Union[str, Sequence[str], None] = '3f9a2c7d1b84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CATALOG_TABLES = (
+    'product_variants',
+    'products',
+    'product_lines',
+    'brands',
+    'categories',
+    'tags',
+    'product_variant_tags',
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # payload chỉ gồm id (NOTIFY giới hạn 8000 bytes), listener tự query phần còn lại
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+        DECLARE
+            data jsonb;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                data := to_jsonb(OLD);
+            ELSE
+                data := to_jsonb(NEW);
+            END IF;
+            PERFORM pg_notify('catalog_changes', json_build_object(
+                'table', TG_TABLE_NAME,
+                'op', TG_OP,
+                'id', data ->> 'id',
+                'variant_id', data ->> 'variant_id',
+                'tag_id', data ->> 'tag_id',
+                'product_id', data ->> 'product_id',
+                'product_line_id', data ->> 'product_line_id'
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in CATALOG_TABLES:
+        op.execute(f"""
+            CREATE TRIGGER {table}_catalog_change
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in CATALOG_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_catalog_change ON {table};")
+    op.execute("DROP FUNCTION IF EXISTS notify_catalog_change();")
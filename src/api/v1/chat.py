@@ -1,13 +1,19 @@
+import asyncio
+import json
 import logging
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.future import select
 
 from src.config import settings
 from src.db import get_db, get_redis, AsyncSession, Redis
-from src.models.product_models import Brand, Category, Tag
+from src.models.product_models import Brand, Category, Tag, Product, ProductVariant
 from src.tools.client import (
-    embedding_client,
+    async_embedding_client,
+    async_redis_client,
+    openai_rate_limiter,
+    gemini_rate_limiter,
 )
 from src.services.chat_services import (
     RAG,
@@ -16,8 +22,13 @@ from src.services.chat_services import (
     Reflection,
     GuardedRAGAgent
 )
+from src.services.semantic_cache_services import SemanticCache
+from src.services.history_services import ChatHistoryStore
+from src.services.embedding_services import EmbeddingBatcher, EmbeddingCache
 from src.schemas.chat_schemas import ChatRequest, ChatResponse
 from src.tools.cache import redis_cache
+from src.tools.telemetry import current_timings
+from src.tasks.queue_uitils import embedding_queue_stats
 
 
 log = logging.getLogger(__name__)
@@ -25,21 +36,69 @@ log = logging.getLogger(__name__)
 router = APIRouter(prefix="/chat", tags=["chat"])
 rag = RAG(
     collection_name=settings.COLLECTION_NAME,
+    vector_index_mode=settings.VECTOR_INDEX_MODE,
+    snapshot_path=settings.VECTOR_INDEX_SNAPSHOT_PATH,
+    quantization=settings.VECTOR_INDEX_QUANTIZATION,
+    rescore_factor=settings.VECTOR_INDEX_RESCORE_FACTOR,
+    group_collection_name=settings.PRODUCT_GROUP_COLLECTION,
+    retrieval_mode=settings.RETRIEVAL_MODE,
+    group_limit=settings.RETRIEVAL_GROUP_LIMIT,
+    variants_per_product=settings.RETRIEVAL_VARIANTS_PER_PRODUCT,
+)
+
+history_store = ChatHistoryStore(
+    redis=async_redis_client,
+    max_items=settings.MAX_HISTORY_ITEMS,
+    max_stored_items=settings.CHAT_HISTORY_MAX_STORED_ITEMS,
+    ttl=settings.CHAT_HISTORY_TTL,
 )
 
 reflection = Reflection(
-    chat_history_collection=settings.CHAT_HISTORY_COLLECTION,
-    semantic_cache_collection=settings.SEMANTIC_CACHE_COLLECTION
+    history_store=history_store,
+    history_token_budget=settings.HISTORY_TOKEN_BUDGET_CHAT,
+    summary_refresh_tokens=settings.HISTORY_SUMMARY_REFRESH_TOKENS,
+)
+
+semantic_cache = SemanticCache(
+    collection_name=settings.SEMANTIC_CACHE_COLLECTION,
+    redis=async_redis_client,
+    similarity_threshold=settings.SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+    max_items=settings.SEMANTIC_CACHE_MAX_ITEMS,
+)
+
+
+embedding_batcher = EmbeddingBatcher(
+    client=async_embedding_client,
+    model=settings.OPENAI_EMBEDDING_MODEL,
+    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+)
+
+embedding_cache = EmbeddingCache(
+    redis=async_redis_client,
+    model=settings.OPENAI_EMBEDDING_MODEL,
+    max_memory_bytes=settings.EMBEDDING_CACHE_MAX_MEMORY_MB * 1024 * 1024,
+    ttl=settings.EMBEDDING_CACHE_TTL,
+    dtype=settings.EMBEDDING_CACHE_DTYPE,
 )
 
 
 agent_router = GuardedRAGAgent(
     rag=rag,
-    embedding_client=embedding_client,
+    embedding_client=async_embedding_client,
     embedding_model=settings.OPENAI_EMBEDDING_MODEL,
     fallback_reflection=reflection,
     similarity_threshold=0.8,
-    max_last_items=settings.MAX_HISTORY_ITEMS
+    keyword_score_threshold=settings.KEYWORD_SCORE_THRESHOLD,
+    max_last_items=settings.MAX_HISTORY_ITEMS,
+    rewrite_token_budget=settings.HISTORY_TOKEN_BUDGET_REWRITE,
+    generate_token_budget=settings.HISTORY_TOKEN_BUDGET_GENERATE,
+    semantic_cache=semantic_cache,
+    speculative=settings.CHAT_SPECULATIVE,
+    speculative_reuse_similarity=settings.CHAT_SPECULATIVE_REUSE_SIMILARITY,
+    embedding_batcher=embedding_batcher,
+    embedding_cache=embedding_cache,
 )
 
 
@@ -56,32 +115,107 @@ async def chatbot(
 
     # Gọi agent invoke (multi-turn + query rewrite + RAG + fallback)
     # get product keyword from cached if exist else call get new
-    tags = await product_keywords(redis=redis, session=session)
-    result = agent_router.invoke(query=query, tags=tags, session_id=session_id)
+    facets = await catalog_facets(redis=redis, session=session)
+    result = await agent_router.invoke(
+        query=query, tags=flatten_facets(facets), session_id=session_id, facets=facets
+    )
 
     # Debug chi tiết
     log.debug(f"[API DEBUG] Agent output (first 300 chars): {result['output'][:300]}")
-    if hasattr(agent_router, 'last_rewritten_query'):
-        log.debug(f"[API DEBUG] Rewritten standalone query: {agent_router.last_rewritten_query}")
+    if result.get("rewritten_query"):
+        log.debug(f"[API DEBUG] Rewritten standalone query: {result['rewritten_query']}")
 
     return {"role": "assistant", "content": result["output"]}
 
 
-# add cached ttl
-@redis_cache(ttl=300)
-@router.get("/keywords", response_model=list[str])
-async def product_keywords(
+def sse_event(data: dict, event: str | None = None) -> str:
+    """Format một event theo chuẩn server-sent events."""
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+@router.post("/stream")
+async def chatbot_stream(
+    data: ChatRequest,
     redis: Redis = Depends(get_redis),
     session: AsyncSession = Depends(get_db)
 ):
     """
-    Lấy danh sách từ khóa sản phẩm.
+    Stream câu trả lời dạng `text/event-stream`:
+    mỗi token là một event `data: {"content": ...}`, kết thúc bằng event `done`.
     """
-    log.info("[API Log] get keywords from db")
+    query = data.message
+    session_id = str(data.session_id)
+    facets = await catalog_facets(redis=redis, session=session)
+
+    async def event_stream():
+        try:
+            async for token in agent_router.stream(
+                query=query, tags=flatten_facets(facets), session_id=session_id, facets=facets
+            ):
+                yield sse_event({"content": token})
+        except Exception as e:
+            log.exception(f"[API ERROR] Chat stream failed: {e}")
+            yield sse_event({"detail": "Có lỗi xảy ra, vui lòng thử lại."}, event="error")
+            return
+        # header Server-Timing đã gửi trước token đầu tiên, timing đầy đủ gửi trong event done
+        yield sse_event({"session_id": session_id, "role": "assistant", "timings": current_timings()}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@redis_cache(ttl=300)
+async def catalog_facets(redis: Redis, session: AsyncSession) -> dict:
+    """
+    Lấy tên brand, category, tag, product, variant từ db (cache 5 phút).
+    """
+    log.info("[API Log] get catalog facets from db")
     brands = await session.execute(select(Brand.name))
-    brands_name = brands.scalars().all()
     categories = await session.execute(select(Category.name))
-    categories_name = categories.scalars().all()
     tags = await session.execute(select(Tag.name))
-    tags_name = tags.scalars().all()
-    return brands_name + categories_name + tags_name
+    products = await session.execute(select(Product.name))
+    variants = await session.execute(select(ProductVariant.name))
+    return {
+        "brands": brands.scalars().all(),
+        "categories": categories.scalars().all(),
+        "tags": tags.scalars().all(),
+        "products": products.scalars().all(),
+        "variants": variants.scalars().all(),
+    }
+
+
+def flatten_facets(facets: dict) -> list[str]:
+    return facets["brands"] + facets["categories"] + facets["tags"] + facets["products"] + facets["variants"]
+
+
+@router.get("/keywords", response_model=list[str])
+async def product_keywords(
+    redis: Redis = Depends(get_redis),
+    session: AsyncSession = Depends(get_db)
+):
+    """
+    Lấy danh sách từ khóa sản phẩm (brand, category, tag, product, variant).
+    """
+    facets = await catalog_facets(redis=redis, session=session)
+    return flatten_facets(facets)
+
+
+@router.get("/metrics")
+async def chat_metrics():
+    """
+    Thống kê runtime của pipeline chat trong worker hiện tại (embedding_queue là của cả hệ thống).
+    """
+    return {
+        "intent": agent_router.intent_classifier.metrics(),
+        "semantic_cache": semantic_cache.metrics(),
+        "llm": reflection.llm_router.metrics(),
+        "speculation": agent_router.speculation_stats,
+        "embedding_batcher": embedding_batcher.metrics(),
+        "embedding_cache": embedding_cache.metrics(),
+        "embedding_queue": await asyncio.to_thread(embedding_queue_stats),
+        "rate_limiter": {"openai": openai_rate_limiter.metrics(), "gemini": gemini_rate_limiter.metrics()},
+    }
@@ -3,7 +3,9 @@ import asyncio
 import logging
 
 import typer
+from redis.asyncio import Redis
 
+from src.config import settings
 from src.db import AsyncSessionLocal, bulk_insert_ignore_conflicts
 from src.models.product_models import (
     Brand,
@@ -16,10 +18,25 @@ from src.models.product_models import (
 )
 from src.tasks.embedding_tasks import (
     process_unembedding_queue,
+    sync_catalog_changes,
     clear_product_embedding,
     clear_history_chat_embedding,
     clear_semantic_cached_embedding,
+    reindex_collections,
+    switch_collections,
+    rollback_collections,
+    collection_versions as list_collection_versions,
+    drop_collection_versions as drop_unused_collection_versions,
+    delete_collection_entries,
+    compact_semantic_cache,
+    cleanup_orphan_embeddings,
 )
+from src.tasks.history_tasks import migrate_chat_history
+from src.tasks.queue_uitils import embedding_queue_stats, requeue_dead_letters, catalog_redis_client
+from src.services.catalog_change_services import CatalogChangeListener
+from src.services.collection_maintenance_services import maintenance_progress
+from src.services.benchmark_services import ChatBenchmark, compare_reports, quantization_benchmark
+from src.tools.fake_clients import LatencyProfile
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -128,12 +145,72 @@ def populatedb():
 
 
 @cli.command()
-def embeddingdb():
+def embeddingdb(full: bool = typer.Option(False, help="Hash lại toàn bộ catalog thay vì chỉ row mới sửa")):
     log.info("Processing unembedding queue...")
-    process_unembedding_queue()
+    process_unembedding_queue(full=full)
     log.info("Unembedding queue processed.")
 
 
+@cli.command()
+def embedding_queue():
+    """Độ dài, số message pending/lag và dead letter của embedding stream."""
+    typer.echo(json.dumps(embedding_queue_stats(), indent=2))
+
+
+@cli.command()
+def requeue_dead_embeddings(count: int = 1000):
+    log.info(f"Requeued {requeue_dead_letters(count)} dead letter messages")
+
+
+@cli.command()
+def listen_catalog_changes(debounce_ms: int = settings.CATALOG_CDC_DEBOUNCE_MS):
+    """Nhận NOTIFY từ trigger catalog và gửi sang celery để embed lại/xóa document bị ảnh hưởng."""
+    listener = CatalogChangeListener(
+        dsn=settings.DATABASE_URL.replace("postgresql+asyncpg", "postgresql"),
+        on_changes=lambda events: sync_catalog_changes.delay(events),
+        debounce_ms=debounce_ms,
+        # quét bù thay đổi xảy ra lúc listener chưa chạy hoặc mất kết nối
+        on_connect=lambda: process_unembedding_queue.delay(),
+    )
+    asyncio.run(listener.run())
+
+
+@cli.command()
+def reindex_collections_version(
+    version: int = typer.Option(None, help="Tiếp tục build version đã có thay vì tạo version mới"),
+    page_size: int = 500,
+    sample_size: int = settings.REINDEX_SAMPLE_SIZE,
+    min_recall: float = settings.REINDEX_MIN_RECALL,
+    switch: bool = typer.Option(True, help="Switch alias sang version mới khi kiểm tra đạt"),
+):
+    """Build version mới của product collections trong nền rồi switch alias, API không bị gián đoạn."""
+    report = reindex_collections(version, page_size, sample_size, min_recall, switch)
+    typer.echo(json.dumps(report, indent=2))
+    if not report["valid"]:
+        raise typer.Exit(code=1)
+
+
+@cli.command()
+def switch_collections_version(version: int):
+    typer.echo(json.dumps(switch_collections(version), indent=2))
+
+
+@cli.command()
+def rollback_collections_version():
+    typer.echo(json.dumps(rollback_collections(), indent=2))
+
+
+@cli.command()
+def collection_versions():
+    """Các version của product collections, version đang phục vụ và version để rollback."""
+    typer.echo(json.dumps(list_collection_versions(), indent=2))
+
+
+@cli.command()
+def drop_collection_versions():
+    log.info(f"Dropped collection versions {drop_unused_collection_versions()}")
+
+
 @cli.command()
 def clear_product_embedded():
     log.info("Processing product embedded queue...")
@@ -155,5 +232,122 @@ def clear_chat_embedded():
     log.info("Chat embedding queue processed.")
 
 
+@cli.command()
+def delete_embeddings(
+    collection: str,
+    where: str = typer.Option(None, help='Metadata filter của chroma dạng JSON, vd. {"brand": "Apple"}'),
+    resume: bool = typer.Option(True, help="Tiếp tục lần chạy bị dừng giữa chừng"),
+):
+    """Xóa document khớp filter (không có filter là xóa trắng collection) theo page."""
+    progress = delete_collection_entries(collection, json.loads(where) if where else None, resume)
+    typer.echo(json.dumps(progress, indent=2))
+
+
+@cli.command()
+def compact_semantic_cache_embedded(resume: bool = True):
+    typer.echo(json.dumps(compact_semantic_cache(resume), indent=2))
+
+
+@cli.command()
+def cleanup_orphan_embedded(resume: bool = True):
+    typer.echo(json.dumps(cleanup_orphan_embeddings(resume), indent=2))
+
+
+@cli.command()
+def maintenance_status():
+    """Tiến độ các job bảo trì collection (job có status running là bị dừng giữa chừng, chạy lại để tiếp tục)."""
+    typer.echo(json.dumps(maintenance_progress(catalog_redis_client), indent=2))
+
+
+@cli.command()
+def migrate_chat_history_store(page_size: int = 500):
+    log.info("Migrating chat history to redis history store...")
+    migrate_chat_history(page_size)
+    log.info("Chat history migrated.")
+
+
+@cli.command()
+def benchmark_chat(
+    sessions: int = 20,
+    stream: bool = False,
+    think_time_ms: float = 0.0,
+    llm: str = typer.Option("800,3000,0", help="OpenAI latency: median_ms,p99_ms,error_rate"),
+    gemini: str = typer.Option("900,3500,0", help="Gemini latency: median_ms,p99_ms,error_rate"),
+    embedding: str = typer.Option("60,250,0", help="Embedding latency: median_ms,p99_ms,error_rate"),
+    chroma: str = typer.Option("15,80,0", help="Chroma latency: median_ms,p99_ms,error_rate"),
+    answer_tokens: int = 120,
+    token_delay_ms: float = 0.0,
+    semantic_cache: bool = True,
+    speculative: bool = settings.CHAT_SPECULATIVE,
+    embedding_batching: bool = True,
+    embedding_cache: bool = True,
+    vector_index: str = typer.Option(settings.VECTOR_INDEX_MODE, help="chroma, exact hoặc hnsw"),
+    retrieval_mode: str = typer.Option(settings.RETRIEVAL_MODE, help="flat hoặc hierarchical"),
+    redis_db: int = 15,
+    seed: int = 42,
+    output: str = typer.Option(None, help="Ghi report JSON ra file để làm baseline"),
+    baseline: str = typer.Option(None, help="Report JSON của lần chạy trước để so sánh"),
+    max_regression: float = 0.2,
+):
+    """
+    Benchmark GuardedRAGAgent với OpenAI/Gemini/embedding/chroma giả lập (chỉ cần Redis).
+    Exit code 1 nếu chậm hơn baseline quá `max_regression`.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def run():
+        redis = Redis(host="redis", port=6379, db=redis_db)
+        benchmark = ChatBenchmark(
+            redis=redis,
+            llm_latency=LatencyProfile.parse(llm, seed),
+            gemini_latency=LatencyProfile.parse(gemini, seed + 1),
+            embedding_latency=LatencyProfile.parse(embedding, seed + 2),
+            chroma_latency=LatencyProfile.parse(chroma, seed + 3),
+            answer_tokens=answer_tokens,
+            token_delay_ms=token_delay_ms,
+            use_semantic_cache=semantic_cache,
+            speculative=speculative,
+            embedding_batching=embedding_batching,
+            embedding_cache=embedding_cache,
+            vector_index=vector_index,
+            retrieval_mode=retrieval_mode,
+        )
+        try:
+            return await benchmark.run(sessions=sessions, stream=stream, think_time_ms=think_time_ms)
+        finally:
+            await benchmark.cleanup()
+            await redis.aclose()
+
+    report = asyncio.run(run())
+    typer.echo(json.dumps(report, indent=2, ensure_ascii=False))
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(report, output_file, indent=2, ensure_ascii=False)
+
+    if baseline:
+        with open(baseline, "r") as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), max_regression)
+        for regression in regressions:
+            log.warning(f"Regression: {regression}")
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+@cli.command()
+def benchmark_quantization(
+    dimensions: int = 1536,
+    limit: int = 10,
+    rescore_factor: int = 4,
+    space: str = typer.Option("cosine", help="l2, cosine hoặc ip"),
+    output: str = typer.Option(None, help="Ghi report JSON ra file"),
+):
+    """So sánh recall và memory của vector index float32/float16/int8/binary trên sample_data (không cần service nào)."""
+    report = quantization_benchmark(dimensions=dimensions, limit=limit, rescore_factor=rescore_factor, space=space)
+    typer.echo(json.dumps(report, indent=2, ensure_ascii=False))
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(report, output_file, indent=2, ensure_ascii=False)
+
+
 if __name__ == "__main__":
     cli()
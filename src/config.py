@@ -30,9 +30,64 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = os.environ["POSTGRES_PASSWORD"]
     POSTGRES_DB: str = os.environ["POSTGRES_DB"]
     COLLECTION_NAME: str = os.getenv("COLLECTION_NAME", "product_variants")
+    PRODUCT_GROUP_COLLECTION: str = os.getenv("PRODUCT_GROUP_COLLECTION", "product_groups")
     CHAT_HISTORY_COLLECTION: str = os.getenv("CHAT_HISTORY_COLLECTION", "chat_history")
     SEMANTIC_CACHE_COLLECTION: str = os.getenv("SEMANTIC_CACHE_COLLECTION", "semantic_cache")
     MAX_HISTORY_ITEMS: int = int(os.getenv("MAX_HISTORY_ITEMS", 100))
+    CHAT_HISTORY_MAX_STORED_ITEMS: int = int(os.getenv("CHAT_HISTORY_MAX_STORED_ITEMS", 1000))
+    CHAT_HISTORY_TTL: int = int(os.getenv("CHAT_HISTORY_TTL", 30 * 24 * 3600))
+    HISTORY_TOKEN_BUDGET_REWRITE: int = int(os.getenv("HISTORY_TOKEN_BUDGET_REWRITE", 800))
+    HISTORY_TOKEN_BUDGET_GENERATE: int = int(os.getenv("HISTORY_TOKEN_BUDGET_GENERATE", 2000))
+    HISTORY_TOKEN_BUDGET_CHAT: int = int(os.getenv("HISTORY_TOKEN_BUDGET_CHAT", 2000))
+    HISTORY_SUMMARY_REFRESH_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_REFRESH_TOKENS", 500))
+    KEYWORD_SCORE_THRESHOLD: float = float(os.getenv("KEYWORD_SCORE_THRESHOLD", 2.0))
+    SEMANTIC_CACHE_SIMILARITY_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_SIMILARITY_THRESHOLD", 0.95))
+    SEMANTIC_CACHE_TTL: int = int(os.getenv("SEMANTIC_CACHE_TTL", 3600))
+    SEMANTIC_CACHE_MAX_ITEMS: int = int(os.getenv("SEMANTIC_CACHE_MAX_ITEMS", 10000))
+    CHAT_SPECULATIVE: bool = True if os.getenv("CHAT_SPECULATIVE", "False") == "True" else False
+    CHAT_SPECULATIVE_REUSE_SIMILARITY: float = float(os.getenv("CHAT_SPECULATIVE_REUSE_SIMILARITY", 0.92))
+    EMBEDDING_BATCH_MAX_SIZE: int = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 64))
+    EMBEDDING_BATCH_WINDOW_MS: float = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 5))
+    RATE_LIMIT_ENABLED: bool = True if os.getenv("RATE_LIMIT_ENABLED", "True") == "True" else False
+    # limit mặc định tới khi học được limit thật từ header x-ratelimit-* của response
+    OPENAI_RATE_LIMIT_REQUESTS_PER_MINUTE: int = int(os.getenv("OPENAI_RATE_LIMIT_REQUESTS_PER_MINUTE", 500))
+    OPENAI_RATE_LIMIT_TOKENS_PER_MINUTE: int = int(os.getenv("OPENAI_RATE_LIMIT_TOKENS_PER_MINUTE", 200_000))
+    GEMINI_RATE_LIMIT_REQUESTS_PER_MINUTE: int = int(os.getenv("GEMINI_RATE_LIMIT_REQUESTS_PER_MINUTE", 1000))
+    GEMINI_RATE_LIMIT_TOKENS_PER_MINUTE: int = int(os.getenv("GEMINI_RATE_LIMIT_TOKENS_PER_MINUTE", 1_000_000))
+    RATE_LIMIT_BACKGROUND_RESERVE: float = float(os.getenv("RATE_LIMIT_BACKGROUND_RESERVE", 0.3))
+    RATE_LIMIT_INTERACTIVE_MAX_WAIT: float = float(os.getenv("RATE_LIMIT_INTERACTIVE_MAX_WAIT", 2.0))
+    RATE_LIMIT_BACKGROUND_MAX_WAIT: float = float(os.getenv("RATE_LIMIT_BACKGROUND_MAX_WAIT", 60.0))
+    EMBEDDING_CONCURRENCY: int = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+    EMBEDDING_REQUEST_MAX_TOKENS: int = int(os.getenv("EMBEDDING_REQUEST_MAX_TOKENS", 200_000))
+    EMBEDDING_REQUEST_MAX_INPUTS: int = int(os.getenv("EMBEDDING_REQUEST_MAX_INPUTS", 2048))
+    EMBEDDING_FLUSH_DELAY_MS: int = int(os.getenv("EMBEDDING_FLUSH_DELAY_MS", 300))
+    EMBEDDING_FLUSH_MAX_ITEMS: int = int(os.getenv("EMBEDDING_FLUSH_MAX_ITEMS", 100))
+    # blue/green reindex: số variant lấy mẫu để đo recall và ngưỡng recall để switch sang version mới
+    REINDEX_SAMPLE_SIZE: int = int(os.getenv("REINDEX_SAMPLE_SIZE", 50))
+    REINDEX_MIN_RECALL: float = float(os.getenv("REINDEX_MIN_RECALL", 0.8))
+    # job bảo trì chroma collection (clear, xóa theo filter, compact, dọn orphan): số id đọc mỗi page / xóa mỗi lần
+    COLLECTION_MAINTENANCE_PAGE_SIZE: int = int(os.getenv("COLLECTION_MAINTENANCE_PAGE_SIZE", 1000))
+    COLLECTION_MAINTENANCE_DELETE_BATCH_SIZE: int = int(os.getenv("COLLECTION_MAINTENANCE_DELETE_BATCH_SIZE", 500))
+    EMBEDDING_PIPELINE_MAX_BATCHES: int = int(os.getenv("EMBEDDING_PIPELINE_MAX_BATCHES", 32))
+    EMBEDDING_CACHE_MAX_MEMORY_MB: int = int(os.getenv("EMBEDDING_CACHE_MAX_MEMORY_MB", 64))
+    EMBEDDING_CACHE_TTL: int = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+    EMBEDDING_CACHE_DTYPE: str = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", 20))
+    LLM_FIRST_TOKEN_TIMEOUT: float = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", 10))
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+    LLM_CIRCUIT_RECOVERY_TIMEOUT: float = float(os.getenv("LLM_CIRCUIT_RECOVERY_TIMEOUT", 30))
+    LLM_HEDGING: bool = True if os.getenv("LLM_HEDGING", "False") == "True" else False
+    LLM_HEDGE_DELAY: float = float(os.getenv("LLM_HEDGE_DELAY", 3))
+    RETRIEVAL_MODE: str = os.getenv("RETRIEVAL_MODE", "flat")
+    RETRIEVAL_GROUP_LIMIT: int = int(os.getenv("RETRIEVAL_GROUP_LIMIT", 8))
+    RETRIEVAL_VARIANTS_PER_PRODUCT: int = int(os.getenv("RETRIEVAL_VARIANTS_PER_PRODUCT", 4))
+    VECTOR_INDEX_MODE: str = os.getenv("VECTOR_INDEX_MODE", "exact")
+    VECTOR_INDEX_SNAPSHOT_PATH: str = os.getenv("VECTOR_INDEX_SNAPSHOT_PATH", "/tmp/aia_faq/product_index")
+    VECTOR_INDEX_QUANTIZATION: str = os.getenv("VECTOR_INDEX_QUANTIZATION", "float32")
+    VECTOR_INDEX_RESCORE_FACTOR: int = int(os.getenv("VECTOR_INDEX_RESCORE_FACTOR", 4))
+    CATALOG_CDC_DEBOUNCE_MS: int = int(os.getenv("CATALOG_CDC_DEBOUNCE_MS", 1000))
+    OTEL_EXPORTER: str = os.getenv("OTEL_EXPORTER", "none")
+    OTEL_EXPORTER_FILE: str = os.getenv("OTEL_EXPORTER_FILE", "traces.jsonl")
     FILE_SERVER_BUCKET_NAME: str = os.getenv("FILE_SERVER_BUCKET_NAME", "faq-image")
     FILE_SERVER_ENDPOINT: str = os.environ["FILE_SERVER_ENDPOINT"]
     FILE_SERVER_ACCESS_KEY: str = os.environ["FILE_SERVER_ACCESS_KEY"]
@@ -1 +1,31 @@
 BATCH_EMBEDDING_SIZE = 100
+# pubsub channel các process dùng để đồng bộ index in-process khi product collection thay đổi
+CATALOG_UPDATES_CHANNEL = "catalog:updates"
+# catalog version: tăng khi catalog hoặc embedding thay đổi (publish catalog update, CDC, CRUD từ admin),
+# semantic cache chỉ match entry cùng version, API worker so với version của snapshot vector index
+CATALOG_INDEX_VERSION_KEY = "catalog:index_version"
+# kênh Postgres NOTIFY do trigger trên các bảng catalog gửi (xem migration catalog_change_triggers)
+CATALOG_CHANGES_CHANNEL = "catalog_changes"
+# embedding queue trên redis stream: consumer group cho nhiều worker, message chỉ bị xóa sau khi ack
+EMBEDDING_STREAM = "embedding_stream"
+EMBEDDING_INTERACTIVE_STREAM = "embedding_stream:interactive"
+# mỗi lane một stream, worker đọc theo thứ tự này: sửa từ admin/CDC trước backfill
+EMBEDDING_LANES = {"interactive": EMBEDDING_INTERACTIVE_STREAM, "background": EMBEDDING_STREAM}
+# payload mới nhất của mỗi job (level:id) chưa xử lý, enqueue lại cùng job chỉ ghi đè payload
+EMBEDDING_JOBS_KEY = "embedding_jobs"
+EMBEDDING_JOB_LANES_KEY = "embedding_jobs:lane"
+# payload của message đã lấy ra nhưng chưa ack, để claim lại khi worker chết
+EMBEDDING_INFLIGHT_KEY = "embedding_jobs:inflight"
+EMBEDDING_FLUSH_KEY = "embedding_flush"
+EMBEDDING_CONSUMER_GROUP = "embedders"
+EMBEDDING_DEAD_LETTER_STREAM = "embedding_stream:dead"
+# message pending lâu hơn (worker chết hoặc batch lỗi) thì worker khác claim lại
+EMBEDDING_CLAIM_IDLE_MS = 60_000
+# số lần giao tối đa trước khi chuyển sang dead letter stream
+EMBEDDING_MAX_DELIVERIES = 5
+# alias -> collection chroma đang phục vụ (blue/green reindex), alias trước đó để rollback
+COLLECTION_ALIASES_KEY = "collection_aliases"
+COLLECTION_PREVIOUS_ALIASES_KEY = "collection_aliases:previous"
+COLLECTION_VERSION_KEY = "collection_aliases:version"
+# tiến độ job bảo trì chroma collection (clear, xóa theo filter, compact, dọn orphan): <key>:<collection>:<job>
+COLLECTION_MAINTENANCE_KEY = "collection_maintenance"
@@ -1,11 +1,14 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.db import init_db
+from src.db import init_db, engine
 from src.config import settings
-from src.api.v1.chat import router as chat_router_v1
+from src.tools.client import async_redis_client, ensure_file_bucket
+from src.tools.telemetry import ServerTimingMiddleware, setup_tracing, instrument_clients
+from src.api.v1.chat import router as chat_router_v1, rag
 from src.api.v1.brand_api import router as brands_router_v1
 from src.api.v1.category_api import router as categories_router_v1
 from src.api.v1.product_line_api import router as products_line_router_v1
@@ -17,7 +20,11 @@ from src.api.v1.tag_api import router as tags_router_v1
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    ensure_file_bucket()
+    # giữ BM25 index của worker đồng bộ với product collection
+    catalog_sync = asyncio.create_task(rag.sync_catalog_updates(async_redis_client))
     yield
+    catalog_sync.cancel()
 
 
 def create_app() -> FastAPI:
@@ -41,6 +48,12 @@ def create_app() -> FastAPI:
     app.include_router(products_router_v1, prefix="/api/v1")
     app.include_router(products_variant_router_v1, prefix="/api/v1")
     app.include_router(tags_router_v1, prefix="/api/v1")
+    app.add_middleware(ServerTimingMiddleware)
+
+    if setup_tracing("aia_faq-api"):
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(app)
+        instrument_clients(engine)
 
     return app
 
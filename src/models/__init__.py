@@ -7,3 +7,4 @@ from src.models.product_models import (
     ProductVariant,
     ProductVariantTag,
 )  # noqa
+from src.models.embedding_models import EmbeddingState  # noqa
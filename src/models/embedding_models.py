@@ -0,0 +1,26 @@
+from sqlalchemy import (
+    UUID,
+    Column,
+    String,
+    UniqueConstraint,
+)
+from src.models.base import BaseModel
+
+
+class EmbeddingState(BaseModel):
+    __tablename__ = "embedding_states"
+
+    entity_id = Column(UUID, nullable=False)
+    collection = Column(String, index=True, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    model = Column(String, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("entity_id", "collection", name="uq_embedding_state_entity_collection"),
+    )
+
+    def __repr__(self):
+        return (
+            f"<EmbeddingState(entity_id={self.entity_id}, collection={self.collection}, "
+            f"content_hash={self.content_hash}, model={self.model})>"
+        )
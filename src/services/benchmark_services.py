@@ -0,0 +1,418 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+from redis.asyncio import Redis
+
+from src.config import settings
+from src.services.chat_services import RAG, OpenAiClient, GeminiClient, Reflection, GuardedRAGAgent
+from src.services.history_services import ChatHistoryStore, CHAT_HISTORY_KEY, CHAT_SUMMARY_KEY
+from src.services.llm_router_services import LLMRouter
+from src.services.embedding_services import EmbeddingBatcher, EmbeddingCache
+from src.services.semantic_cache_services import SemanticCache
+from src.services.quantization_services import QUANTIZATIONS
+from src.services.vector_index_services import LocalVectorIndex
+from src.tools.fake_clients import FakeOpenAI, FakeGemini, FakeChroma, LatencyProfile, hashed_embedding
+from src.tools.telemetry import collect_timings
+from src.utils.common import (
+    generate_product_text,
+    generate_product_group_text,
+    generate_product_line_text,
+    product_metadata,
+    product_group_metadata,
+    percentile,
+)
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# hội thoại nhiều lượt, mỗi session chạy tuần tự một script
+DEFAULT_SCRIPTS = [
+    ["Xin chào", "Mình muốn mua điện thoại Apple dưới 25 triệu", "Bản 128GB có những màu nào?", "Cảm ơn bạn"],
+    ["Laptop nào phù hợp để chơi game?", "Có máy nào khoảng 30 triệu không?", "So sánh giúp mình hai máy đó"],
+    ["Tai nghe chống ồn giá rẻ", "Pin dùng được bao lâu?", "Có bảo hành không?"],
+    ["Shop có đồng hồ thông minh Samsung không?", "Còn hàng không?", "Mình muốn trả góp được không?"],
+    ["Máy tính bảng cho học sinh", "Màn hình bao nhiêu inch?", "Có bản rẻ hơn không?"],
+]
+BENCHMARK_MODEL = "benchmark"
+
+
+def load_sample_catalog(path: str = "sample_data") -> tuple[list[dict], list[dict], dict]:
+    """
+    Build variant item (cùng format `generate_product_text`), product/product line item
+    (`generate_product_group_text`, `generate_product_line_text`) và facets từ sample_data, không cần Postgres.
+    """
+    def load(name):
+        with open(os.path.join(path, f"{name}.json"), "r") as file:
+            return json.load(file)
+
+    brands = {item["id"]: item for item in load("brands")}
+    categories = {item["id"]: item for item in load("categories")}
+    tags = {item["id"]: item for item in load("tags")}
+    lines = {item["id"]: item for item in load("product_lines")}
+    products = {item["id"]: item for item in load("products")}
+    variant_tags = {}
+    for link in load("product_variants_tags"):
+        variant_tags.setdefault(link["variant_id"], []).append(SimpleNamespace(name=tags[link["tag_id"]]["name"]))
+
+    # dựng object giống ORM model để dùng lại đúng các hàm generate_*_text
+    line_models = {
+        line_id: SimpleNamespace(
+            **line,
+            brand=SimpleNamespace(**brands[line["brand_id"]]),
+            category=SimpleNamespace(**categories[line["category_id"]]),
+            products=[],
+        )
+        for line_id, line in lines.items()
+    }
+    product_models = {}
+    for product_id, product in products.items():
+        line_model = line_models[product["product_line_id"]]
+        product_models[product_id] = SimpleNamespace(**product, product_line=line_model, variants=[])
+        line_model.products.append(product_models[product_id])
+
+    items = []
+    for variant in load("product_variants"):
+        product_model = product_models[variant["product_id"]]
+        model = SimpleNamespace(
+            **{"url": None, **variant},
+            tags=variant_tags.get(variant["id"], []),
+            product=product_model,
+        )
+        product_model.variants.append(model)
+        items.append(generate_product_text(model))
+    groups = [generate_product_group_text(model) for model in product_models.values() if model.variants]
+    groups += [generate_product_line_text(model) for model in line_models.values() if model.products]
+
+    facets = {
+        "brands": [item["name"] for item in brands.values()],
+        "categories": [item["name"] for item in categories.values()],
+        "tags": [item["name"] for item in tags.values()],
+        "products": [item["name"] for item in products.values()],
+        "variants": [item["name"] for item in items],
+    }
+    return items, groups, facets
+
+
+class ChatBenchmark:
+    """
+    Chạy `GuardedRAGAgent` end-to-end với OpenAI, Gemini, embedding và chroma giả lập in-process.
+    Chỉ Redis là thật (history, semantic cache index), dùng db riêng và xóa key của run khi xong.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        llm_latency: LatencyProfile = None,
+        gemini_latency: LatencyProfile = None,
+        embedding_latency: LatencyProfile = None,
+        chroma_latency: LatencyProfile = None,
+        answer_tokens: int = 120,
+        token_delay_ms: float = 0.0,
+        use_semantic_cache: bool = True,
+        speculative: bool = settings.CHAT_SPECULATIVE,
+        embedding_batching: bool = True,
+        embedding_cache: bool = True,
+        vector_index: str = settings.VECTOR_INDEX_MODE,
+        retrieval_mode: str = settings.RETRIEVAL_MODE,
+        catalog_path: str = "sample_data",
+    ):
+        self.redis = redis
+        self.run_id = uuid.uuid4().hex[:8]
+        self.catalog_path = catalog_path
+        self.llm_client = FakeOpenAI(llm_latency, answer_tokens, token_delay_ms)
+        self.gemini_client = FakeGemini(gemini_latency, answer_tokens, token_delay_ms)
+        self.embedding_client = FakeOpenAI(embedding_latency)
+        self.chroma_client = FakeChroma(chroma_latency)
+
+        self.router = LLMRouter(
+            providers=[("openai", OpenAiClient(self.llm_client)), ("gemini", GeminiClient(self.gemini_client))],
+            timeout=settings.LLM_TIMEOUT,
+            first_token_timeout=settings.LLM_FIRST_TOKEN_TIMEOUT,
+            failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout=settings.LLM_CIRCUIT_RECOVERY_TIMEOUT,
+            hedging=settings.LLM_HEDGING,
+            hedge_delay=settings.LLM_HEDGE_DELAY,
+        )
+        self.history_store = ChatHistoryStore(
+            redis=redis,
+            max_items=settings.MAX_HISTORY_ITEMS,
+            max_stored_items=settings.CHAT_HISTORY_MAX_STORED_ITEMS,
+            ttl=3600,
+        )
+        self.reflection = Reflection(
+            history_store=self.history_store,
+            history_token_budget=settings.HISTORY_TOKEN_BUDGET_CHAT,
+            summary_refresh_tokens=settings.HISTORY_SUMMARY_REFRESH_TOKENS,
+            router=self.router,
+        )
+        self.semantic_cache = SemanticCache(
+            collection_name=settings.SEMANTIC_CACHE_COLLECTION,
+            redis=redis,
+            similarity_threshold=settings.SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+            ttl=settings.SEMANTIC_CACHE_TTL,
+            max_items=settings.SEMANTIC_CACHE_MAX_ITEMS,
+            chroma_client=self.chroma_client,
+            index_key=f"bench:{self.run_id}:semantic_cache:index",
+        ) if use_semantic_cache else None
+        self.snapshot_dir = os.path.join(tempfile.gettempdir(), f"aia_faq_bench_{self.run_id}")
+        self.rag = RAG(
+            collection_name=settings.COLLECTION_NAME,
+            chroma_client=self.chroma_client,
+            vector_index_mode=vector_index,
+            snapshot_path=os.path.join(self.snapshot_dir, "product_index"),
+            quantization=settings.VECTOR_INDEX_QUANTIZATION,
+            rescore_factor=settings.VECTOR_INDEX_RESCORE_FACTOR,
+            group_collection_name=settings.PRODUCT_GROUP_COLLECTION,
+            retrieval_mode=retrieval_mode,
+            group_limit=settings.RETRIEVAL_GROUP_LIMIT,
+            variants_per_product=settings.RETRIEVAL_VARIANTS_PER_PRODUCT,
+        )
+        self.embedding_batcher = EmbeddingBatcher(
+            client=self.embedding_client,
+            model=BENCHMARK_MODEL,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+        ) if embedding_batching else None
+        self.embedding_cache = EmbeddingCache(
+            redis=redis,
+            model=BENCHMARK_MODEL,
+            max_memory_bytes=settings.EMBEDDING_CACHE_MAX_MEMORY_MB * 1024 * 1024,
+            ttl=3600,
+            dtype=settings.EMBEDDING_CACHE_DTYPE,
+            prefix=f"bench:{self.run_id}:embedding",
+        ) if embedding_cache else None
+        self.agent = GuardedRAGAgent(
+            rag=self.rag,
+            embedding_client=self.embedding_client,
+            embedding_model=BENCHMARK_MODEL,
+            fallback_reflection=self.reflection,
+            similarity_threshold=0.8,
+            max_last_items=settings.MAX_HISTORY_ITEMS,
+            rewrite_token_budget=settings.HISTORY_TOKEN_BUDGET_REWRITE,
+            generate_token_budget=settings.HISTORY_TOKEN_BUDGET_GENERATE,
+            semantic_cache=self.semantic_cache,
+            router=self.router,
+            speculative=speculative,
+            speculative_reuse_similarity=settings.CHAT_SPECULATIVE_REUSE_SIMILARITY,
+            embedding_batcher=self.embedding_batcher,
+            embedding_cache=self.embedding_cache,
+        )
+        self.facets = None
+        self.tags = []
+        self.session_ids = []
+
+    async def setup(self):
+        items, groups, self.facets = load_sample_catalog(self.catalog_path)
+        self.tags = sum(self.facets.values(), [])
+        collection = await self.rag.get_collection()
+        await collection.add(
+            ids=[item["id"] for item in items],
+            embeddings=[hashed_embedding(item["text"]) for item in items],
+            documents=[item["text"] for item in items],
+            metadatas=[product_metadata(item) for item in items],
+        )
+        group_collection = await self.rag.get_group_collection()
+        await group_collection.add(
+            ids=[item["id"] for item in groups],
+            embeddings=[hashed_embedding(item["text"]) for item in groups],
+            documents=[item["text"] for item in groups],
+            metadatas=[product_group_metadata(item) for item in groups],
+        )
+        await self.rag.load_catalog_indexes()
+        log.info(f"[Benchmark] Loaded {len(items)} catalog documents and {len(groups)} product groups")
+
+    async def run_turn(self, session_id: str, query: str, stream: bool) -> dict:
+        started = time.perf_counter()
+        first_token = None
+        error = None
+        with collect_timings() as timings:
+            try:
+                if stream:
+                    async for _ in self.agent.stream(query, self.tags, session_id, self.facets):
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                else:
+                    await self.agent.invoke(query, self.tags, session_id, self.facets)
+            except Exception as e:
+                error = repr(e)
+        return {
+            "latency": time.perf_counter() - started,
+            "first_token": first_token,
+            "error": error,
+            "timings": list(timings),
+        }
+
+    async def run_session(self, index: int, scripts: list[list[str]], stream: bool, think_time_ms: float) -> list[dict]:
+        session_id = f"bench-{self.run_id}-{index}"
+        self.session_ids.append(session_id)
+        results = []
+        for query in scripts[index % len(scripts)]:
+            results.append(await self.run_turn(session_id, query, stream))
+            if think_time_ms:
+                await asyncio.sleep(think_time_ms / 1000)
+        return results
+
+    async def run(
+        self,
+        sessions: int = 20,
+        scripts: list[list[str]] = None,
+        stream: bool = False,
+        think_time_ms: float = 0.0,
+    ) -> dict:
+        scripts = scripts or DEFAULT_SCRIPTS
+        if self.facets is None:
+            await self.setup()
+        started = time.perf_counter()
+        session_results = await asyncio.gather(*[
+            self.run_session(index, scripts, stream, think_time_ms) for index in range(sessions)
+        ])
+        duration = time.perf_counter() - started
+        await self.reflection.compactor.drain()
+        return self.report([turn for turns in session_results for turn in turns], duration, sessions, stream)
+
+    def report(self, turns: list[dict], duration: float, sessions: int, stream: bool) -> dict:
+        def summarize(samples: list[float]) -> dict:
+            samples_ms = [sample * 1000 for sample in samples]
+            return {
+                "p50": percentile(samples_ms, 0.5),
+                "p95": percentile(samples_ms, 0.95),
+                "p99": percentile(samples_ms, 0.99),
+                "mean": sum(samples_ms) / len(samples_ms) if samples_ms else None,
+                "max": max(samples_ms) if samples_ms else None,
+            }
+
+        stages = {}
+        for turn in turns:
+            for name, duration_ms in turn["timings"]:
+                stages.setdefault(name, []).append(duration_ms)
+        errors = [turn["error"] for turn in turns if turn["error"]]
+        total_latency_ms = sum(turn["latency"] for turn in turns) * 1000 or 1.0
+        report = {
+            "sessions": sessions,
+            "requests": len(turns),
+            "errors": len(errors),
+            "error_rate": len(errors) / len(turns) if turns else 0.0,
+            "duration_s": duration,
+            "requests_per_sec": len(turns) / duration if duration else 0.0,
+            "latency_ms": summarize([turn["latency"] for turn in turns]),
+            "stages_ms": {
+                name: {
+                    "count": len(samples),
+                    "mean": sum(samples) / len(samples),
+                    "p95": percentile(samples, 0.95),
+                    "total_share": sum(samples) / total_latency_ms,
+                }
+                for name, samples in sorted(stages.items())
+            },
+            "backend_calls": {
+                "openai": self.llm_client.calls,
+                "gemini": self.gemini_client.calls,
+                "embedding": self.embedding_client.calls,
+            },
+            "intent": self.agent.intent_classifier.metrics(),
+            "llm": self.router.metrics(),
+            "speculation": self.agent.speculation_stats,
+            "sample_errors": sorted(set(errors))[:5],
+        }
+        if stream:
+            report["first_token_ms"] = summarize([turn["first_token"] for turn in turns if turn["first_token"] is not None])
+        if self.semantic_cache:
+            report["semantic_cache"] = self.semantic_cache.metrics()
+        if self.embedding_batcher:
+            report["embedding_batcher"] = self.embedding_batcher.metrics()
+        if self.embedding_cache:
+            report["embedding_cache"] = self.embedding_cache.metrics()
+        if self.rag.vector_index is not None:
+            report["vector_index"] = {
+                "mode": self.rag.vector_index.mode,
+                "quantization": self.rag.vector_index.quantization,
+                "size": len(self.rag.vector_index),
+                "memory_bytes": self.rag.vector_index.memory_bytes(),
+            }
+        return report
+
+    async def cleanup(self):
+        keys = [CHAT_HISTORY_KEY.format(session_id=sid) for sid in self.session_ids]
+        keys += [CHAT_SUMMARY_KEY.format(session_id=sid) for sid in self.session_ids]
+        if self.semantic_cache:
+            keys.append(self.semantic_cache.index_key)
+        if self.embedding_cache:
+            keys += [key async for key in self.redis.scan_iter(match=f"{self.embedding_cache.prefix}:*")]
+        if keys:
+            await self.redis.delete(*keys)
+        shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+
+def compare_reports(report: dict, baseline: dict, max_regression: float = 0.2) -> list[str]:
+    """Trả về danh sách chỉ số bị chậm hơn baseline quá `max_regression` (tỉ lệ)."""
+    regressions = []
+    for key in ("p50", "p95", "p99"):
+        current, previous = report["latency_ms"].get(key), baseline["latency_ms"].get(key)
+        if current and previous and current > previous * (1 + max_regression):
+            regressions.append(f"latency {key}: {previous:.1f}ms -> {current:.1f}ms")
+    current, previous = report["requests_per_sec"], baseline["requests_per_sec"]
+    if previous and current < previous * (1 - max_regression):
+        regressions.append(f"requests/sec: {previous:.2f} -> {current:.2f}")
+    if report["error_rate"] > baseline["error_rate"] + max_regression * max(baseline["error_rate"], 0.01):
+        regressions.append(f"error rate: {baseline['error_rate']:.3f} -> {report['error_rate']:.3f}")
+    return regressions
+
+
+def quantization_benchmark(
+    catalog_path: str = "sample_data",
+    dimensions: int = 1536,
+    limit: int = 10,
+    rescore_factor: int = 4,
+    space: str = "cosine",
+) -> dict:
+    """
+    Recall@limit và memory của từng kiểu quantization so với search exact float32,
+    catalog lấy từ `sample_data`, embedding là `hashed_embedding` (không gọi OpenAI).
+    """
+    items, _, facets = load_sample_catalog(catalog_path)
+    ids = [item["id"] for item in items]
+    documents = [item["text"] for item in items]
+    embeddings = [hashed_embedding(text, dimensions) for text in documents]
+    metadatas = [product_metadata(item) for item in items]
+    queries = [turn for script in DEFAULT_SCRIPTS for turn in script] + facets["products"] + facets["categories"]
+    query_embeddings = [hashed_embedding(query, dimensions) for query in queries]
+
+    exact = LocalVectorIndex(space=space)
+    exact.build(ids, embeddings, documents, metadatas)
+    truth = [{doc_id for doc_id, *_ in exact.search(query, limit)} for query in query_embeddings]
+
+    results = []
+    for quantization in QUANTIZATIONS:
+        # binary luôn phải rescore, các kiểu khác đo cả khi không rescore
+        for factor in sorted({rescore_factor, 0 if quantization not in ("float32", "binary") else rescore_factor}):
+            index = LocalVectorIndex(space=space, quantization=quantization, rescore_factor=factor)
+            index.build(ids, embeddings, documents, metadatas)
+            started = time.perf_counter()
+            hits = [{doc_id for doc_id, *_ in index.search(query, limit)} for query in query_embeddings]
+            duration = time.perf_counter() - started
+            vector_bytes = index.codes.nbytes if index.codes is not None else index.base.nbytes
+            results.append({
+                "quantization": quantization,
+                "rescore_factor": factor if quantization != "float32" else None,
+                "recall": sum(len(hit & expected) / len(expected) for hit, expected in zip(hits, truth) if expected)
+                / max(1, sum(1 for expected in truth if expected)),
+                "query_ms": duration * 1000 / len(query_embeddings),
+                "vector_bytes": vector_bytes,
+                "bytes_per_vector": vector_bytes / max(1, len(ids)),
+                "compression": exact.base.nbytes / vector_bytes if vector_bytes else 0.0,
+            })
+    return {
+        "documents": len(ids),
+        "dimensions": dimensions,
+        "queries": len(queries),
+        "limit": limit,
+        "space": space,
+        "results": results,
+    }
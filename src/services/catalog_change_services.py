@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable
+
+import asyncpg
+
+from src.constants import CATALOG_CHANGES_CHANNEL
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class CatalogChangeListener:
+    """
+    LISTEN trên channel mà trigger `notify_catalog_change` (migration 8c1d5e2a9f37) gửi event khi catalog thay đổi.
+    - Event được gom trong `debounce_ms` (bỏ trùng) rồi gọi `on_changes(events)` một lần, vd. sửa tên brand
+      sinh ra một event chứ không phải một event cho mỗi variant; việc resolve ra variant làm ở celery task.
+    - NOTIFY không được lưu lại khi không có ai LISTEN: mỗi lần (re)connect gọi `on_connect` để quét bù
+      những thay đổi bị lỡ trong lúc mất kết nối.
+    - `on_changes` lỗi (vd. broker celery tạm down) thì giữ lại batch, gửi lại với exponential backoff
+      (`dispatch_retry_delay` tới `max_dispatch_retry_delay`), event mới trong lúc chờ được gộp vào batch đó.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        on_changes: Callable[[list[dict]], Awaitable[None] | None],
+        debounce_ms: int = 1000,
+        on_connect: Callable[[], Awaitable[None] | None] = None,
+        retry_delay: float = 5.0,
+        keepalive_interval: float = 30.0,
+        dispatch_retry_delay: float = 1.0,
+        max_dispatch_retry_delay: float = 60.0,
+    ):
+        self.dsn = dsn
+        self.on_changes = on_changes
+        self.debounce = debounce_ms / 1000
+        self.on_connect = on_connect
+        self.retry_delay = retry_delay
+        self.keepalive_interval = keepalive_interval
+        self.dispatch_retry_delay = dispatch_retry_delay
+        self.max_dispatch_retry_delay = max_dispatch_retry_delay
+        self.events: asyncio.Queue[dict] = asyncio.Queue()
+        # batch gửi lỗi, giữ qua cả reconnect
+        self._failed: dict[str, dict] = {}
+        self._dispatch_failures = 0
+
+    @staticmethod
+    def _key(event: dict) -> str:
+        return json.dumps(event, sort_keys=True)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            self.events.put_nowait(json.loads(payload))
+        except ValueError:
+            log.warning(f"[CatalogCDC] Ignoring malformed payload: {payload}")
+
+    async def _call(self, callback, *args):
+        result = callback(*args)
+        if asyncio.iscoroutine(result):
+            await result
+
+    async def _drain(self, events: dict[str, dict], window: float) -> list[dict]:
+        """Gom thêm event vào `events` tới khi hết `window` giây, bỏ event trùng (vd. nhiều UPDATE trên cùng row)."""
+        events = dict(events)
+        deadline = asyncio.get_running_loop().time() + window
+        while (remaining := deadline - asyncio.get_running_loop().time()) > 0:
+            try:
+                event = await asyncio.wait_for(self.events.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            events[self._key(event)] = event
+        return list(events.values())
+
+    async def _dispatch(self, events: list[dict]):
+        log.info(f"[CatalogCDC] Dispatching {len(events)} catalog changes")
+        try:
+            await self._call(self.on_changes, events)
+        except Exception as e:
+            self._dispatch_failures += 1
+            self._failed = {self._key(event): event for event in events}
+            log.error(
+                f"[CatalogCDC] Failed to dispatch {len(events)} catalog changes, "
+                f"retrying in {self._dispatch_backoff()}s: {e}"
+            )
+            return
+        self._failed = {}
+        self._dispatch_failures = 0
+
+    def _dispatch_backoff(self) -> float:
+        return min(self.max_dispatch_retry_delay, self.dispatch_retry_delay * 2 ** (self._dispatch_failures - 1))
+
+    async def _listen(self, connection):
+        while True:
+            if self._failed:
+                # chờ backoff rồi gửi lại batch lỗi cùng event mới tới trong lúc chờ
+                events = await self._drain(self._failed, self._dispatch_backoff())
+            else:
+                try:
+                    first = await asyncio.wait_for(self.events.get(), timeout=self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    # connection chết thì không nhận được notify nào, query để phát hiện và reconnect
+                    await connection.fetchval("SELECT 1")
+                    continue
+                events = await self._drain({self._key(first): first}, self.debounce)
+            await self._dispatch(events)
+
+    async def run(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(CATALOG_CHANGES_CHANNEL, self._on_notify)
+                log.info(f"[CatalogCDC] Listening on channel {CATALOG_CHANGES_CHANNEL}")
+                if self.on_connect is not None:
+                    await self._call(self.on_connect)
+                await self._listen(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"[CatalogCDC] Connection lost: {e}, retrying in {self.retry_delay}s")
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
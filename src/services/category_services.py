@@ -6,6 +6,8 @@ from src.schemas.category_schemas import (
     CategoryUpdateSchema,
 )
 from src.services.base_services import BaseServiceDBSession
+from src.tools.cache import bump_catalog_version
+from src.tools.client import async_redis_client
 from src.utils.common import update_obj_from_dict
 
 
@@ -15,6 +17,7 @@ class CategoryService(BaseServiceDBSession):
         self.session.add(obj)
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def get(self, obj_id: str) -> Category | None:
@@ -33,6 +36,7 @@ class CategoryService(BaseServiceDBSession):
         update_obj_from_dict(obj, data.model_dump(exclude_unset=True))
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def delete(self, obj_id: str) -> bool:
@@ -44,6 +48,7 @@ class CategoryService(BaseServiceDBSession):
             return False
         await self.session.delete(obj)
         await self.session.commit()
+        await bump_catalog_version(async_redis_client)
         return True
 
     async def list(self, skip: int = 0, limit: int = 20) -> list[Category]:
@@ -1,11 +1,28 @@
-import logging
+import asyncio
 import json
-import uuid
+import logging
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-from src.tools.client import chroma_client, llm_client, gemini_client
+from src.tools.client import (
+    async_llm_client,
+    async_gemini_client,
+    get_async_chroma_client,
+)
 from src.config import settings
+from src.constants import CATALOG_INDEX_VERSION_KEY, CATALOG_UPDATES_CHANNEL
+from src.services.intent_services import ProductIntentClassifier
+from src.services.semantic_cache_services import SemanticCache
+from src.services.history_services import ChatHistoryStore, HistoryCompactor
+from src.services.lexical_index_services import BM25Index
+from src.services.query_parser_services import QueryParser
+from src.services.llm_router_services import LLMRouter
+from src.services.embedding_services import EmbeddingBatcher, EmbeddingCache
+from src.services.vector_index_services import LocalVectorIndex, VECTOR_INDEX_MODES, snapshot_lock
+from src.services.collection_alias_services import resolve_collection_aliases
+from src.tools.rate_limiter import unwrap_rate_limit
+from src.tools.telemetry import stage
+from src.utils.common import estimate_tokens, cosine_similarity
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -13,11 +30,27 @@ log = logging.getLogger(__name__)
 OPEN_AI_ROLE_MAPPING = {"human": "user", "ai": "assistant", "system": "system"}
 GEMINI_AI_ROLE_MAPPING = {"human": "user", "ai": "model", "system": "model"}
 DEFAULT_SEARCH_LIMIT = 5
+REFLECTION_SYSTEM_PROMPT = """
+        Instruction:
+        Bạn là chatbot cửa hàng bán điện thoại/laptop. Vai trò của bạn là hỗ trợ khách hàng trong việc tìm hiểu về các sản phẩm và dịch vụ của cửa hàng, cũng như tạo một trải nghiệm mua sắm dễ chịu và thân thiện.
+        Hãy luôn giữ thái độ lịch sự và chuyên nghiệp. Nếu khách hàng hỏi về sản phẩm cụ thể, hãy cung cấp thông tin chi tiết và gợi ý các lựa chọn phù hợp. Nếu khách hàng trò chuyện về các chủ đề không liên quan đến sản phẩm, hãy tham gia vào cuộc trò chuyện một cách vui vẻ và thân thiện và đề xuất họ các thông tin về sản phẩm ví dụ: Bạn có quan tâm về điện thoại không?
+        một số điểm chính bạn cần lưu ý:
+        0. [Important] Chỉ trả lời dựa trên các thông tin của sản phẩm có trong database. Tuyệt đối không cung cấp thông tin bên ngoài hay gợi ý khách hàng tìm kiếm trên mạng.
+        1. Đáp ứng nhanh chóng và chính xác, sử dụng xưng hô là "Mình và bạn".
+        2. Giữ cho cuộc trò chuyện vui vẻ và thân thiện.
+        3. Khi gặp những cầu hỏi còn lựa chọn nào khác không, hãy tìm kiếm lại trong database
+        4. Giữ cho cuộc trò chuyện mang tính chất hỗ trợ và giúp đỡ.
+        5. Khi nhận các câu hỏi không liên quan đến sản phẩm, hãy thân thiện hướng dẫn khách hàng đến các chủ đề liên quan đến các sản phẩm.
+        6. Khi nhận các câu hỏi về thông tin sản phẩm, có thể lấy từ `Product Line Description` và `Product Description`, khi các câu hỏi liên quan đến thông số kỹ thuật, cấu hình như: màu sắc, dung lượng pin, camera, cấu hình, hãy sử dụng `Specs` để trả lời.
+        7. Khi được hỏi link hoặc url của sản phẩm. hãy lấy thông tin từ `Url` và đính kèm format: `Links: {url}`
+        8. Khi được hỏi về giá sản phẩm, hãy lấy thông tin từ `Prhình
+        Hãy làm cho khách hàng cảm thấy được chào đón và quan tâm!
+        """
 
 
 class OpenAiClient:
-    def __init__(self):
-        self.client = llm_client
+    def __init__(self, client: AsyncOpenAI = None):
+        self.client = client or async_llm_client
     
     def restructure_content(self, messages: list[dict]):
         new_message = []
@@ -30,21 +63,38 @@ class OpenAiClient:
             new_message.append(mes)
         return new_message
 
-    def chat(self, messages, model="gpt-4o-mini"):
+    async def chat(self, messages, model="gpt-4o-mini"):
         re_messages = self.restructure_content(messages)
         log.info(f"[openai message] {messages}")
-        response = self.client.chat.completions.create(
-            model=model,
-            messages=re_messages,
-            temperature=0.1
-        )
+        with unwrap_rate_limit():
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=re_messages,
+                temperature=0.1
+            )
         # Trả về thẳng string content thay vì object
         return response.choices[0].message.content
 
+    async def chat_stream(self, messages, model="gpt-4o-mini"):
+        """Stream từng đoạn text ngay khi OpenAI trả về."""
+        re_messages = self.restructure_content(messages)
+        log.info(f"[openai stream message] {messages}")
+        with unwrap_rate_limit():
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=re_messages,
+                temperature=0.1,
+                stream=True
+            )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
 
 class GeminiClient:
-    def __init__(self):
-        self.client = gemini_client
+    def __init__(self, client=None):
+        # `client` là `genai.Client(...).aio` hoặc object cùng interface
+        self.client = client or async_gemini_client
     
     def restructure_content(self, messages: list[dict]):
         new_message = []
@@ -58,9 +108,9 @@ class GeminiClient:
         log.info(f"[gemini message] {new_message}")
         return new_message
 
-    def chat(self, messages, model=settings.GEMINI_MODEL):
+    async def chat(self, messages, model=settings.GEMINI_MODEL):
         re_messages = self.restructure_content(messages)
-        response = self.client.models.generate_content(
+        response = await self.client.models.generate_content(
             model=model,
             contents=re_messages,
             config={
@@ -69,14 +119,236 @@ class GeminiClient:
         )
         return response.text
 
+    async def chat_stream(self, messages, model=settings.GEMINI_MODEL):
+        """Stream từng đoạn text ngay khi Gemini trả về."""
+        re_messages = self.restructure_content(messages)
+        stream = await self.client.models.generate_content_stream(
+            model=model,
+            contents=re_messages,
+            config={
+                    "temperature": 0.1
+                }
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
 
 llm = OpenAiClient()
 gemini_llm = GeminiClient()
+llm_router = LLMRouter(
+    providers=[("openai", llm), ("gemini", gemini_llm)],
+    timeout=settings.LLM_TIMEOUT,
+    first_token_timeout=settings.LLM_FIRST_TOKEN_TIMEOUT,
+    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+    recovery_timeout=settings.LLM_CIRCUIT_RECOVERY_TIMEOUT,
+    hedging=settings.LLM_HEDGING,
+    hedge_delay=settings.LLM_HEDGE_DELAY,
+)
 
 
 class RAG:
-    def __init__(self, collection_name: str):
-        self.collection = chroma_client.get_or_create_collection(name=collection_name)
+    def __init__(
+        self,
+        collection_name: str,
+        lexical_index: BM25Index = None,
+        chroma_client=None,
+        vector_index_mode: str = "chroma",
+        snapshot_path: str = None,
+        quantization: str = "float32",
+        rescore_factor: int = 4,
+        group_collection_name: str = None,
+        retrieval_mode: str = "flat",
+        group_limit: int = 8,
+        variants_per_product: int = 4,
+    ):
+        """
+        `vector_index_mode`: "chroma" query thẳng chroma, "exact"/"hnsw" search trên bản sao in-process
+        (LocalVectorIndex), snapshot ở `snapshot_path` được memmap để các worker dùng chung.
+        `quantization`: kiểu code giữ trong memory của mỗi worker, float32 gốc chỉ đọc từ memmap khi rescore.
+        `retrieval_mode="hierarchical"`: tìm product/product line trong `group_collection_name` trước,
+        rồi chỉ search variant của các product đó và gộp variant cùng product thành một kết quả.
+        `collection_name`/`group_collection_name` là alias, được đổi sang version đang phục vụ khi load index.
+        """
+        self.collection_alias = collection_name
+        self.collection_name = collection_name
+        self.collection = None
+        self.lexical_index = lexical_index or BM25Index()
+        self.chroma_client = chroma_client
+        self.vector_index_mode = vector_index_mode if vector_index_mode in VECTOR_INDEX_MODES else None
+        self.snapshot_path = snapshot_path
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.vector_index: LocalVectorIndex | None = None
+        self.group_collection_alias = group_collection_name
+        self.group_collection_name = group_collection_name
+        self.group_collection = None
+        self.retrieval_mode = retrieval_mode if group_collection_name else "flat"
+        self.group_limit = group_limit
+        self.variants_per_product = variants_per_product
+
+    async def get_collection(self):
+        # async chroma client chỉ tạo được trong event loop nên lấy collection lúc gọi lần đầu
+        if self.collection is None:
+            client = self.chroma_client or await get_async_chroma_client()
+            self.collection = await client.get_or_create_collection(name=self.collection_name)
+        return self.collection
+
+    async def get_group_collection(self):
+        if self.group_collection is None:
+            client = self.chroma_client or await get_async_chroma_client()
+            self.group_collection = await client.get_or_create_collection(name=self.group_collection_name)
+        return self.group_collection
+
+    async def resolve_collections(self, redis):
+        """Đổi alias sang collection đang phục vụ (sau reindex/rollback), bỏ collection đã lấy nếu tên đổi."""
+        aliases = [name for name in (self.collection_alias, self.group_collection_alias) if name]
+        resolved = await resolve_collection_aliases(redis, aliases)
+        if resolved[self.collection_alias] != self.collection_name:
+            log.info(f"[RAG] Collection {self.collection_alias} -> {resolved[self.collection_alias]}")
+            self.collection_name = resolved[self.collection_alias]
+            self.collection = None
+        if self.group_collection_alias and resolved[self.group_collection_alias] != self.group_collection_name:
+            self.group_collection_name = resolved[self.group_collection_alias]
+            self.group_collection = None
+
+    async def load_lexical_index(self, page_size: int = 500):
+        """Build BM25 index từ document đang có trong product collection (đọc theo page)."""
+        collection = await self.get_collection()
+        index = BM25Index(k1=self.lexical_index.k1, b=self.lexical_index.b)
+        offset = 0
+        while True:
+            page = await collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            index.add_many(ids, page["documents"], page["metadatas"])
+            offset += len(ids)
+        self.lexical_index = index
+        log.info(f"[RAG] Loaded lexical index with {len(index)} documents")
+
+    async def load_catalog_indexes(self, redis=None, page_size: int = 500):
+        """
+        Load BM25 index và (nếu bật) vector index in-process.
+        Snapshot còn đúng version trong Redis thì memmap lại, không thì đọc chroma theo page rồi ghi snapshot mới.
+        """
+        if redis is not None:
+            await self.resolve_collections(redis)
+        if self.vector_index_mode is None:
+            await self.load_lexical_index(page_size)
+            return
+
+        version = int(await redis.get(CATALOG_INDEX_VERSION_KEY) or 0) if redis is not None else 0
+        async with snapshot_lock(self.snapshot_path):
+            index = await asyncio.to_thread(self._load_snapshot)
+            if index is not None and index.version != version:
+                log.info(f"[RAG] Vector index snapshot is stale (version {index.version}, catalog {version})")
+                index = None
+            if index is None:
+                index = await self._build_vector_index(page_size)
+                index.version = version
+                await asyncio.to_thread(index.save, self.snapshot_path)
+                # mở lại bằng memmap để vector float32 nằm trong page cache thay vì memory của process
+                index = await asyncio.to_thread(self._load_snapshot)
+
+        lexical_index = BM25Index(k1=self.lexical_index.k1, b=self.lexical_index.b)
+        lexical_index.add_many(index.ids, index.documents, index.metadatas)
+        self.vector_index = index
+        self.lexical_index = lexical_index
+        log.info(
+            f"[RAG] Loaded vector index ({index.mode}, {index.quantization}) and lexical index "
+            f"with {len(index)} documents, memory {index.memory_bytes()}"
+        )
+
+    def _load_snapshot(self) -> LocalVectorIndex | None:
+        return LocalVectorIndex.load(
+            self.snapshot_path, self.vector_index_mode, self.quantization, self.rescore_factor
+        )
+
+    async def _build_vector_index(self, page_size: int) -> LocalVectorIndex:
+        collection = await self.get_collection()
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        ids, embeddings, documents, metadatas = [], [], [], []
+        offset = 0
+        while True:
+            page = await collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset
+            )
+            page_ids = page.get("ids") or []
+            if not page_ids:
+                break
+            ids += page_ids
+            embeddings += list(page["embeddings"])
+            documents += page["documents"]
+            metadatas += page["metadatas"]
+            offset += len(page_ids)
+        # chỉ dùng để ghi snapshot, mode/quantization áp dụng khi load lại
+        index = LocalVectorIndex(space=space)
+        index.build(ids, embeddings, documents, metadatas)
+        return index
+
+    async def apply_catalog_update(self, update: dict):
+        # "reload" (switch collection version) được xử lý ở sync_catalog_updates
+        action = update.get("action")
+        if action == "clear":
+            self.lexical_index = BM25Index(k1=self.lexical_index.k1, b=self.lexical_index.b)
+            if self.vector_index is not None:
+                self.vector_index.clear()
+        elif action == "delete":
+            for doc_id in update["ids"]:
+                self.lexical_index.remove(doc_id)
+            if self.vector_index is not None:
+                self.vector_index.remove(update["ids"])
+        elif action == "upsert":
+            self.lexical_index.add_many(update["ids"], update["documents"], update["metadatas"] or None)
+            if self.vector_index is not None:
+                # message không mang embedding (quá lớn cho pubsub), lấy lại từ chroma
+                collection = await self.get_collection()
+                page = await collection.get(ids=update["ids"], include=["embeddings", "documents", "metadatas"])
+                self.vector_index.upsert(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+        if self.vector_index is not None:
+            self.vector_index.version = max(self.vector_index.version, update.get("version", 0))
+
+    async def sync_catalog_updates(self, redis, retry_delay: int = 5):
+        """
+        Chạy nền trong mỗi API worker: subscribe CATALOG_UPDATES_CHANNEL rồi load lại index,
+        sau đó áp dụng incremental update do `process_embedding_queue` publish,
+        "reload" (reindex/rollback đổi collection version) thì load lại toàn bộ từ collection mới.
+        """
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(CATALOG_UPDATES_CHANNEL)
+                    await self.load_catalog_indexes(redis)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        update = json.loads(message["data"])
+                        if update.get("action") == "reload":
+                            await self.load_catalog_indexes(redis)
+                        else:
+                            await self.apply_catalog_update(update)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"[RAG] Catalog sync failed, retry in {retry_delay}s: {e}")
+                await asyncio.sleep(retry_delay)
+
+    def _format_document(self, doc_id, document: str, meta: dict, distance: float = None, score: float = None):
+        """`distance` của vector search, `score` (BM25) của keyword search, thang đo khác nhau nên để riêng."""
+        meta = meta if isinstance(meta, dict) else {}
+        return {
+            "_id": doc_id,
+            "title": meta.get("title") or meta.get("name") or "N/A",
+            "description": document,
+            "price": meta.get("price", "N/A"),
+            "brand": meta.get("brand", "N/A"),
+            "category": meta.get("tags", "N/A"),
+            "product_id": meta.get("product_id"),
+            "product_name": meta.get("product_name"),
+            "distance": distance,
+            "score": score,
+        }
 
     def _format_results(self, results: dict):
         """Chuyển kết quả từ ChromaDB thành dict dễ dùng."""
@@ -88,47 +360,64 @@ class RAG:
         ids_list = results["ids"][0] if "ids" in results and results["ids"] else [None]*len(docs_list)
         distances_list = results["distances"][0] if "distances" in results and results["distances"] else [0]*len(docs_list)
 
-        formatted = []
-        for i in range(len(docs_list)):
-            meta = metas_list[i] if isinstance(metas_list[i], dict) else {}
-            formatted.append({
-                "_id": ids_list[i],
-                "title": meta.get("title") or meta.get("name") or "N/A",
-                "description": docs_list[i],
-                "price": meta.get("price", "N/A"),
-                "brand": meta.get("brand", "N/A"),
-                "category": meta.get("tags", "N/A"),
-                "distance": distances_list[i]
-            })
-        return formatted
-
-    def vector_search(self, query_embedding: list, limit: int = DEFAULT_SEARCH_LIMIT):
+        return [
+            self._format_document(ids_list[i], docs_list[i], metas_list[i], distances_list[i])
+            for i in range(len(docs_list))
+        ]
+
+    async def vector_search(self, query_embedding: list, limit: int = DEFAULT_SEARCH_LIMIT, constraints: dict = None):
+        """`constraints` (từ QueryParser) được đẩy xuống chroma thành metadata filter."""
         if not query_embedding:
             return []
 
-        results_raw = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit
-        )
-        results = self._format_results(results_raw)
+        if self.vector_index is not None:
+            return self.local_vector_search(query_embedding, limit, constraints)
+
+        collection = await self.get_collection()
+        where = QueryParser.to_chroma_where(constraints)
+        with stage("vector_search", limit=limit, filtered=where is not None) as span:
+            results_raw = await collection.query(
+                query_embeddings=[query_embedding],
+                n_results=limit,
+                **({"where": where} if where else {})
+            )
+            results = self._format_results(results_raw)
+            span.set_attribute("results", len(results))
         log.debug(f"[DEBUG] Vector search results ({len(results)} items):")
         for r in results:
             log.debug(f"  {r['_id']}: {r['title']}, distance={r['distance']:.4f}")
         return results
 
-    def keyword_search(self, query: str, limit=DEFAULT_SEARCH_LIMIT):
-        """Tìm document dựa trên từ khóa text."""
+    def local_vector_search(self, query_embedding: list, limit: int = DEFAULT_SEARCH_LIMIT, constraints: dict = None):
+        """Search trên vector index in-process, filter bằng QueryParser.matches (mask được cache theo constraints)."""
+        index = self.vector_index
+        doc_filter = (lambda meta: QueryParser.matches(meta, constraints)) if constraints else None
+        filter_key = json.dumps(constraints, sort_keys=True, default=str) if constraints else None
+        with stage("vector_search", limit=limit, filtered=doc_filter is not None, index_size=len(index)) as span:
+            span.set_attribute("backend", index.mode)
+            results = [
+                self._format_document(doc_id, document, meta, distance)
+                for doc_id, document, meta, distance in index.search(query_embedding, limit, doc_filter, filter_key)
+            ]
+            span.set_attribute("results", len(results))
+        return results
+
+    async def keyword_search(self, query: str, limit=DEFAULT_SEARCH_LIMIT, constraints: dict = None):
+        """Tìm document dựa trên từ khóa text bằng BM25 index in-process, BM25 score nằm ở `score`."""
         if not query:
             return []
- 
-        results_raw = self.collection.query(
-            query_texts=[query],
-            n_results=limit
-        )
-        results = self._format_results(results_raw)
-        print(f"[DEBUG] Keyword search results ({len(results)} items):")
+
+        index = self.lexical_index
+        doc_filter = (lambda meta: QueryParser.matches(meta, constraints)) if constraints else None
+        with stage("keyword_search", limit=limit, filtered=doc_filter is not None, index_size=len(index)) as span:
+            results = [
+                self._format_document(doc_id, index.documents[doc_id], index.metadatas[doc_id], score=score)
+                for doc_id, score in index.search(query, limit, doc_filter=doc_filter)
+            ]
+            span.set_attribute("results", len(results))
+        log.debug(f"[DEBUG] Keyword search results ({len(results)} items):")
         for r in results:
-            print(f"  {r['_id']}: {r['title']}, distance={r['distance']:.4f}")
+            log.debug(f"  {r['_id']}: {r['title']}, score={r['score']:.4f}")
         return results
  
     def reciprocal_rank_fusion(self, result_lists, k=3):
@@ -144,33 +433,118 @@ class RAG:
                 score = 1.0 / (k + rank + 1)
                 scores[doc_id] = scores.get(doc_id, 0) + score
  
-        # Gom lại thông tin từ kết quả gốc (ưu tiên cái xuất hiện trước)
+        # Gom lại thông tin từ kết quả gốc (ưu tiên cái xuất hiện trước),
+        # document có trong nhiều danh sách giữ cả distance (vector) lẫn score (BM25)
         id_to_doc = {}
         for results in result_lists:
             for item in results:
-                if item["_id"] not in id_to_doc:
-                    id_to_doc[item["_id"]] = item
+                doc = id_to_doc.setdefault(item["_id"], dict(item))
+                for key in ("distance", "score"):
+                    if doc.get(key) is None and item.get(key) is not None:
+                        doc[key] = item[key]
  
         # Sort theo score
         fused = sorted(id_to_doc.values(), key=lambda x: scores.get(x["_id"], 0), reverse=True)
         return fused
  
-    def hybrid_search(self, query_embedding: list, query_text: str = "", limit=DEFAULT_SEARCH_LIMIT):
+    async def hybrid_search(
+        self,
+        query_embedding: list,
+        query_text: str = "",
+        limit=DEFAULT_SEARCH_LIMIT,
+        constraints: dict = None,
+        vector_constraints: dict = None,
+    ):
         """
         Kết hợp vector search và keyword search, dùng RRF để fusion.
         query_embedding: vector embedding của câu hỏi
         query_text: text của câu hỏi
+        constraints: brand/category/tag/khoảng giá, lọc ngay trong lúc search thay vì lọc top-k sau
+        vector_constraints: constraints riêng cho vector search (vd. thêm phạm vi product), mặc định là `constraints`
         """
-        vector_results = self.vector_search(query_embedding, limit)
-        keyword_results = self.keyword_search(query_text, limit) if query_text else []
+        vector_constraints = vector_constraints or constraints
+        if query_text:
+            vector_results, keyword_results = await asyncio.gather(
+                self.vector_search(query_embedding, limit, vector_constraints),
+                self.keyword_search(query_text, limit, constraints),
+            )
+        else:
+            vector_results = await self.vector_search(query_embedding, limit, vector_constraints)
+            keyword_results = []
+
+        if not vector_results and not keyword_results and not QueryParser.is_empty(vector_constraints):
+            # ràng buộc có thể bị hiểu sai, search lại không filter để vẫn có context gần nhất
+            log.debug(f"[DEBUG] No results with constraints {vector_constraints}, retry without filter")
+            return await self.hybrid_search(query_embedding, query_text, limit)
         fused_results = self.reciprocal_rank_fusion([vector_results, keyword_results])
-        print(f"[DEBUG] Hybrid search fused results ({len(fused_results)} items):")
+        log.debug(f"[DEBUG] Hybrid search fused results ({len(fused_results)} items):")
         for r in fused_results[:limit]:
-            print(f"  {r['_id']}: {r['title']}")
+            log.debug(f"  {r['_id']}: {r['title']}")
         return fused_results[:limit]
 
-    def enhance_prompt(self, query_embedding: list):
-        results = self.hybrid_search(query_embedding)
+    async def group_search(self, query_embedding: list, constraints: dict = None) -> tuple[list[str], list[str]]:
+        """
+        Lượt retrieval đầu trên product/product line, trả về (product_ids, product_line_ids).
+        Chỉ lọc brand/category ở mức này, giá và tag được lọc trên variant.
+        """
+        coarse = {key: constraints.get(key) for key in ("brands", "categories")} if constraints else None
+        where = QueryParser.to_chroma_where(coarse)
+        with stage("group_search", limit=self.group_limit, filtered=where is not None) as span:
+            try:
+                collection = await self.get_group_collection()
+                results = await collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=self.group_limit,
+                    include=["metadatas", "distances"],
+                    **({"where": where} if where else {})
+                )
+            except Exception as e:
+                log.error(f"[RAG] Group search failed, falling back to flat search: {e}")
+                return [], []
+            metadatas = (results.get("metadatas") or [[]])[0] or []
+            product_ids = [meta["product_id"] for meta in metadatas if meta.get("level") == "product"]
+            line_ids = [meta["product_line_id"] for meta in metadatas if meta.get("level") == "line"]
+            span.set_attribute("products", len(product_ids))
+            span.set_attribute("product_lines", len(line_ids))
+        return product_ids, line_ids
+
+    def collapse_variants(self, results: list[dict]) -> list[dict]:
+        """Gộp variant cùng product thành một kết quả (vị trí của variant xếp cao nhất), tên variant thành options."""
+        groups, prices = {}, {}
+        for r in results:
+            key = r.get("product_id") or r["_id"]
+            if key not in groups:
+                groups[key] = {**r, "title": r.get("product_name") or r["title"], "options": [], "variant_ids": []}
+                prices[key] = []
+            groups[key]["options"].append(r["title"])
+            groups[key]["variant_ids"].append(r["_id"])
+            if isinstance(r["price"], (int, float)):
+                prices[key].append(r["price"])
+
+        for key, group in groups.items():
+            if prices[key] and min(prices[key]) != max(prices[key]):
+                group["price"] = f"{min(prices[key]):,.0f} - {max(prices[key]):,.0f}"
+        return list(groups.values())
+
+    async def search(
+        self, query_embedding: list, query_text: str = "", limit=DEFAULT_SEARCH_LIMIT, constraints: dict = None
+    ):
+        """Retrieval cho agent: flat (hybrid search trên variant) hoặc hierarchical theo `retrieval_mode`."""
+        if self.retrieval_mode != "hierarchical":
+            return await self.hybrid_search(query_embedding, query_text, limit, constraints)
+
+        product_ids, line_ids = await self.group_search(query_embedding, constraints)
+        # group collection chưa có dữ liệu thì search variant không giới hạn product
+        scoped = None
+        if product_ids or line_ids:
+            scoped = {**(constraints or {}), "product_ids": product_ids, "product_line_ids": line_ids}
+        results = await self.hybrid_search(
+            query_embedding, query_text, limit * self.variants_per_product, constraints, vector_constraints=scoped
+        )
+        return self.collapse_variants(results)[:limit]
+
+    async def enhance_prompt(self, query_embedding: list):
+        results = await self.hybrid_search(query_embedding)
         if not results:
             log.debug("[DEBUG] No knowledge retrieved from RAG.")
             return ""
@@ -183,104 +557,83 @@ class RAG:
 
 
 class Reflection:
-    def __init__(self, chat_history_collection: str, semantic_cache_collection: str):
-        self.history_collection = chroma_client.get_or_create_collection(name=chat_history_collection)
-        self.semantic_cache_collection = chroma_client.get_or_create_collection(name=semantic_cache_collection)
-    
-    def raw_chat(self, messages):
-        try:
-            response_text = llm.chat(messages)
-        except:
-            response_text = gemini_llm.chat(messages)
-        return response_text
+    def __init__(
+        self,
+        history_store: ChatHistoryStore,
+        history_token_budget: int = 2000,
+        summary_refresh_tokens: int = 500,
+        router: LLMRouter = None
+    ):
+        self.history_store = history_store
+        self.llm_router = router or llm_router
+        self.history_token_budget = history_token_budget
+        self.compactor = HistoryCompactor(
+            history_store,
+            summarizer=self.raw_chat,
+            refresh_min_tokens=summary_refresh_tokens
+        )
 
-    def chat(self, session_id: str, enhanced_message: str, original_message: str = '', cache_response: bool = False, query_embedding: list = None):
-        # Build full prompt with context
-        system_prompt_content = """
-        Instruction:
-        Bạn là chatbot cửa hàng bán điện thoại/laptop. Vai trò của bạn là hỗ trợ khách hàng trong việc tìm hiểu về các sản phẩm và dịch vụ của cửa hàng, cũng như tạo một trải nghiệm mua sắm dễ chịu và thân thiện.
-        Hãy luôn giữ thái độ lịch sự và chuyên nghiệp. Nếu khách hàng hỏi về sản phẩm cụ thể, hãy cung cấp thông tin chi tiết và gợi ý các lựa chọn phù hợp. Nếu khách hàng trò chuyện về các chủ đề không liên quan đến sản phẩm, hãy tham gia vào cuộc trò chuyện một cách vui vẻ và thân thiện và đề xuất họ các thông tin về sản phẩm ví dụ: Bạn có quan tâm về điện thoại không?
-        một số điểm chính bạn cần lưu ý:
-        0. [Important] Chỉ trả lời dựa trên các thông tin của sản phẩm có trong database. Tuyệt đối không cung cấp thông tin bên ngoài hay gợi ý khách hàng tìm kiếm trên mạng.
-        1. Đáp ứng nhanh chóng và chính xác, sử dụng xưng hô là "Mình và bạn".
-        2. Giữ cho cuộc trò chuyện vui vẻ và thân thiện.
-        3. Khi gặp những cầu hỏi còn lựa chọn nào khác không, hãy tìm kiếm lại trong database
-        4. Giữ cho cuộc trò chuyện mang tính chất hỗ trợ và giúp đỡ.
-        5. Khi nhận các câu hỏi không liên quan đến sản phẩm, hãy thân thiện hướng dẫn khách hàng đến các chủ đề liên quan đến các sản phẩm.
-        6. Khi nhận các câu hỏi về thông tin sản phẩm, có thể lấy từ `Product Line Description` và `Product Description`, khi các câu hỏi liên quan đến thông số kỹ thuật, cấu hình như: màu sắc, dung lượng pin, camera, cấu hình, hãy sử dụng `Specs` để trả lời.
-        7. Khi được hỏi link hoặc url của sản phẩm. hãy lấy thông tin từ `Url` và đính kèm format: `Links: {url}`
-        8. Khi được hỏi về giá sản phẩm, hãy lấy thông tin từ `Prhình
-        Hãy làm cho khách hàng cảm thấy được chào đón và quan tâm!
+    async def raw_chat(self, messages):
+        # OpenAI -> Gemini qua router (deadline, circuit breaker, hedging)
+        return await self.llm_router.chat(messages)
+
+    async def raw_chat_stream(self, messages):
+        """
+        Stream câu trả lời, fallback sang Gemini nếu OpenAI lỗi trước khi trả token đầu tiên.
+        Lỗi giữa chừng thì raise luôn vì client đã nhận một phần câu trả lời.
         """
-        system_prompt = [{"role": "system", "content": system_prompt_content}]
-        session_msgs = self.__construct_session_messages__(session_id)
+        async for token in self.llm_router.chat_stream(messages):
+            yield token
+
+    async def build_messages(self, session_id: str, enhanced_message: str):
+        # Build full prompt with context
+        system_prompt = [{"role": "system", "content": REFLECTION_SYSTEM_PROMPT}]
+        history = await self.compactor.load(session_id)
+        session_msgs = self.compactor.compact(history, self.history_token_budget)
+        self.compactor.schedule_refresh(history, self.history_token_budget)
         user_prompt = [{"role": "user", "content": enhanced_message}]
-        messages = system_prompt + session_msgs + user_prompt
+        return system_prompt + session_msgs + user_prompt
 
-        try:
-            response_text = llm.chat(messages)
-        except:
-            response_text = gemini_llm.chat(messages)
+    async def chat(self, session_id: str, enhanced_message: str, original_message: str = ''):
+        messages = await self.build_messages(session_id, enhanced_message)
 
-        # Lưu history
-        self.__record_human_prompt__(session_id, enhanced_message, original_message)
-        self.__record_ai_response__(session_id, response_text)
+        response_text = await self.raw_chat(messages)
 
-        # Cache nếu cần
-        if cache_response and query_embedding:
-            self.__cache_ai_response__(enhanced_message, original_message, response_text, query_embedding)
+        # Lưu history
+        await self.__record_exchange__(session_id, enhanced_message, original_message, response_text)
 
         return response_text
 
-    def __construct_session_messages__(self, session_id: str):
-        session_messages = self.history_collection.get(where_document={"$contains": session_id})
-        result = []
-        if not session_messages.get('ids'):
-            return result
-        for doc in session_messages.get('documents', []):
-            hist = json.loads(doc).get('History', {})
-            role = OPEN_AI_ROLE_MAPPING.get(hist.get('type', 'human'), 'user')
-            content = hist.get('data', {}).get('content', '')
-            result.append({"role": role, "content": content})
-        return result
-
-    def __record_human_prompt__(self, session_id: str, enhanced_message: str, original_message: str):
-        self.history_collection.add(
-            ids=[str(uuid.uuid4())],
-            documents=[json.dumps({
-                "SessionId": session_id,
-                "History": {
-                    "type": "human",
-                    "data": {
-                        "type": "human",
-                        "content": original_message,
-                        "enhanced_content": enhanced_message
-                    }
-                }
-            })]
-        )
+    async def chat_stream(self, session_id: str, enhanced_message: str, original_message: str = ''):
+        """Giống `chat` nhưng stream token, history chỉ được lưu sau khi stream kết thúc."""
+        messages = await self.build_messages(session_id, enhanced_message)
+        chunks = []
+        async for token in self.raw_chat_stream(messages):
+            chunks.append(token)
+            yield token
+        await self.__record_exchange__(session_id, enhanced_message, original_message, "".join(chunks))
 
-    def __record_ai_response__(self, session_id: str, response_text: str):
-        self.history_collection.add(
-            ids=[str(uuid.uuid4())],
-            documents=[json.dumps({
-                "SessionId": session_id,
-                "History": {
-                    "type": "ai",
-                    "data": {"type": "ai", "content": response_text}
-                }
-            })]
+    async def __construct_session_messages__(self, session_id: str, limit: int = None):
+        """Lấy tối đa `limit` message gần nhất của session (mặc định MAX_HISTORY_ITEMS)."""
+        history = await self.history_store.last(session_id, limit)
+        # giữ role human/ai để restructure_content map đúng cho cả OpenAI và Gemini
+        return [{"role": hist.get('type', 'human'), "content": hist.get('content', '')} for hist in history]
+
+    async def __record_human_prompt__(self, session_id: str, enhanced_message: str, original_message: str):
+        await self.history_store.append(
+            session_id,
+            self.history_store.build_message("human", original_message, enhanced_content=enhanced_message)
         )
 
-    def __cache_ai_response__(self, enhanced_message: str, original_message: str, response_text: str, query_embedding: list):
-        self.semantic_cache_collection.add(
-            ids=[str(uuid.uuid4())],
-            embeddings=[query_embedding],
-            documents=[json.dumps({
-                "text": [{"type": "human", "content": original_message, "enhanced_content": enhanced_message}],
-                "llm_string": {"model_name": "gpt-4o-mini", "name": "ChatOpenAI"},
-                "return_val": [{"type": "ai", "content": response_text}]
-            })]
+    async def __record_ai_response__(self, session_id: str, response_text: str):
+        await self.history_store.append(session_id, self.history_store.build_message("ai", response_text))
+
+    async def __record_exchange__(self, session_id: str, enhanced_message: str, original_message: str, response_text: str):
+        """Lưu cả câu hỏi và câu trả lời trong một lần ghi (giữ nguyên thứ tự human -> ai)."""
+        await self.history_store.append(
+            session_id,
+            self.history_store.build_message("human", original_message, enhanced_content=enhanced_message),
+            self.history_store.build_message("ai", response_text),
         )
 
 
@@ -290,39 +643,74 @@ class GuardedRAGAgent:
     - Dùng chatHistory để tạo câu hỏi standalone.
     - Tìm document RAG dựa trên rewritten query.
     - Fallback Reflection nếu không tìm đủ document.
+    Agent không giữ state theo request, nhiều request có thể chạy đồng thời trên cùng một instance.
     """
     def __init__(
         self,
         rag: RAG,
-        embedding_client: OpenAI,
+        embedding_client: AsyncOpenAI,
         embedding_model: str,
         fallback_reflection: Reflection = None,
         similarity_threshold: float = 0.75,
-        max_last_items: int = 100
+        keyword_score_threshold: float = 2.0,
+        max_last_items: int = 100,
+        rewrite_token_budget: int = 800,
+        generate_token_budget: int = 2000,
+        intent_classifier: ProductIntentClassifier = None,
+        semantic_cache: SemanticCache = None,
+        query_parser: QueryParser = None,
+        router: LLMRouter = None,
+        speculative: bool = False,
+        speculative_reuse_similarity: float = 0.92,
+        embedding_batcher: EmbeddingBatcher = None,
+        embedding_cache: EmbeddingCache = None
     ):
         self.rag = rag
         self.embedding_client = embedding_client
         self.embedding_model = embedding_model
         self.fallback_reflection = fallback_reflection
         self.similarity_threshold = similarity_threshold
+        self.keyword_score_threshold = keyword_score_threshold
         self.max_last_items = max_last_items
-        self.last_rewritten_query = ""
+        self.rewrite_token_budget = rewrite_token_budget
+        self.generate_token_budget = generate_token_budget
+        self.intent_classifier = intent_classifier or ProductIntentClassifier()
+        self.semantic_cache = semantic_cache
+        self.query_parser = query_parser or QueryParser()
+        self.llm_router = router or (fallback_reflection.llm_router if fallback_reflection else llm_router)
+        self.speculative = speculative
+        self.speculative_reuse_similarity = speculative_reuse_similarity
+        self.speculation_stats = {"reused": 0, "rerun": 0, "cancelled": 0}
+        self.embedding_batcher = embedding_batcher
+        self.embedding_cache = embedding_cache
+
+    async def is_product_query(self, query: str, tags: list[str]) -> bool:
+        """
+        Check sơ bộ query có liên quan sản phẩm.
+        Classifier local quyết định phần lớn traffic, chỉ gọi LLM khi kết quả mơ hồ.
+        """
+        decision = self.intent_classifier.classify(query, tags)
+        if decision is not None:
+            log.debug(f"[DEBUG] Product query decided locally: {decision}")
+            return decision
 
-    def is_product_query(self, query: str, tags: list[str]) -> bool:
-        """Check sơ bộ query có liên quan sản phẩm."""
         prompt = f"""
+            You are the assistant of a store selling phones, laptops and tech accessories.
             Given the user query: {query}
-            And the following product tags: {tags}
             Is this query related to a product? Respond with "yes" or "no".
         """
-        response = self.fallback_reflection.raw_chat([{"role": "human", "content": prompt}])
+        response = await self.fallback_reflection.raw_chat([{"role": "human", "content": prompt}])
         log.debug(f"[DEBUG] Product query check response: {response}")
-        return response.lower() == "yes"
+        return response.strip().lower().startswith("yes")
+
+    def _compact_history(self, history: dict | None, budget: int) -> list[dict]:
+        if not history:
+            return []
+        return self.fallback_reflection.compactor.compact(history, budget)
 
-    def __rewrite_query(self, chat_history, query):
-        """Tạo câu hỏi standalone dựa trên chat history dài hạn."""
-        history_to_use = chat_history[-self.max_last_items:] if len(chat_history) > self.max_last_items else chat_history
-        historyString = "\n".join([f"{h['role']}: {h['content']}" for h in history_to_use])
+    async def __rewrite_query(self, chat_history, query):
+        """Tạo câu hỏi standalone dựa trên chat history (đã compact theo `rewrite_token_budget`)."""
+        historyString = "\n".join([f"{h['role']}: {h['content']}" for h in chat_history])
 
         prompt = [{
             "role": "user",
@@ -335,85 +723,316 @@ class GuardedRAGAgent:
             """
         }]
 
-        rewritten = self.fallback_reflection.raw_chat(prompt)
+        rewritten = await self.fallback_reflection.raw_chat(prompt)
         log.debug(f"[DEBUG] Rewritten query: {rewritten[:300]}")  # show first 300 chars
-        self.last_rewritten_query = rewritten
         return rewritten
 
-    def invoke(self, query: str, tags: list[str] = [], session_id: str = ""):
-        log.debug(f"[DEBUG] Incoming query: {query}")
+    @staticmethod
+    def _prompt_tokens(messages: list[dict]) -> int:
+        return sum(estimate_tokens(m.get("content") or "") for m in messages)
 
-        # 1. Nếu query không liên quan sản phẩm
-        if not self.is_product_query(query, tags):
-            print("[DEBUG] Query không liên quan sản phẩm.")
-            if self.fallback_reflection:
-                output = self.fallback_reflection.chat(
-                    session_id=session_id,
-                    enhanced_message=query,
-                    original_message=query,
-                    cache_response=False
+    async def embed_query(self, text: str) -> list[float]:
+        if self.embedding_cache:
+            cached = await self.embedding_cache.get(text)
+            if cached is not None:
+                return cached
+
+        if self.embedding_batcher:
+            # gom với các request đồng thời khác thành một lần gọi embeddings.create
+            embedding = await self.embedding_batcher.embed(text)
+        else:
+            with unwrap_rate_limit():
+                response = await self.embedding_client.embeddings.create(
+                    model=self.embedding_model,
+                    input=text
                 )
-                print(f"[DEBUG] Fallback Reflection output: {output[:200]}...")
-                return {"output": output}
-            return {"output": "Không tìm thấy dữ liệu"}
+            embedding = response.data[0].embedding
 
-        # 2. Lấy toàn bộ chatHistory
-        chatHistory = self.fallback_reflection.__construct_session_messages__(session_id) if self.fallback_reflection else []
+        if self.embedding_cache:
+            await self.embedding_cache.set(text, embedding)
+        return embedding
 
-        # 3. Rewrite query thành standalone
-        rewritten_query = self.__rewrite_query(chatHistory, query)
+    async def _classify(self, query: str, tags: list[str]) -> bool:
+        with stage("classify", query_tokens=estimate_tokens(query)) as span:
+            is_product = await self.is_product_query(query, tags)
+            span.set_attribute("product_query", is_product)
+        return is_product
 
-        # 4. Tạo embedding cho rewritten query
-        query_embedding = self.embedding_client.embeddings.create(
-            model=self.embedding_model,
-            input=rewritten_query
-        ).data[0].embedding
+    async def _load_history(self, session_id: str) -> dict | None:
+        """Lấy chatHistory gần nhất + rolling summary, mỗi stage compact theo budget riêng."""
+        if not self.fallback_reflection:
+            return None
+        with stage("history_load") as span:
+            history = await self.fallback_reflection.compactor.load(session_id, self.max_last_items)
+            span.set_attribute("messages", len(history["messages"]))
+            span.set_attribute("has_summary", history["summary"] is not None)
+        self.fallback_reflection.compactor.schedule_refresh(
+            history, min(self.rewrite_token_budget, self.generate_token_budget)
+        )
+        return history
 
-        # 5. Lấy document từ RAG
-        results = self.rag.hybrid_search(query_embedding, limit=5)
+    async def _rewrite(self, history: dict | None, query: str) -> str:
+        with stage("rewrite") as span:
+            rewrite_history = self._compact_history(history, self.rewrite_token_budget)
+            rewritten_query = await self.__rewrite_query(rewrite_history, query)
+            span.set_attribute("history_tokens", sum(estimate_tokens(m["content"]) for m in rewrite_history))
+            span.set_attribute("output_tokens", estimate_tokens(rewritten_query))
+        return rewritten_query
+
+    async def _embed(self, text: str) -> list[float]:
+        with stage("embed", input_tokens=estimate_tokens(text)) as span:
+            query_embedding = await self.embed_query(text)
+            span.set_attribute("dimensions", len(query_embedding))
+        return query_embedding
+
+    async def _lookup_cache(self, query_embedding: list[float]) -> tuple[int | None, dict | None]:
+        """Tra semantic cache trước khi generate, trả về (catalog_version, entry nếu hit)."""
+        if not self.semantic_cache:
+            return None, None
+        with stage("cache_lookup") as span:
+            catalog_version = await self.semantic_cache.catalog_version()
+            cached = await self.semantic_cache.lookup(query_embedding, catalog_version)
+            span.set_attribute("hit", cached is not None)
+        return catalog_version, cached
+
+    async def _retrieve(self, query_text: str, query_embedding: list[float], facets: dict = None) -> tuple[dict, list]:
+        """Lấy document từ RAG, ràng buộc brand/category/tag/giá được đẩy xuống vector store."""
+        constraints = self.query_parser.parse(query_text, facets)
+        results = await self.rag.search(
+            query_embedding, query_text=query_text, limit=5, constraints=constraints
+        )
         log.debug(f"[DEBUG] Retrieved {len(results)} documents from RAG")
         for r in results:
-            log.debug(f"  _id={r['_id']}, title={r['title']}, distance={r['distance']:.4f}")
+            log.debug(f"  _id={r['_id']}, title={r['title']}, distance={r['distance']}, score={r.get('score')}")
+        return constraints, results
 
-        # 6. Filter theo similarity threshold
-        filtered_results = [r for r in results if r['distance'] >= self.similarity_threshold]
-        log.debug(f"[DEBUG] Filtered {len(filtered_results)} docs with similarity >= {self.similarity_threshold}")
+    async def _embed_and_retrieve(self, query_text: str, facets: dict = None) -> tuple[list[float], dict, list]:
+        query_embedding = await self._embed(query_text)
+        constraints, results = await self._retrieve(query_text, query_embedding, facets)
+        return query_embedding, constraints, results
+
+    def _is_relevant(self, result: dict) -> bool:
+        """Document chỉ có từ keyword search không có distance, so BM25 score với ngưỡng riêng."""
+        if result.get("distance") is not None and result["distance"] >= self.similarity_threshold:
+            return True
+        return result.get("score") is not None and result["score"] >= self.keyword_score_threshold
+
+    def _build_plan(
+        self,
+        query: str,
+        history: dict | None,
+        rewritten_query: str,
+        query_embedding: list[float],
+        catalog_version: int | None,
+        results: list,
+    ) -> dict:
+        # 6. Filter theo similarity threshold (vector) hoặc BM25 score threshold (keyword)
+        filtered_results = [r for r in results if self._is_relevant(r)]
+        log.debug(
+            f"[DEBUG] Filtered {len(filtered_results)} docs with similarity >= {self.similarity_threshold}"
+            f" or BM25 score >= {self.keyword_score_threshold}"
+        )
         for r in filtered_results:
-            log.debug(f"  _id={r['_id']}, title={r['title']}, distance={r['distance']:.4f}")
+            log.debug(f"  _id={r['_id']}, title={r['title']}, distance={r['distance']}, score={r.get('score')}")
 
         if not filtered_results:
             log.debug("[DEBUG] Không có document đủ similarity, fallback Reflection.")
-            if self.fallback_reflection:
-                output = self.fallback_reflection.chat(
-                    session_id=session_id,
-                    enhanced_message=query,
-                    original_message=query,
-                    cache_response=False
-                )
-                log.debug(f"[DEBUG] Fallback Reflection output: {output[:200]}...")
-                return {"output": output}
-            return {"output": "Không tìm thấy dữ liệu"}
+            route = "reflection" if self.fallback_reflection else "empty"
+            return {"route": route, "rewritten_query": rewritten_query}
 
         # 7. Ghép prompt từ các document
         prompt_docs = "\n".join([
             f"Title: {r['title']}, Content: {r['description']}, Price: {r['price']}, Brand: {r['brand']}"
+            + (f", Options: {', '.join(r['options'])}" if r.get("options") else "")
             for r in filtered_results
         ])
 
         # 8. Tạo message list cho LLM (multi-turn)
         messages = [{"role": "system", "content": "Bạn là chatbot cửa hàng bán đồ công nghệ hi-tech, thân thiện."}]
-        messages += chatHistory[-self.max_last_items:]  # giữ multi-turn context
+        messages += self._compact_history(history, self.generate_token_budget)  # giữ multi-turn context
         messages.append({"role": "system", "content": f"Thông tin sản phẩm liên quan:\n{prompt_docs}"})
         messages.append({"role": "user", "content": query})
+        return {
+            "route": "rag",
+            "messages": messages,
+            "rewritten_query": rewritten_query,
+            "query_embedding": query_embedding,
+            "catalog_version": catalog_version,
+        }
+
+    async def _prepare(self, query: str, tags: list[str], session_id: str, facets: dict = None) -> dict:
+        """
+        Chạy các bước trước khi sinh câu trả lời, trả về:
+        - {"route": "reflection"} nếu cần fallback Reflection
+        - {"route": "empty"} nếu không có Reflection để fallback
+        - {"route": "cached", "output": ...} nếu semantic cache đã có câu trả lời
+        - {"route": "rag", "messages": [...]} nếu đã đủ context để gọi LLM
+        """
+        log.debug(f"[DEBUG] Incoming query: {query}")
+        if self.speculative:
+            return await self._prepare_speculative(query, tags, session_id, facets)
+
+        # 1. Nếu query không liên quan sản phẩm
+        if not await self._classify(query, tags):
+            log.debug("[DEBUG] Query không liên quan sản phẩm.")
+            return {"route": "reflection" if self.fallback_reflection else "empty"}
+
+        # 2. Lấy chatHistory
+        history = await self._load_history(session_id)
+
+        # 3. Rewrite query thành standalone
+        rewritten_query = await self._rewrite(history, query)
+
+        # 4. Tạo embedding cho rewritten query
+        query_embedding = await self._embed(rewritten_query)
+
+        # 4.1 Tra semantic cache trước khi retrieval + generate
+        catalog_version, cached = await self._lookup_cache(query_embedding)
+        if cached:
+            return {"route": "cached", "output": cached["output"], "rewritten_query": rewritten_query}
+
+        # 5. Lấy document từ RAG
+        _, results = await self._retrieve(rewritten_query, query_embedding, facets)
+        return self._build_plan(query, history, rewritten_query, query_embedding, catalog_version, results)
+
+    async def _prepare_speculative(self, query: str, tags: list[str], session_id: str, facets: dict = None) -> dict:
+        """
+        Giống `_prepare` nhưng classify, load history và embed + retrieve câu hỏi gốc chạy song song.
+        - Query không liên quan sản phẩm thì hủy phần việc đã chạy trước.
+        - Lượt đầu (không có history) thì không cần rewrite, dùng luôn kết quả retrieve câu hỏi gốc.
+        - Câu rewrite đủ gần câu gốc (cosine embedding >= `speculative_reuse_similarity`, cùng constraints)
+          thì dùng lại kết quả retrieve, ngược lại mới retrieve lại.
+        """
+        classify_task = asyncio.create_task(self._classify(query, tags))
+        history_task = asyncio.create_task(self._load_history(session_id))
+        retrieve_task = asyncio.create_task(self._embed_and_retrieve(query, facets))
+        tasks = [classify_task, history_task, retrieve_task]
+        try:
+            # 1. Nếu query không liên quan sản phẩm, bỏ phần việc speculative
+            if not await classify_task:
+                self.speculation_stats["cancelled"] += 1
+                log.debug("[DEBUG] Query không liên quan sản phẩm.")
+                return {"route": "reflection" if self.fallback_reflection else "empty"}
+
+            # 2-3. Rewrite dựa trên history, trong lúc retrieve câu hỏi gốc vẫn đang chạy
+            history = await history_task
+            if self._compact_history(history, self.rewrite_token_budget):
+                rewritten_query = await self._rewrite(history, query)
+            else:
+                rewritten_query = query
+
+            # 4. Embedding của rewritten query (trùng câu gốc thì dùng lại)
+            if rewritten_query.strip() == query.strip():
+                query_embedding, _, results = await retrieve_task
+                reuse = True
+            else:
+                query_embedding = await self._embed(rewritten_query)
+                raw_embedding, raw_constraints, results = await retrieve_task
+                reuse = (
+                    cosine_similarity(raw_embedding, query_embedding) >= self.speculative_reuse_similarity
+                    and self.query_parser.parse(rewritten_query, facets) == raw_constraints
+                )
+
+            # 4.1 Tra semantic cache
+            catalog_version, cached = await self._lookup_cache(query_embedding)
+            if cached:
+                return {"route": "cached", "output": cached["output"], "rewritten_query": rewritten_query}
+
+            # 5. Retrieve lại chỉ khi câu rewrite khác đáng kể câu gốc
+            if reuse:
+                self.speculation_stats["reused"] += 1
+            else:
+                self.speculation_stats["rerun"] += 1
+                _, results = await self._retrieve(rewritten_query, query_embedding, facets)
+            return self._build_plan(query, history, rewritten_query, query_embedding, catalog_version, results)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # đánh dấu đã đọc lỗi của phần việc speculative bị bỏ, tránh warning "never retrieved"
+                    task.exception()
+
+    async def _finalize(self, session_id: str, query: str, plan: dict, response: str):
+        """Lưu history và cache câu trả lời RAG (chỉ cache câu trả lời có grounding từ catalog)."""
+        tasks = []
+        if self.fallback_reflection:
+            tasks.append(self.fallback_reflection.__record_exchange__(session_id, query, query, response))
+        if self.semantic_cache and plan["route"] == "rag":
+            tasks.append(self.semantic_cache.store(
+                original_message=query,
+                enhanced_message=plan["rewritten_query"],
+                response_text=response,
+                query_embedding=plan["query_embedding"],
+                catalog_version=plan["catalog_version"],
+            ))
+        with stage("history_write", cache_store=len(tasks) > 1):
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error(f"[ERROR] Failed to persist chat turn: {result}")
+
+    async def invoke(self, query: str, tags: list[str] = [], session_id: str = "", facets: dict = None):
+        plan = await self._prepare(query, tags, session_id, facets)
+        rewritten_query = plan.get("rewritten_query", "")
+
+        if plan["route"] == "empty":
+            return {"output": "Không tìm thấy dữ liệu", "rewritten_query": rewritten_query}
+
+        if plan["route"] == "reflection":
+            with stage("generate", route="reflection") as span:
+                output = await self.fallback_reflection.chat(
+                    session_id=session_id,
+                    enhanced_message=query,
+                    original_message=query
+                )
+                span.set_attribute("output_tokens", estimate_tokens(output))
+            log.debug(f"[DEBUG] Fallback Reflection output: {output[:200]}...")
+            return {"output": output, "rewritten_query": rewritten_query}
+
+        if plan["route"] == "cached":
+            await self._finalize(session_id, query, plan, plan["output"])
+            return {"output": plan["output"], "rewritten_query": rewritten_query}
 
         # 9. Gọi LLM
-        llm = OpenAiClient()
-        response = llm.chat(messages)
+        with stage("generate", route="rag", prompt_tokens=self._prompt_tokens(plan["messages"])) as span:
+            response = await self.llm_router.chat(plan["messages"])
+            span.set_attribute("output_tokens", estimate_tokens(response))
         log.debug(f"[DEBUG] LLM output (first 300 chars): {response[:300]}")
 
-        # 10. Lưu history
-        if self.fallback_reflection:
-            self.fallback_reflection.__record_human_prompt__(session_id, query, query)
-            self.fallback_reflection.__record_ai_response__(session_id, response)
+        # 10. Lưu history + semantic cache
+        await self._finalize(session_id, query, plan, response)
+
+        return {"output": response, "rewritten_query": rewritten_query}
+
+    async def stream(self, query: str, tags: list[str] = [], session_id: str = "", facets: dict = None):
+        """Giống `invoke` nhưng yield từng token, history được lưu sau khi stream xong."""
+        plan = await self._prepare(query, tags, session_id, facets)
+
+        if plan["route"] == "empty":
+            yield "Không tìm thấy dữ liệu"
+            return
+
+        if plan["route"] == "reflection":
+            with stage("generate", activate=False, route="reflection"):
+                async for token in self.fallback_reflection.chat_stream(
+                    session_id=session_id,
+                    enhanced_message=query,
+                    original_message=query
+                ):
+                    yield token
+            return
+
+        if plan["route"] == "cached":
+            yield plan["output"]
+            await self._finalize(session_id, query, plan, plan["output"])
+            return
+
+        chunks = []
+        with stage("generate", activate=False, route="rag", prompt_tokens=self._prompt_tokens(plan["messages"])) as span:
+            async for token in self.llm_router.chat_stream(plan["messages"]):
+                chunks.append(token)
+                yield token
+            span.set_attribute("output_tokens", estimate_tokens("".join(chunks)))
 
-        return {"output": response}
+        await self._finalize(session_id, query, plan, "".join(chunks))
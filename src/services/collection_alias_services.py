@@ -0,0 +1,98 @@
+import logging
+import re
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from src.constants import COLLECTION_ALIASES_KEY, COLLECTION_PREVIOUS_ALIASES_KEY, COLLECTION_VERSION_KEY
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# ARGV: từng cặp alias, collection mới; alias hiện tại (hoặc chính tên alias nếu chưa có) được giữ để rollback
+SWITCH_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i]) or ARGV[i]
+    redis.call('HSET', KEYS[2], ARGV[i], current)
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+# đổi chỗ alias hiện tại và alias trước đó, rollback lần nữa là quay lại version mới
+ROLLBACK_SCRIPT = """
+local previous = redis.call('HGETALL', KEYS[2])
+if #previous == 0 then
+    return 0
+end
+local current = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[1], unpack(previous))
+if #current > 0 then
+    redis.call('HSET', KEYS[2], unpack(current))
+end
+return 1
+"""
+
+
+def versioned_name(name: str, version: int) -> str:
+    return f"{name}__v{version}"
+
+
+def collection_version(name: str, collection_name: str) -> int | None:
+    """Version của một collection vật lý thuộc alias `name`, collection trùng tên alias là v0."""
+    if collection_name == name:
+        return 0
+    match = re.fullmatch(rf"{re.escape(name)}__v(\d+)", collection_name)
+    return int(match.group(1)) if match else None
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class CollectionAliases:
+    """
+    Alias (tên collection trong settings, vd. product_variants) -> collection chroma đang phục vụ (vd. product_variants__v3).
+    - Chưa có alias thì chính tên alias là collection (dữ liệu trước khi có versioning, coi như v0).
+    - Tất cả alias nằm trong một hash nên switch nhiều collection cùng lúc là atomic,
+      alias trước khi switch được giữ lại để rollback.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._switch = redis.register_script(SWITCH_SCRIPT)
+        self._rollback = redis.register_script(ROLLBACK_SCRIPT)
+
+    def resolve(self, name: str) -> str:
+        return _decode(self.redis.hget(COLLECTION_ALIASES_KEY, name)) or name
+
+    def resolve_all(self, names: list[str]) -> dict[str, str]:
+        values = self.redis.hmget(COLLECTION_ALIASES_KEY, names)
+        return {name: _decode(value) or name for name, value in zip(names, values)}
+
+    def previous(self, names: list[str]) -> dict[str, str | None]:
+        values = self.redis.hmget(COLLECTION_PREVIOUS_ALIASES_KEY, names)
+        return {name: _decode(value) for name, value in zip(names, values)}
+
+    def next_version(self) -> int:
+        return self.redis.incr(COLLECTION_VERSION_KEY)
+
+    def switch(self, targets: dict[str, str]):
+        self._switch(
+            keys=[COLLECTION_ALIASES_KEY, COLLECTION_PREVIOUS_ALIASES_KEY],
+            args=[value for pair in targets.items() for value in pair],
+        )
+        log.info(f"[CollectionAliases] Switched to {targets}")
+
+    def rollback(self) -> bool:
+        rolled_back = bool(self._rollback(keys=[COLLECTION_ALIASES_KEY, COLLECTION_PREVIOUS_ALIASES_KEY]))
+        if rolled_back:
+            log.info(f"[CollectionAliases] Rolled back to {self.redis.hgetall(COLLECTION_ALIASES_KEY)}")
+        return rolled_back
+
+
+async def resolve_collection_aliases(redis: AsyncRedis, names: list[str]) -> dict[str, str]:
+    """Bản async của `CollectionAliases.resolve_all` cho API worker."""
+    values = await redis.hmget(COLLECTION_ALIASES_KEY, names)
+    return {name: _decode(value) or name for name, value in zip(names, values)}
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable
+
+from redis import Redis
+
+from src.constants import COLLECTION_MAINTENANCE_KEY
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+PROGRESS_FIELDS = ("offset", "scanned", "deleted", "total", "started_at", "updated_at")
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def maintenance_progress(redis: Redis) -> list[dict]:
+    """Tiến độ của tất cả job bảo trì (đang chạy, bị dừng giữa chừng hoặc đã xong)."""
+    jobs = []
+    for key in sorted(_decode(key) for key in redis.scan_iter(f"{COLLECTION_MAINTENANCE_KEY}:*")):
+        progress = {_decode(field): _decode(value) for field, value in redis.hgetall(key).items()}
+        jobs.append({
+            **progress,
+            **{field: int(progress[field]) for field in PROGRESS_FIELDS if field in progress},
+        })
+    return jobs
+
+
+class CollectionMaintenanceJob:
+    """
+    Job bảo trì một chroma collection theo page, không load cả collection vào memory worker:
+    - mỗi lần chỉ đọc `page_size` id (kèm field `include` nếu cần), xóa theo batch tối đa `delete_batch_size` id
+    - `on_delete(ids)` chạy sau mỗi batch bị xóa (vd. xóa embedding_states, báo API worker)
+    - tiến độ lưu vào Redis hash `collection_maintenance:<collection>:<job>` sau mỗi page:
+      job bị dừng giữa chừng chạy lại thì tiếp tục từ offset đã lưu, job đã xong chạy lại thì bắt đầu lại từ đầu
+    - `prune` lưu id sắp xóa (field `pending`) cùng offset trước khi xóa, chạy lại thì xóa nốt rồi mới đọc tiếp
+    """
+
+    def __init__(
+        self,
+        collection,
+        redis: Redis,
+        job: str,
+        page_size: int = 1000,
+        delete_batch_size: int = 500,
+        on_delete: Callable[[list[str]], Awaitable[None] | None] = None,
+    ):
+        self.collection = collection
+        self.redis = redis
+        self.job = job
+        self.page_size = page_size
+        self.delete_batch_size = delete_batch_size
+        self.on_delete = on_delete
+        self.key = f"{COLLECTION_MAINTENANCE_KEY}:{collection.name}:{job}"
+
+    async def _call(self, callback, *args):
+        result = callback(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    def _start(self, resume: bool) -> dict:
+        progress = {_decode(field): _decode(value) for field, value in self.redis.hgetall(self.key).items()}
+        if resume and progress.get("status") == "running":
+            progress = {field: int(progress[field]) for field in PROGRESS_FIELDS if field in progress}
+            log.info(f"[CollectionMaintenance] Resuming {self.key} at offset {progress['offset']}")
+        else:
+            self.redis.hdel(self.key, "pending")
+            progress = {
+                "offset": 0,
+                "scanned": 0,
+                "deleted": 0,
+                "total": self.collection.count(),
+                "started_at": int(time.time()),
+            }
+        progress.update({"collection": self.collection.name, "job": self.job, "status": "running"})
+        self._save(progress)
+        return progress
+
+    def _save(self, progress: dict):
+        progress["updated_at"] = int(time.time())
+        self.redis.hset(self.key, mapping=progress)
+
+    def _pending(self) -> list[str]:
+        return json.loads(_decode(self.redis.hget(self.key, "pending")) or "[]")
+
+    def _finish(self, progress: dict) -> dict:
+        progress["status"] = "done"
+        self._save(progress)
+        log.info(
+            f"[CollectionMaintenance] {self.collection.name} {self.job} done: "
+            f"scanned {progress['scanned']}, deleted {progress['deleted']}"
+        )
+        return progress
+
+    def _report(self, progress: dict):
+        self._save(progress)
+        log.info(
+            f"[CollectionMaintenance] {self.collection.name} {self.job}: "
+            f"scanned {progress['scanned']}/{progress['total']}, deleted {progress['deleted']}"
+        )
+
+    async def delete(self, ids: list[str]) -> int:
+        for start in range(0, len(ids), self.delete_batch_size):
+            batch = ids[start:start + self.delete_batch_size]
+            self.collection.delete(ids=batch)
+            if self.on_delete is not None:
+                await self._call(self.on_delete, batch)
+        return len(ids)
+
+    async def delete_where(self, where: dict = None, resume: bool = True) -> dict:
+        """
+        Xóa document khớp `where` (không có `where` là xóa trắng collection).
+        Document đã xóa không còn được trả về nên luôn đọc page đầu của phần còn lại, chạy lại là tự tiếp tục.
+        """
+        progress = self._start(resume)
+        previous = None
+        while ids := self.collection.get(where=where, include=[], limit=self.page_size)["ids"]:
+            if ids == previous:
+                raise RuntimeError(f"Collection {self.collection.name} still returns {len(ids)} deleted documents")
+            previous = ids
+            progress["scanned"] += len(ids)
+            progress["deleted"] += await self.delete(ids)
+            self._report(progress)
+        return self._finish(progress)
+
+    async def prune(
+        self,
+        select: Callable[[dict], Awaitable[list[str]] | list[str]],
+        include: list[str] = None,
+        resume: bool = True,
+    ) -> dict:
+        """
+        Quét toàn bộ collection theo page từ offset đã lưu, `select(page)` trả về id cần xóa trong page
+        (vd. document không còn row trong DB). Document bị xóa làm các document sau dồn lên,
+        nên offset chỉ tăng theo số document còn giữ lại.
+        Offset mới được lưu cùng danh sách id sắp xóa trước khi xóa: dừng giữa chừng thì lần chạy sau xóa nốt
+        các id đó (xóa lại id đã xóa không lỗi) để offset đã lưu đúng với collection trước khi đọc page tiếp.
+        """
+        progress = self._start(resume)
+        if pending := self._pending():
+            log.info(f"[CollectionMaintenance] Finishing {len(pending)} deletes of {self.key} before resuming")
+            await self.delete(pending)
+            self.redis.hdel(self.key, "pending")
+        while True:
+            page = self.collection.get(include=include or [], limit=self.page_size, offset=progress["offset"])
+            if not page["ids"]:
+                break
+            ids = list(await self._call(select, page))
+            progress["offset"] += len(page["ids"]) - len(ids)
+            progress["scanned"] += len(page["ids"])
+            progress["deleted"] += len(ids)
+            if ids:
+                self._save({**progress, "pending": json.dumps(ids)})
+                await self.delete(ids)
+                self.redis.hdel(self.key, "pending")
+            self._report(progress)
+        return self._finish(progress)
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI, APIConnectionError, APITimeoutError
+
+from src.utils.common import estimate_tokens
+from src.tools.rate_limiter import rate_limit_exceeded, unwrap_rate_limit
+from src.tools.telemetry import tracer
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+
+def is_retryable(error: Exception) -> bool:
+    # rate limiter local đã chờ hết max_wait, retry ngay chỉ chiếm thêm bucket
+    if rate_limit_exceeded(error) is not None:
+        return False
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        return isinstance(error, (APIConnectionError, APITimeoutError))
+    return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Thời gian chờ provider yêu cầu (header retry-after-ms / retry-after dạng số giây)."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class EmbeddingPipeline:
+    """
+    Embed text cho các batch của embedding queue (celery worker), theo pipeline:
+    - text của nhiều batch được gom thành request theo tổng token ước lượng (`max_tokens`, `max_inputs`),
+      request đầy thì gửi ngay; không có request nào đang chạy thì gửi luôn phần đang gom, nên lúc ít job
+      không phải chờ đầy request, lúc đông thì text mới được gom trong khi chờ request trước.
+    - tối đa `concurrency` request chạy cùng lúc trong thread pool (client openai sync),
+      event loop vẫn rảnh để ghi chroma cho batch đã embed xong.
+    - lỗi 429/5xx/timeout gửi lại với exponential backoff + jitter, ưu tiên header retry-after của provider.
+    - text cùng key (content hash) đã/đang embed thì dùng chung future.
+    """
+
+    def __init__(
+        self,
+        client: OpenAI,
+        model: str,
+        concurrency: int = 4,
+        max_tokens: int = 200_000,
+        max_inputs: int = 2048,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        # SDK cũng retry, để backoff ở đây quyết định thời gian chờ
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_inputs = max_inputs
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding")
+        self._futures: dict[str, asyncio.Future] = {}
+        self._pack: list[tuple[str, str]] = []
+        self._pack_tokens = 0
+        self._inflight = set()
+        self.stats = {"requests": 0, "texts": 0, "tokens": 0, "retries": 0, "errors": 0}
+
+    def submit(self, texts: dict[str, str]) -> dict[str, asyncio.Future]:
+        """`texts` là {key: text}, trả về future của vector cho từng key."""
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key, text in texts.items():
+            if key not in self._futures:
+                tokens = estimate_tokens(text)
+                if self._pack and (
+                    self._pack_tokens + tokens > self.max_tokens or len(self._pack) >= self.max_inputs
+                ):
+                    self.flush()
+                self._futures[key] = loop.create_future()
+                self._pack.append((key, text))
+                self._pack_tokens += tokens
+            futures[key] = self._futures[key]
+        if not self._inflight:
+            self.flush()
+        return futures
+
+    def flush(self):
+        pack, tokens = self._pack, self._pack_tokens
+        self._pack, self._pack_tokens = [], 0
+        if not pack:
+            return
+        task = asyncio.create_task(self._send(pack, tokens))
+        self._inflight.add(task)
+        task.add_done_callback(self._on_sent)
+
+    def _on_sent(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        # phần gom được trong lúc chờ không phải đợi tới khi đầy request
+        if not self._inflight:
+            self.flush()
+
+    async def _send(self, pack: list[tuple[str, str]], tokens: int):
+        texts = [text for _, text in pack]
+        with tracer.start_as_current_span(
+            "embedding.embed", attributes={"embedding.texts": len(texts), "embedding.tokens": tokens}
+        ):
+            try:
+                vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self._embed, texts)
+            except Exception as e:
+                self.stats["errors"] += 1
+                log.error(f"[EmbeddingPipeline] Request of {len(texts)} texts failed: {e}")
+                for key, _ in pack:
+                    # bỏ future lỗi để lần sau (batch được claim lại) embed lại
+                    self._futures.pop(key).set_exception(e)
+                return
+        self.stats["requests"] += 1
+        self.stats["texts"] += len(texts)
+        self.stats["tokens"] += tokens
+        for (key, _), vector in zip(pack, vectors):
+            self._futures[key].set_result(vector)
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        """Chạy trong thread pool, sleep khi backoff chỉ giữ một slot của pool."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with unwrap_rate_limit():
+                    response = self.client.embeddings.create(model=self.model, input=texts)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+                self.stats["retries"] += 1
+                log.warning(f"[EmbeddingPipeline] {e.__class__.__name__}, retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+
+    async def close(self):
+        self.flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        self.executor.shutdown(wait=False)
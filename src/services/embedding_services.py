@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import logging
+import time
+import unicodedata
+from collections import OrderedDict, deque
+
+from openai import AsyncOpenAI
+from redis.asyncio import Redis
+
+from src.services.quantization_services import encode_vector, decode_vector
+from src.tools.rate_limiter import unwrap_rate_limit
+from src.utils.common import percentile
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+BATCH_STATS_WINDOW = 1000
+
+
+class EmbeddingBatcher:
+    """
+    Gom các request embedding đồng thời trong API process thành một lần gọi `embeddings.create`.
+    - Request đầu tiên mở một cửa sổ `max_wait_ms`, hết cửa sổ hoặc đủ `max_batch_size` thì gửi batch.
+    - Text trùng nhau trong cùng batch chỉ embed một lần.
+    - Caller bị hủy (vd. speculative retrieval) thì kết quả của nó bị bỏ, không ảnh hưởng caller khác.
+    """
+
+    def __init__(self, client: AsyncOpenAI, model: str, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.client = client
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending: list[tuple[str, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._inflight = set()
+        self.batch_sizes = deque(maxlen=BATCH_STATS_WINDOW)
+        self.queue_delays = deque(maxlen=BATCH_STATS_WINDOW)
+        self.stats = {"requests": 0, "batches": 0, "deduplicated": 0, "errors": 0}
+
+    async def embed(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        self.stats["requests"] += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future, float]]):
+        # caller đã hủy trong lúc chờ thì không cần embed nữa
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+        sent_at = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.stats["batches"] += 1
+        self.stats["deduplicated"] += len(batch) - len(texts)
+        self.batch_sizes.append(len(batch))
+        self.queue_delays.extend((sent_at - enqueued_at) * 1000 for _, _, enqueued_at in batch)
+        try:
+            with unwrap_rate_limit():
+                response = await self.client.embeddings.create(model=self.model, input=texts)
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.error(f"[EmbeddingBatcher] Batch of {len(texts)} texts failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        vectors = {texts[item.index]: item.embedding for item in response.data}
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "mean_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+            "max_batch_size": max(self.batch_sizes) if self.batch_sizes else 0,
+            "queue_delay_ms_p50": percentile(self.queue_delays, 0.5),
+            "queue_delay_ms_p95": percentile(self.queue_delays, 0.95),
+        }
+
+
+def embedding_cache_text(text: str) -> str:
+    """Chuẩn hóa nhẹ để làm key (không bỏ dấu vì dấu tiếng Việt đổi nghĩa câu)."""
+    return " ".join(unicodedata.normalize("NFC", text).lower().split())
+
+
+class EmbeddingCache:
+    """
+    Cache embedding theo (model, text đã chuẩn hóa), hai tầng:
+    - LRU in-process lưu bytes đã lượng tử hóa (float16 mặc định, int8 kèm scale), evict theo tổng bytes.
+    - Redis lưu cùng bytes đó (không phải JSON list) để các worker dùng chung, có TTL.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        model: str,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        ttl: int = 7 * 24 * 3600,
+        dtype: str = "float16",
+        prefix: str = "embedding",
+    ):
+        self.redis = redis
+        self.model = model
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        self.dtype = dtype
+        self.prefix = prefix
+        self._lru: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_bytes = 0
+        self.stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model}\x00{embedding_cache_text(text)}".encode()).hexdigest()
+        return f"{self.prefix}:{self.dtype}:{digest}"
+
+    def _remember(self, key: str, data: bytes):
+        if key in self._lru:
+            self.memory_bytes -= len(self._lru.pop(key))
+        self._lru[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_memory_bytes and self._lru:
+            _, evicted = self._lru.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _to_list(self, data: bytes) -> list[float]:
+        return decode_vector(data, self.dtype).tolist()
+
+    async def get(self, text: str) -> list[float] | None:
+        key = self.key(text)
+        data = self._lru.get(key)
+        if data is not None:
+            self._lru.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return self._to_list(data)
+
+        try:
+            data = await self.redis.get(key)
+        except Exception as e:
+            log.error(f"[EmbeddingCache] Redis get failed: {e}")
+            data = None
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+
+        self._remember(key, data)
+        self.stats["redis_hits"] += 1
+        return self._to_list(data)
+
+    async def set(self, text: str, embedding: list[float]):
+        key = self.key(text)
+        data = encode_vector(embedding, self.dtype)
+        self._remember(key, data)
+        self.stats["stores"] += 1
+        try:
+            await self.redis.set(key, data, ex=self.ttl)
+        except Exception as e:
+            log.error(f"[EmbeddingCache] Redis set failed: {e}")
+
+    def metrics(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["redis_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "items": len(self._lru),
+            "memory_bytes": self.memory_bytes,
+        }
@@ -0,0 +1,86 @@
+import logging
+from uuid import uuid4
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from src.models.embedding_models import EmbeddingState
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class EmbeddingStateStore:
+    """
+    Hash của text đã embed cho mỗi entity trong một chroma collection.
+    Chỉ embed lại khi hash hoặc embedding model thay đổi, `updated_at` là thời điểm kiểm tra gần nhất.
+    """
+
+    def __init__(self, session: AsyncSession, collection: str, model: str):
+        self.session = session
+        self.collection = collection
+        self.model = model
+
+    async def get_hashes(self, entity_ids: list[str]) -> dict[str, str]:
+        """Hash đã embed bằng model hiện tại (state của model cũ coi như chưa embed)."""
+        if not entity_ids:
+            return {}
+        results = await self.session.execute(
+            select(EmbeddingState.entity_id, EmbeddingState.content_hash).where(
+                EmbeddingState.collection == self.collection,
+                EmbeddingState.model == self.model,
+                EmbeddingState.entity_id.in_(entity_ids),
+            )
+        )
+        return {str(entity_id): content_hash for entity_id, content_hash in results.all()}
+
+    async def save(self, hashes: dict[str, str]):
+        if not hashes:
+            return
+        stmt = insert(EmbeddingState).values([
+            {
+                "id": uuid4(),
+                "entity_id": entity_id,
+                "collection": self.collection,
+                "content_hash": content_hash,
+                "model": self.model,
+            }
+            for entity_id, content_hash in hashes.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_embedding_state_entity_collection",
+            set_={
+                "content_hash": stmt.excluded.content_hash,
+                "model": stmt.excluded.model,
+                "updated_at": func.now(),
+            },
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+    async def touch(self, entity_ids: list[str]):
+        """Đánh dấu đã kiểm tra, text không đổi nên lần quét incremental sau bỏ qua."""
+        if not entity_ids:
+            return
+        await self.session.execute(
+            update(EmbeddingState)
+            .where(EmbeddingState.collection == self.collection, EmbeddingState.entity_id.in_(entity_ids))
+            .values(updated_at=func.now())
+        )
+        await self.session.commit()
+
+    async def delete(self, entity_ids: list[str]):
+        if not entity_ids:
+            return
+        await self.session.execute(
+            delete(EmbeddingState)
+            .where(EmbeddingState.collection == self.collection, EmbeddingState.entity_id.in_(entity_ids))
+        )
+        await self.session.commit()
+
+    async def clear(self):
+        """Xóa state của collection (khi collection bị xóa trắng) để lần quét sau embed lại toàn bộ."""
+        await self.session.execute(delete(EmbeddingState).where(EmbeddingState.collection == self.collection))
+        await self.session.commit()
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+
+from src.utils.common import estimate_tokens
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+CHAT_HISTORY_KEY = "chat:history:{session_id}"
+CHAT_SUMMARY_KEY = "chat:summary:{session_id}"
+CHAT_SUMMARY_LOCK_KEY = "chat:summary:lock:{session_id}"
+# chi phí cố định của mỗi message (role, separator) trong prompt
+MESSAGE_TOKEN_OVERHEAD = 4
+SUMMARY_PROMPT = """
+    Tóm tắt ngắn gọn cuộc trò chuyện giữa khách hàng và chatbot cửa hàng dưới đây bằng tiếng Việt.
+    Giữ lại sản phẩm khách đã hỏi, nhu cầu, ngân sách, các lựa chọn đã được tư vấn và câu hỏi còn bỏ ngỏ.
+    Tóm tắt trước đó (nếu có):
+    {previous_summary}
+    Các message mới cần gộp vào tóm tắt:
+    {messages}
+"""
+
+
+class ChatHistoryStore:
+    """
+    Lưu chat history theo session trong Redis list, mỗi phần tử là một message JSON.
+    - Ghi: RPUSH + LTRIM nên list không vượt quá `max_stored_items`.
+    - Đọc: LRANGE N phần tử cuối, chi phí chỉ phụ thuộc N chứ không phụ thuộc tổng traffic.
+    """
+
+    def __init__(self, redis: Redis, max_items: int = 100, max_stored_items: int = 1000, ttl: int = 30 * 24 * 3600):
+        self.redis = redis
+        self.max_items = max_items
+        self.max_stored_items = max_stored_items
+        self.ttl = ttl
+
+    def key(self, session_id: str) -> str:
+        return CHAT_HISTORY_KEY.format(session_id=session_id)
+
+    @staticmethod
+    def build_message(role: str, content: str, created_at: float = None, **extra) -> dict:
+        return {"type": role, "content": content, "created_at": created_at or time.time(), **extra}
+
+    async def append(self, session_id: str, *messages: dict):
+        """Thêm message theo đúng thứ tự truyền vào."""
+        if not messages:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self.queue_append(pipe, session_id, *messages)
+            await pipe.execute()
+
+    def queue_append(self, pipe, session_id: str, *messages: dict):
+        """Như `append` nhưng ghi vào pipeline của caller, để gộp nhiều session cùng state khác trong một transaction."""
+        key = self.key(session_id)
+        pipe.rpush(key, *[json.dumps(message, ensure_ascii=False) for message in messages])
+        pipe.ltrim(key, -self.max_stored_items, -1)
+        pipe.expire(key, self.ttl)
+
+    async def last(self, session_id: str, limit: int = None) -> list[dict]:
+        """Lấy tối đa `limit` message gần nhất, sắp xếp từ cũ đến mới."""
+        limit = limit or self.max_items
+        items = await self.redis.lrange(self.key(session_id), -limit, -1)
+        return [json.loads(item) for item in items]
+
+    async def length(self, session_id: str) -> int:
+        return await self.redis.llen(self.key(session_id))
+
+    async def clear(self, session_id: str):
+        await self.redis.delete(self.key(session_id))
+
+    async def get_summary(self, session_id: str) -> dict | None:
+        data = await self.redis.hgetall(CHAT_SUMMARY_KEY.format(session_id=session_id))
+        if not data:
+            return None
+        data = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v for k, v in data.items()}
+        return {"summary": data["summary"], "until": float(data["until"])}
+
+    async def set_summary(self, session_id: str, summary: str, until: float):
+        """Lưu rolling summary cạnh history, `until` là created_at của message cuối đã được tóm tắt."""
+        key = CHAT_SUMMARY_KEY.format(session_id=session_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"summary": summary, "until": until})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content", "")) + MESSAGE_TOKEN_OVERHEAD
+
+
+class HistoryCompactor:
+    """
+    Giữ prompt history trong một token budget cố định.
+    - Lấy message mới nhất cho tới khi hết budget.
+    - Phần cũ hơn được thay bằng rolling summary lưu trong Redis cạnh history của session.
+    - Summary được refresh ở background khi phần chưa tóm tắt đủ `refresh_min_tokens`.
+    """
+
+    def __init__(
+        self,
+        history_store: ChatHistoryStore,
+        summarizer: Callable[[list[dict]], Awaitable[str]] = None,
+        refresh_min_tokens: int = 500,
+        lock_ttl: int = 60,
+    ):
+        self.history_store = history_store
+        self.summarizer = summarizer
+        self.refresh_min_tokens = refresh_min_tokens
+        self.lock_ttl = lock_ttl
+        self._background_tasks = set()
+
+    async def load(self, session_id: str, limit: int = None) -> dict:
+        messages, summary = await asyncio.gather(
+            self.history_store.last(session_id, limit),
+            self.history_store.get_summary(session_id),
+        )
+        return {"session_id": session_id, "messages": messages, "summary": summary}
+
+    def split(self, history: dict, budget: int) -> tuple[list[dict], list[dict]]:
+        """Chia history thành (phần bị bỏ, phần giữ lại) sao cho phần giữ lại + summary nằm trong budget."""
+        messages = history["messages"]
+        if sum(message_tokens(m) for m in messages) <= budget:
+            return [], messages
+
+        summary = history["summary"]
+        remaining = budget - (estimate_tokens(summary["summary"]) + MESSAGE_TOKEN_OVERHEAD if summary else 0)
+        kept = []
+        for message in reversed(messages):
+            cost = message_tokens(message)
+            if cost > remaining:
+                break
+            kept.append(message)
+            remaining -= cost
+        kept.reverse()
+        return messages[:len(messages) - len(kept)], kept
+
+    def compact(self, history: dict, budget: int) -> list[dict]:
+        """Trả về message list (role human/ai/system) nằm trong `budget` token."""
+        dropped, kept = self.split(history, budget)
+        result = []
+        if dropped and history["summary"]:
+            result.append({
+                "role": "system",
+                "content": f"Tóm tắt cuộc trò chuyện trước đó:\n{history['summary']['summary']}"
+            })
+        result += [{"role": m.get("type", "human"), "content": m.get("content", "")} for m in kept]
+        log.debug(f"[History] Compacted {len(history['messages'])} messages to {len(result)} within {budget} tokens")
+        return result
+
+    def schedule_refresh(self, history: dict, budget: int):
+        """Tạo task refresh summary nếu phần bị bỏ chưa được tóm tắt đủ lớn, không chặn request hiện tại."""
+        if not self.summarizer:
+            return
+        dropped, _ = self.split(history, budget)
+        until = history["summary"]["until"] if history["summary"] else 0
+        pending = [m for m in dropped if m.get("created_at", 0) > until]
+        if sum(message_tokens(m) for m in pending) < self.refresh_min_tokens:
+            return
+        task = asyncio.create_task(self.refresh_summary(history["session_id"], pending, history["summary"]))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def drain(self):
+        """Chờ các task refresh summary đang chạy (dùng khi shutdown / kết thúc benchmark)."""
+        if self._background_tasks:
+            await asyncio.gather(*list(self._background_tasks), return_exceptions=True)
+
+    async def refresh_summary(self, session_id: str, pending: list[dict], previous: dict | None):
+        lock_key = CHAT_SUMMARY_LOCK_KEY.format(session_id=session_id)
+        if not await self.history_store.redis.set(lock_key, 1, nx=True, ex=self.lock_ttl):
+            return
+        try:
+            prompt = SUMMARY_PROMPT.format(
+                previous_summary=previous["summary"] if previous else "",
+                messages="\n".join(f"{m.get('type', 'human')}: {m.get('content', '')}" for m in pending),
+            )
+            summary = await self.summarizer([{"role": "human", "content": prompt}])
+            await self.history_store.set_summary(session_id, summary, pending[-1].get("created_at", time.time()))
+            log.info(f"[History] Refreshed summary for session {session_id} with {len(pending)} messages")
+        except Exception as e:
+            log.error(f"[History] Failed to refresh summary for session {session_id}: {e}")
+        finally:
+            await self.history_store.redis.delete(lock_key)
@@ -0,0 +1,202 @@
+import logging
+import re
+import unicodedata
+from collections import deque
+
+from src.utils.common import normalize_text
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Từ khóa chung thể hiện ý định hỏi về sản phẩm (đã bỏ dấu), điểm âm là dấu hiệu small talk
+PRODUCT_INTENT_HINTS = {
+    # "gia" một mình trùng "gia đình", "tham gia" sau khi bỏ dấu, chỉ tính khi đi kèm từ khác (hoặc có dấu, xem bên dưới)
+    "gia bao nhieu": 2.0,
+    "gia ban": 2.0,
+    "gia re": 2.0,
+    "bang gia": 2.0,
+    "bao nhieu tien": 2.0,
+    "mua": 2.0,
+    "dat hang": 2.0,
+    "tra gop": 2.0,
+    "bao hanh": 2.0,
+    "con hang": 2.0,
+    "giam gia": 2.0,
+    "khuyen mai": 1.5,
+    "dien thoai": 3.0,
+    "smartphone": 3.0,
+    "laptop": 3.0,
+    "may tinh": 2.0,
+    "may tinh bang": 3.0,
+    "tablet": 3.0,
+    "tai nghe": 3.0,
+    "dong ho": 2.0,
+    "cau hinh": 2.0,
+    "thong so": 2.0,
+    "so sanh": 1.5,
+    "san pham": 2.0,
+    "pin": 1.5,
+    "camera": 1.5,
+    "man hinh": 1.5,
+    "ram": 1.5,
+    "chip": 1.5,
+    "bo nho": 1.5,
+    "dung luong": 1.5,
+    "mau sac": 1.0,
+    "phien ban": 1.0,
+    "xin chao": -2.0,
+    "chao ban": -2.0,
+    "hello": -2.0,
+    "cam on": -2.0,
+    "tam biet": -2.0,
+    "ban la ai": -2.0,
+    "ban ten gi": -2.0,
+    "thoi tiet": -3.0,
+    "ke chuyen": -3.0,
+    "haha": -1.0,
+}
+# Từ khóa chỉ rõ nghĩa khi còn dấu ("giá" khác "gia đình", "màu" khác "mau lên", "rẻ" khác "rẽ"), khớp trên text giữ dấu
+ACCENTED_PRODUCT_INTENT_HINTS = {
+    "giá": 2.0,
+    "màu": 1.0,
+    "rẻ": 1.0,
+}
+# số đi kèm đơn vị kỹ thuật / giá tiền: "128gb", "5000 mah", "10 trieu", "15tr"
+SPEC_PATTERN = re.compile(r"\b\d+([.,]\d+)?\s*(gb|tb|mah|inch|hz|mp|w|tr|trieu|k|nghin|d|vnd)\b")
+SPEC_SCORE = 2.0
+
+PRODUCT_SCORE_THRESHOLD = 2.0
+SMALL_TALK_SCORE_THRESHOLD = -1.0
+
+
+class AhoCorasick:
+    """Automaton Aho-Corasick tìm tất cả keyword trong một lần duyệt text."""
+
+    def __init__(self, keywords: list[str] = None):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in keywords or []:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword: str):
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            if ch not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.output[state].append(keyword)
+
+    def build(self):
+        queue = deque()
+        for state in self.goto[0].values():
+            self.fail[state] = 0
+            queue.append(state)
+        while queue:
+            current = queue.popleft()
+            for ch, nxt in self.goto[current].items():
+                queue.append(nxt)
+                fallback = self.fail[current]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def iter_matches(self, text: str):
+        """Yield (start, end, keyword) cho mỗi keyword xuất hiện trong text."""
+        state = 0
+        for idx, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for keyword in self.output[state]:
+                yield idx - len(keyword) + 1, idx + 1, keyword
+
+    def find_words(self, text: str) -> set[str]:
+        """Chỉ giữ các match trọn từ, tránh "ram" khớp trong "program"."""
+        found = set()
+        for start, end, keyword in self.iter_matches(text):
+            before = text[start - 1] if start > 0 else " "
+            after = text[end] if end < len(text) else " "
+            if not before.isalnum() and not after.isalnum():
+                found.add(keyword)
+        return found
+
+
+class ProductIntentClassifier:
+    """
+    Phân loại query có liên quan sản phẩm hay không mà không cần gọi LLM.
+    - Khớp tên brand/category/tag/product/variant trong catalog -> chắc chắn là product query.
+    - Không khớp thì chấm điểm theo từ khóa chung, chỉ khi điểm lơ lửng mới trả về None để escalate lên LLM.
+    """
+
+    def __init__(
+        self,
+        product_threshold: float = PRODUCT_SCORE_THRESHOLD,
+        small_talk_threshold: float = SMALL_TALK_SCORE_THRESHOLD,
+    ):
+        self.product_threshold = product_threshold
+        self.small_talk_threshold = small_talk_threshold
+        self.hint_matcher = AhoCorasick(list(PRODUCT_INTENT_HINTS.keys()))
+        self.accented_hint_matcher = AhoCorasick(list(ACCENTED_PRODUCT_INTENT_HINTS.keys()))
+        self.catalog_matcher = AhoCorasick()
+        self._catalog_signature = None
+        self.stats = {"total": 0, "catalog_match": 0, "scored_product": 0, "scored_other": 0, "escalated": 0}
+
+    def update_keywords(self, keywords: list[str]):
+        """Build lại automaton khi danh sách keyword của catalog thay đổi."""
+        signature = hash(tuple(keywords))
+        if signature == self._catalog_signature:
+            return
+        normalized = {normalize_text(keyword) for keyword in keywords if keyword}
+        self.catalog_matcher = AhoCorasick(sorted(k for k in normalized if len(k) > 1))
+        self._catalog_signature = signature
+        log.info(f"[Intent] Built catalog matcher with {len(normalized)} keywords")
+
+    def score(self, normalized_query: str, query: str = "") -> float:
+        hints = self.hint_matcher.find_words(normalized_query)
+        score = sum(PRODUCT_INTENT_HINTS[hint] for hint in hints)
+        accented_query = re.sub(r"\s+", " ", unicodedata.normalize("NFC", query).lower())
+        accented_hints = self.accented_hint_matcher.find_words(accented_query)
+        score += sum(ACCENTED_PRODUCT_INTENT_HINTS[hint] for hint in accented_hints)
+        if SPEC_PATTERN.search(normalized_query):
+            score += SPEC_SCORE
+        return score
+
+    def classify(self, query: str, keywords: list[str] = None) -> bool | None:
+        """True/False nếu chắc chắn, None nếu mơ hồ và cần hỏi LLM."""
+        if keywords is not None:
+            self.update_keywords(keywords)
+        self.stats["total"] += 1
+        normalized_query = normalize_text(query)
+
+        matched = self.catalog_matcher.find_words(normalized_query)
+        if matched:
+            self.stats["catalog_match"] += 1
+            log.debug(f"[Intent] Catalog keywords matched: {matched}")
+            return True
+
+        score = self.score(normalized_query, query)
+        log.debug(f"[Intent] Query score: {score}")
+        if score >= self.product_threshold:
+            self.stats["scored_product"] += 1
+            return True
+        if score <= self.small_talk_threshold:
+            self.stats["scored_other"] += 1
+            return False
+
+        self.stats["escalated"] += 1
+        return None
+
+    def metrics(self) -> dict:
+        total = self.stats["total"]
+        return {
+            **self.stats,
+            "escalation_rate": self.stats["escalated"] / total if total else 0.0,
+        }
@@ -0,0 +1,88 @@
+import logging
+import math
+from collections import Counter
+from typing import Callable
+
+from src.utils.common import tokenize
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class BM25Index:
+    """
+    Inverted index BM25 in-process cho product text.
+    Text được chuẩn hóa (lowercase, bỏ dấu tiếng Việt) trước khi tách term,
+    nên "điện thoại" và "dien thoai" cho cùng kết quả.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, dict[str, int]] = {}
+        self.doc_lengths: dict[str, int] = {}
+        self.documents: dict[str, str] = {}
+        self.metadatas: dict[str, dict] = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self.doc_lengths
+
+    def add(self, doc_id: str, text: str, metadata: dict = None):
+        """Thêm hoặc cập nhật document (incremental, không cần rebuild toàn bộ index)."""
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(terms.values())
+        self.doc_lengths[doc_id] = length
+        self.documents[doc_id] = text
+        self.metadatas[doc_id] = metadata or {}
+        self.total_length += length
+
+    def add_many(self, ids: list[str], documents: list[str], metadatas: list[dict] = None):
+        metadatas = metadatas or [None] * len(ids)
+        for doc_id, text, metadata in zip(ids, documents, metadatas):
+            self.add(doc_id, text, metadata)
+
+    def remove(self, doc_id: str):
+        if doc_id not in self.doc_lengths:
+            return
+        for term in set(tokenize(self.documents[doc_id])):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        self.documents.pop(doc_id, None)
+        self.metadatas.pop(doc_id, None)
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, {}))
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def search(
+        self, query: str, limit: int = 5, doc_filter: Callable[[dict], bool] = None
+    ) -> list[tuple[str, float]]:
+        """Trả về [(doc_id, bm25_score)] theo score giảm dần, `doc_filter` lọc theo metadata trước khi xếp hạng."""
+        if not self.doc_lengths:
+            return []
+        avgdl = self.total_length / len(self.doc_lengths)
+        scores: dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in posting.items():
+                if doc_filter and not doc_filter(self.metadatas[doc_id]):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
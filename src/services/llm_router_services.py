@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable
+
+from src.tools.rate_limiter import rate_limit_exceeded
+from src.tools.telemetry import tracer
+from src.utils.common import percentile
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+LATENCY_WINDOW = 200
+# cần đủ sample mới tin p95, trước đó hedge theo `hedge_delay` cố định
+MIN_LATENCY_SAMPLES = 20
+
+
+class LLMUnavailableError(Exception):
+    """Không provider nào trả lời được (lỗi, quá deadline hoặc circuit đang mở)."""
+
+
+class CircuitBreaker:
+    """
+    - closed: gọi bình thường, lỗi liên tiếp đủ `failure_threshold` thì mở.
+    - open: bỏ qua provider trong `recovery_timeout` giây.
+    - half_open: cho đúng một request thử, thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CIRCUIT_CLOSED
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return CIRCUIT_HALF_OPEN
+        return CIRCUIT_OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CIRCUIT_CLOSED:
+            return True
+        if state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release(self):
+        """Request thử bị hủy (thua hedge) thì không tính là lỗi hay thành công."""
+        self._probe_in_flight = False
+
+
+class Provider:
+    def __init__(self, name: str, client, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.client = client
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.first_token_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {
+            "calls": 0, "successes": 0, "failures": 0, "timeouts": 0, "cancelled": 0, "skipped": 0, "rate_limited": 0
+        }
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "state": self.breaker.state,
+            "latency_p50": percentile(self.latencies, 0.5),
+            "latency_p95": percentile(self.latencies, 0.95),
+            "first_token_p95": percentile(self.first_token_latencies, 0.95),
+        }
+
+
+class LLMRouter:
+    """
+    Gọi các LLM provider (OpenAiClient, GeminiClient) theo thứ tự ưu tiên:
+    - Mỗi lần gọi có deadline, quá hạn thì tính là lỗi và chuyển provider tiếp theo.
+    - Provider lỗi liên tiếp bị circuit breaker bỏ qua, request sau không phải chờ timeout nữa.
+    - Bật `hedging` thì khi provider đầu chậm hơn p95 của nó, gửi song song sang provider kế tiếp
+      và lấy kết quả về trước, request còn lại bị hủy.
+    """
+
+    def __init__(
+        self,
+        providers: list[tuple[str, object]],
+        timeout: float = 20.0,
+        first_token_timeout: float = 10.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        hedging: bool = False,
+        hedge_delay: float = 3.0,
+    ):
+        self.providers = [Provider(name, client, failure_threshold, recovery_timeout) for name, client in providers]
+        self.timeout = timeout
+        self.first_token_timeout = first_token_timeout
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+        self.stats = {"requests": 0, "hedged": 0, "fallbacks": 0, "unavailable": 0}
+
+    def available_providers(self) -> list[Provider]:
+        available = []
+        for provider in self.providers:
+            if provider.breaker.allow():
+                available.append(provider)
+            else:
+                provider.stats["skipped"] += 1
+        return available
+
+    def _hedge_after(self, samples) -> float:
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return self.hedge_delay
+        return percentile(samples, 0.95)
+
+    async def _guarded(self, provider: Provider, call: Callable[[Provider], Awaitable], timeout: float, samples: deque):
+        provider.stats["calls"] += 1
+        started = time.monotonic()
+        with tracer.start_as_current_span(f"llm.{provider.name}", attributes={"llm.deadline": timeout}) as span:
+            try:
+                result = await asyncio.wait_for(call(provider), timeout)
+            except asyncio.CancelledError:
+                provider.stats["cancelled"] += 1
+                provider.breaker.release()
+                span.set_attribute("llm.outcome", "cancelled")
+                raise
+            except asyncio.TimeoutError:
+                provider.stats["timeouts"] += 1
+                provider.stats["failures"] += 1
+                provider.breaker.record_failure()
+                span.set_attribute("llm.outcome", "timeout")
+                log.warning(f"[LLMRouter] {provider.name} exceeded deadline {timeout}s")
+                raise
+            except Exception as e:
+                if rate_limit_exceeded(e) is not None:
+                    # rate limiter local từ chối, provider chưa nhận request: chuyển provider khác, không tính lỗi
+                    provider.stats["rate_limited"] += 1
+                    provider.breaker.release()
+                    span.set_attribute("llm.outcome", "rate_limited")
+                    log.warning(f"[LLMRouter] {provider.name} rate limited locally: {e}")
+                    raise
+                provider.stats["failures"] += 1
+                provider.breaker.record_failure()
+                span.set_attribute("llm.outcome", "error")
+                log.warning(f"[LLMRouter] {provider.name} failed: {e}")
+                raise
+            span.set_attribute("llm.outcome", "ok")
+        samples.append(time.monotonic() - started)
+        provider.stats["successes"] += 1
+        provider.breaker.record_success()
+        return result
+
+    async def _race(
+        self,
+        call: Callable[[Provider], Awaitable],
+        timeout: float,
+        samples_of: Callable[[Provider], deque],
+        discard: Callable[[object], Awaitable] = None,
+    ):
+        """
+        Chạy `call` trên provider đầu tiên, lỗi thì chuyển provider kế tiếp,
+        chậm quá ngưỡng hedge thì chạy thêm provider kế tiếp song song. Trả về (provider, result).
+        `discard` dọn kết quả của provider về sau (vd. đóng stream) khi hai provider xong cùng lúc.
+        """
+        self.stats["requests"] += 1
+        candidates = self.available_providers()
+        if not candidates:
+            self.stats["unavailable"] += 1
+            raise LLMUnavailableError("All LLM providers are unavailable (circuit open)")
+
+        pending: dict[asyncio.Task, Provider] = {}
+        errors = []
+        next_idx = 0
+        last_launched = None
+
+        def launch():
+            nonlocal next_idx, last_launched
+            provider = candidates[next_idx]
+            next_idx += 1
+            last_launched = provider
+            task = asyncio.create_task(self._guarded(provider, call, timeout, samples_of(provider)))
+            pending[task] = provider
+
+        launch()
+        try:
+            while pending:
+                can_hedge = self.hedging and next_idx < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self._hedge_after(samples_of(last_launched)) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    self.stats["hedged"] += 1
+                    log.info(f"[LLMRouter] {last_launched.name} is slow, hedging to {candidates[next_idx].name}")
+                    launch()
+                    continue
+                winner = None
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(f"{provider.name}: {task.exception()!r}")
+                    elif winner is None:
+                        winner = provider, task.result()
+                    elif discard:
+                        await discard(task.result())
+                if winner:
+                    return winner
+                if not pending and next_idx < len(candidates):
+                    self.stats["fallbacks"] += 1
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            # half-open breaker đã cho phép probe nhưng request không dùng tới
+            for provider in candidates[next_idx:]:
+                provider.breaker.release()
+
+        raise LLMUnavailableError("; ".join(errors))
+
+    async def chat(self, messages) -> str:
+        _, response = await self._race(
+            lambda provider: provider.client.chat(messages),
+            self.timeout,
+            lambda provider: provider.latencies,
+        )
+        return response
+
+    async def chat_stream(self, messages) -> AsyncIterator[str]:
+        """
+        Deadline/hedge áp dụng cho token đầu tiên, sau đó stream tiếp từ provider thắng.
+        Lỗi giữa chừng thì raise luôn vì client đã nhận một phần câu trả lời.
+        """
+        async def first_token(provider: Provider):
+            stream = provider.client.chat_stream(messages)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close(result):
+            await result[0].aclose()
+
+        provider, (stream, token) = await self._race(
+            first_token,
+            self.first_token_timeout,
+            lambda provider: provider.first_token_latencies,
+            discard=close,
+        )
+        if token is None:
+            return
+        try:
+            yield token
+            async for token in stream:
+                yield token
+        except Exception:
+            provider.stats["failures"] += 1
+            provider.breaker.record_failure()
+            raise
+        finally:
+            await stream.aclose()
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "providers": {provider.name: provider.metrics() for provider in self.providers},
+        }
@@ -11,6 +11,8 @@ from src.schemas.product_line_schemas import (
 )
 from src.models.product_models import Brand
 from src.services.base_services import BaseServiceDBSession
+from src.tools.cache import bump_catalog_version
+from src.tools.client import async_redis_client
 from src.utils.common import building_slug, update_obj_from_dict
 
 
@@ -41,6 +43,7 @@ class ProductLinesService(BaseServiceDBSession):
         self.session.add(obj)
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def get(self, obj_id: str) -> ProductLines | None:
@@ -62,6 +65,7 @@ class ProductLinesService(BaseServiceDBSession):
         obj.slug = await self._generate_slug(obj.name, obj.category_id, obj.brand_id)
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def delete(self, obj_id: str) -> bool:
@@ -73,6 +77,7 @@ class ProductLinesService(BaseServiceDBSession):
             return False
         await self.session.delete(obj)
         await self.session.commit()
+        await bump_catalog_version(async_redis_client)
         return True
 
     async def list(
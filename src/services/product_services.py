@@ -14,6 +14,8 @@ from src.schemas.product_schemas import (
 )
 from src.models.product_models import Brand
 from src.services.base_services import BaseServiceDBSession
+from src.tools.cache import bump_catalog_version
+from src.tools.client import async_redis_client
 from src.utils.common import building_slug, update_obj_from_dict, is_valid_uuid4
 
 
@@ -39,6 +41,7 @@ class ProductService(BaseServiceDBSession):
         self.session.add(obj)
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def get(self, obj_id: str) -> Product | None:
@@ -59,6 +62,7 @@ class ProductService(BaseServiceDBSession):
         obj.url = f"/products/{obj.slug}"
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def delete(self, obj_id: str) -> bool:
@@ -68,6 +72,7 @@ class ProductService(BaseServiceDBSession):
             return False
         await self.session.delete(obj)
         await self.session.commit()
+        await bump_catalog_version(async_redis_client)
         return True
 
     async def list(
@@ -1,5 +1,6 @@
 from uuid import UUID, uuid4
 from typing import Any, List
+import asyncio
 import logging
 
 from fastapi import HTTPException
@@ -8,6 +9,7 @@ from sqlalchemy.orm import selectinload
 
 from src.models.product_models import (
     Product,
+    ProductLines,
     ProductVariant,
     Tag,
     Image
@@ -19,9 +21,10 @@ from src.schemas.product_variant_schemas import (
 )
 
 from src.services.base_services import BaseServiceDBSession
-from src.utils.common import building_slug, update_obj_from_dict, is_valid_uuid4
+from src.utils.common import building_slug, update_obj_from_dict, is_valid_uuid4, generate_product_text
 from src.tasks.embedding_tasks import enqueue_text
-from src.tools.client import minio_client
+from src.tools.client import minio_client, async_redis_client
+from src.tools.cache import bump_catalog_version
 from src.config import settings
 
 logging.basicConfig(level=logging.INFO)
@@ -49,6 +52,7 @@ class ProductVariantService(BaseServiceDBSession):
         self.session.add(obj)
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def get(self, obj_id: str) -> ProductVariant | None:
@@ -80,12 +84,32 @@ class ProductVariantService(BaseServiceDBSession):
         obj.url = f"/product-variants/{obj.slug}"
         await self.session.commit()
         await self.session.refresh(obj)
+        # câu trả lời trong semantic cache có thể chứa giá cũ
+        await bump_catalog_version(async_redis_client)
 
-        variant_data = await self.generate_product_data(obj)
-        # add to queue flower queue
-        enqueue_text(variant_data)
+        variant_data = generate_product_text(await self._get_for_embedding(obj.id))
+        # lane interactive: embed lại sau vài trăm ms thay vì chờ cron, enqueue gọi redis/celery sync nên chạy trong thread
+        await asyncio.to_thread(enqueue_text, variant_data, "interactive")
         return obj
 
+    async def _get_for_embedding(self, obj_id: UUID) -> ProductVariant:
+        """Variant kèm các relationship mà `generate_product_text` cần (tags, product, product line, brand, category)."""
+        result = await self.session.execute(
+            select(ProductVariant)
+            .where(ProductVariant.id == obj_id)
+            .options(
+                selectinload(ProductVariant.tags),
+                selectinload(ProductVariant.product)
+                    .selectinload(Product.product_line)
+                    .selectinload(ProductLines.brand),
+                selectinload(ProductVariant.product)
+                    .selectinload(Product.product_line)
+                    .selectinload(ProductLines.category),
+            )
+            .execution_options(populate_existing=True)
+        )
+        return result.scalar_one()
+
     async def delete(self, obj_id: str) -> bool:
         result = await self.session.execute(
             select(ProductVariant).where(ProductVariant.id == obj_id)
@@ -95,6 +119,7 @@ class ProductVariantService(BaseServiceDBSession):
             return False
         await self.session.delete(obj)
         await self.session.commit()
+        await bump_catalog_version(async_redis_client)
         return True
 
     async def list(
@@ -0,0 +1,106 @@
+import numpy as np
+
+# float32 là không lượng tử hóa, binary chỉ dùng cho lượt lọc đầu (bắt buộc rescore)
+QUANTIZATIONS = ("float32", "float16", "int8", "binary")
+INT8_MAX = 127
+# số bit 1 của mỗi giá trị byte, dùng tính hamming distance cho binary code
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+# số row xử lý mỗi lần để mảng float32 tạm khi tính dot không lớn bằng cả ma trận
+CHUNK_ROWS = 4096
+
+
+def quantize(vectors, quantization: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Trả về (codes, scales):
+    - float16: ép kiểu, không có scale
+    - int8: scalar quantization đối xứng, scale riêng cho mỗi vector = max|x| / 127
+    - binary: bit dấu của từng chiều, pack 8 chiều vào một byte
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    if quantization == "float32":
+        return np.ascontiguousarray(vectors), None
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    if quantization == "int8":
+        scales = np.abs(vectors).max(axis=1) / INT8_MAX
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -INT8_MAX, INT8_MAX).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if quantization == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray | None, quantization: str, dimensions: int) -> np.ndarray:
+    if quantization == "int8":
+        return codes.astype(np.float32) * scales[:, None]
+    if quantization == "binary":
+        return np.unpackbits(codes, axis=1, count=dimensions).astype(np.float32) * 2 - 1
+    return codes.astype(np.float32)
+
+
+def encode_vector(vector, quantization: str) -> bytes:
+    """Serialize một vector (vd. lưu Redis), int8 có 4 byte scale float32 ở đầu."""
+    codes, scales = quantize(vector, quantization)
+    return (scales.tobytes() if scales is not None else b"") + codes.tobytes()
+
+
+def decode_vector(data: bytes, quantization: str) -> np.ndarray:
+    if quantization == "int8":
+        scale = np.frombuffer(data[:4], dtype=np.float32)[0]
+        return np.frombuffer(data[4:], dtype=np.int8).astype(np.float32) * scale
+    if quantization == "binary":
+        raise ValueError("Binary codes cannot be decoded back to a vector")
+    return np.frombuffer(data, dtype=np.dtype(quantization)).astype(np.float32)
+
+
+class QuantizedMatrix:
+    """
+    Ma trận embedding đã lượng tử hóa, chỉ thêm row (index đánh dấu xóa chứ không xóa row).
+    `dots` trả về dot product xấp xỉ với query, riêng binary trả về hamming distance tới sign code của query.
+    """
+
+    def __init__(self, quantization: str, dimensions: int):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.quantization = quantization
+        self.dimensions = dimensions
+        code_dtype = {"float32": np.float32, "float16": np.float16, "int8": np.int8, "binary": np.uint8}[quantization]
+        code_width = (dimensions + 7) // 8 if quantization == "binary" else dimensions
+        self.codes = np.zeros((0, code_width), dtype=code_dtype)
+        self.scales = np.zeros(0, dtype=np.float32) if quantization == "int8" else None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def append(self, vectors):
+        codes, scales = quantize(vectors, self.quantization)
+        self.codes = np.concatenate([self.codes, codes]) if len(self.codes) else codes
+        if self.scales is not None:
+            self.scales = np.concatenate([self.scales, scales])
+
+    def dots(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        if self.quantization == "binary":
+            query_code = np.packbits(query > 0)
+            return np.concatenate([
+                POPCOUNT[self.codes[chunk] ^ query_code].sum(axis=1, dtype=np.int32)
+                for chunk in np.array_split(rows, max(1, -(-len(rows) // CHUNK_ROWS)))
+            ]).astype(np.float32)
+
+        results = []
+        for chunk in np.array_split(rows, max(1, -(-len(rows) // CHUNK_ROWS))):
+            dots = self.codes[chunk].astype(np.float32) @ query
+            if self.scales is not None:
+                dots *= self.scales[chunk]
+            results.append(dots)
+        return np.concatenate(results)
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        scales = self.scales[rows] if self.scales is not None else None
+        return dequantize(self.codes[rows], scales, self.quantization, self.dimensions)
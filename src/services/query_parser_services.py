@@ -0,0 +1,207 @@
+import logging
+import re
+
+from src.utils.common import normalize_text
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# từ khóa tiếng Việt (đã bỏ dấu) -> tên category/tag trong catalog (đã normalize)
+CATEGORY_SYNONYMS = {
+    "dien thoai": ["smartphone"],
+    "smartphone": ["smartphone"],
+    "laptop": ["laptop"],
+    "may tinh xach tay": ["laptop"],
+    "may tinh bang": ["tablet"],
+    "tablet": ["tablet"],
+    "dong ho": ["smartwatch"],
+    "tai nghe": ["headphones", "earbuds"],
+    "may anh": ["camera"],
+    "loa": ["smart speaker"],
+    "sac": ["charger"],
+    "cu sac": ["charger"],
+    "phu kien": ["accessory"],
+}
+TAG_SYNONYMS = {
+    "choi game": ["gaming"],
+    "gaming": ["gaming"],
+    "van phong": ["office"],
+    "do hoa": ["graphic"],
+    "gia re": ["cheap", "budget"],
+    "cao cap": ["premium", "luxury"],
+    "sac nhanh": ["fast charging"],
+    "chong on": ["noise cancelling"],
+    "khong day": ["wireless"],
+    "chong nuoc": ["water resistant"],
+    "nho gon": ["compact", "portable"],
+}
+
+NUMBER = r"(\d+(?:[.,]\d+)?)\s*(trieu|tr|cu|m|k|nghin|ngan|ty)?(?![a-z0-9])"
+UNIT_MULTIPLIERS = {"trieu": 1e6, "tr": 1e6, "cu": 1e6, "m": 1e6, "k": 1e3, "nghin": 1e3, "ngan": 1e3, "ty": 1e9}
+PRICE_RANGE_PATTERN = re.compile(rf"\btu\s+{NUMBER}\s*(?:den|toi|-)\s*{NUMBER}")
+PRICE_MAX_PATTERN = re.compile(rf"\b(?:duoi|it hon|nho hon|khong qua|toi da|re hon|ngan sach|max|<=?)\s*{NUMBER}")
+PRICE_MIN_PATTERN = re.compile(rf"\b(?:tren|lon hon|toi thieu|>=?)\s*{NUMBER}")
+PRICE_FROM_PATTERN = re.compile(rf"\btu\s*{NUMBER}")
+PRICE_AROUND_PATTERN = re.compile(rf"\b(?:khoang|tam|tam tam|gia)\s*{NUMBER}")
+PRICE_AROUND_RATIO = 0.15
+# "từ" dùng cho cả năm, thông số...: số không có đơn vị giá chỉ là giá khi câu hỏi có nhắc tới giá/tiền
+PRICE_WORD_PATTERN = re.compile(r"\b(?:gia|tien|ngan sach)\b")
+# số đứng trước đơn vị thông số hoặc từ chỉ số lượng không phải giá: "16 GB", "5 màu", "2 phiên bản"
+NOT_PRICE_SUFFIX_PATTERN = re.compile(
+    r"\s*(?:gb|tb|mb|mah|inch|in|hz|ghz|w|mp|mm|cm|kg|core|nhan|luong|mau|phien ban|chiec|cai|nam|thang|nguoi|lan)"
+    r"(?![a-z0-9])"
+)
+YEAR_PATTERN = re.compile(r"(?:19|20)\d\d")
+
+
+def parse_price(value: str, unit: str | None) -> float:
+    number = float(value.replace(",", "."))
+    if unit:
+        return number * UNIT_MULTIPLIERS[unit]
+    # "dưới 10" trong ngữ cảnh cửa hàng điện thoại/laptop hiểu là 10 triệu
+    return number * 1e6 if number < 1000 else number
+
+
+class QueryParser:
+    """
+    Tách ràng buộc có cấu trúc (brand, category, tag, khoảng giá) từ câu hỏi
+    để đẩy xuống vector store dưới dạng metadata filter.
+    """
+
+    def __init__(self):
+        self.brands: dict[str, str] = {}
+        self.categories: dict[str, str] = {}
+        self.tags: dict[str, str] = {}
+        self._facets_signature = None
+
+    def update_facets(self, facets: dict):
+        """`facets`: {"brands": [...], "categories": [...], "tags": [...]} lấy từ DB."""
+        signature = hash(tuple(tuple(facets.get(key) or []) for key in ("brands", "categories", "tags")))
+        if signature == self._facets_signature:
+            return
+        self.brands = {normalize_text(name): name for name in facets.get("brands") or []}
+        self.categories = {normalize_text(name): name for name in facets.get("categories") or []}
+        self.tags = {normalize_text(name): name for name in facets.get("tags") or []}
+        self._facets_signature = signature
+
+    @staticmethod
+    def _contains(text: str, phrase: str) -> bool:
+        return re.search(rf"(?<![a-z0-9]){re.escape(phrase)}(?![a-z0-9])", text) is not None
+
+    def _match_names(self, text: str, names: dict[str, str], synonyms: dict[str, list[str]]) -> list[str]:
+        found = {original for normalized, original in names.items() if self._contains(text, normalized)}
+        for phrase, targets in synonyms.items():
+            if self._contains(text, phrase):
+                found.update(names[target] for target in targets if target in names)
+        return sorted(found)
+
+    @staticmethod
+    def _is_price(text: str, match: re.Match, needs_price_word: bool = False) -> bool:
+        """
+        Số trong `match` (từng cặp group số, đơn vị) có phải giá không: số không kèm đơn vị giá bị loại khi là năm
+        hoặc đứng trước đơn vị thông số/số lượng, với `needs_price_word` thì câu hỏi còn phải nhắc tới giá.
+        """
+        has_unit = False
+        for value_group in range(1, (match.re.groups or 0) + 1, 2):
+            if match.group(value_group + 1):
+                has_unit = True
+                continue
+            if YEAR_PATTERN.fullmatch(match.group(value_group)):
+                return False
+            if NOT_PRICE_SUFFIX_PATTERN.match(text, match.end(value_group)):
+                return False
+        return has_unit or not needs_price_word or PRICE_WORD_PATTERN.search(text) is not None
+
+    def _find_price(self, pattern: re.Pattern, text: str, needs_price_word: bool = False) -> re.Match | None:
+        return next((m for m in pattern.finditer(text) if self._is_price(text, m, needs_price_word)), None)
+
+    def parse_price_range(self, text: str) -> tuple[float | None, float | None]:
+        if match := self._find_price(PRICE_RANGE_PATTERN, text, needs_price_word=True):
+            low = parse_price(match.group(1), match.group(2) or match.group(4))
+            high = parse_price(match.group(3), match.group(4))
+            return min(low, high), max(low, high)
+        if match := self._find_price(PRICE_MAX_PATTERN, text):
+            return None, parse_price(match.group(1), match.group(2))
+        if match := self._find_price(PRICE_MIN_PATTERN, text):
+            return parse_price(match.group(1), match.group(2)), None
+        if match := self._find_price(PRICE_FROM_PATTERN, text, needs_price_word=True):
+            return parse_price(match.group(1), match.group(2)), None
+        if match := self._find_price(PRICE_AROUND_PATTERN, text):
+            price = parse_price(match.group(1), match.group(2))
+            return price * (1 - PRICE_AROUND_RATIO), price * (1 + PRICE_AROUND_RATIO)
+        return None, None
+
+    def parse(self, query: str, facets: dict = None) -> dict:
+        if facets is not None:
+            self.update_facets(facets)
+        text = normalize_text(query)
+        min_price, max_price = self.parse_price_range(text)
+        constraints = {
+            "brands": self._match_names(text, self.brands, {}),
+            "categories": self._match_names(text, self.categories, CATEGORY_SYNONYMS),
+            "tags": self._match_names(text, self.tags, TAG_SYNONYMS),
+            "min_price": min_price,
+            "max_price": max_price,
+        }
+        log.debug(f"[QueryParser] {query!r} -> {constraints}")
+        return constraints
+
+    @staticmethod
+    def is_empty(constraints: dict | None) -> bool:
+        return not constraints or not any(constraints.values())
+
+    @staticmethod
+    def to_chroma_where(constraints: dict | None) -> dict | None:
+        """Chuyển constraints thành `where` filter của chroma (metadata do process_embedding_queue ghi)."""
+        if not constraints:
+            return None
+        clauses = []
+        if constraints.get("brands"):
+            clauses.append({"brand": {"$in": constraints["brands"]}})
+        if constraints.get("categories"):
+            clauses.append({"category": {"$in": constraints["categories"]}})
+        tag_clauses = [{f"tag_{tag}": True} for tag in constraints.get("tags") or []]
+        if len(tag_clauses) > 1:
+            clauses.append({"$or": tag_clauses})
+        else:
+            clauses.extend(tag_clauses)
+        if constraints.get("min_price") is not None:
+            clauses.append({"price": {"$gte": constraints["min_price"]}})
+        if constraints.get("max_price") is not None:
+            clauses.append({"price": {"$lte": constraints["max_price"]}})
+        # phạm vi product/product line do lượt retrieval đầu của hierarchical search chọn
+        scope_clauses = [
+            {key: {"$in": constraints[scope]}}
+            for scope, key in (("product_ids", "product_id"), ("product_line_ids", "product_line_id"))
+            if constraints.get(scope)
+        ]
+        if len(scope_clauses) > 1:
+            clauses.append({"$or": scope_clauses})
+        else:
+            clauses.extend(scope_clauses)
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    @staticmethod
+    def matches(metadata: dict, constraints: dict | None) -> bool:
+        """Cùng logic với `to_chroma_where` nhưng áp dụng cho metadata trong index in-process."""
+        if not constraints:
+            return True
+        if constraints.get("brands") and metadata.get("brand") not in constraints["brands"]:
+            return False
+        if constraints.get("categories") and metadata.get("category") not in constraints["categories"]:
+            return False
+        if constraints.get("tags") and not any(metadata.get(f"tag_{tag}") for tag in constraints["tags"]):
+            return False
+        price = metadata.get("price")
+        if constraints.get("min_price") is not None and (price is None or price < constraints["min_price"]):
+            return False
+        if constraints.get("max_price") is not None and (price is None or price > constraints["max_price"]):
+            return False
+        if constraints.get("product_ids") or constraints.get("product_line_ids"):
+            return (
+                metadata.get("product_id") in (constraints.get("product_ids") or ())
+                or metadata.get("product_line_id") in (constraints.get("product_line_ids") or ())
+            )
+        return True
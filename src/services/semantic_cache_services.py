@@ -0,0 +1,147 @@
+import json
+import logging
+import time
+import uuid
+
+from redis.asyncio import Redis
+
+from src.tools.client import get_async_chroma_client
+from src.tools.cache import get_catalog_version
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_INDEX_KEY = "semantic_cache:index"
+
+
+class SemanticCache:
+    """
+    Cache câu trả lời theo embedding của rewritten query.
+    - Entry gắn với catalog version, đổi giá/sản phẩm thì entry cũ không còn match.
+    - Hết TTL hoặc vượt `max_items` thì xóa entry cũ nhất (index theo thời gian tạo lưu trong Redis sorted set).
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        redis: Redis,
+        similarity_threshold: float = 0.95,
+        ttl: int = 3600,
+        max_items: int = 10000,
+        chroma_client=None,
+        index_key: str = SEMANTIC_CACHE_INDEX_KEY,
+    ):
+        self.collection_name = collection_name
+        self.redis = redis
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self.collection = None
+        self.chroma_client = chroma_client
+        self.index_key = index_key
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    async def get_collection(self):
+        if self.collection is None:
+            client = self.chroma_client or await get_async_chroma_client()
+            self.collection = await client.get_or_create_collection(
+                name=self.collection_name,
+                metadata={"hnsw:space": "cosine"},
+            )
+        return self.collection
+
+    async def catalog_version(self) -> int:
+        return await get_catalog_version(self.redis)
+
+    def _similarity(self, distance: float) -> float:
+        # collection cũ có thể đang dùng l2, embedding OpenAI đã chuẩn hóa nên l2^2 = 2 - 2cos
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "cosine":
+            return 1 - distance
+        if space == "ip":
+            return -distance
+        return 1 - distance / 2
+
+    async def lookup(self, query_embedding: list, catalog_version: int) -> dict | None:
+        """Trả về entry gần nhất nếu đủ similarity, cùng catalog version và còn TTL."""
+        collection = await self.get_collection()
+        results = await collection.query(
+            query_embeddings=[query_embedding],
+            n_results=1,
+            where={"$and": [
+                {"catalog_version": catalog_version},
+                {"created_at": {"$gte": int(time.time()) - self.ttl}},
+            ]},
+            include=["documents", "distances"],
+        )
+        ids = results.get("ids") or [[]]
+        if not ids[0]:
+            self.stats["misses"] += 1
+            return None
+
+        similarity = self._similarity(results["distances"][0][0])
+        if similarity < self.similarity_threshold:
+            log.debug(f"[SemanticCache] Nearest entry similarity {similarity:.4f} below threshold")
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        entry = json.loads(results["documents"][0][0])
+        log.debug(f"[SemanticCache] Hit {ids[0][0]} with similarity {similarity:.4f}")
+        return {
+            "id": ids[0][0],
+            "similarity": similarity,
+            "output": entry["return_val"][0]["content"],
+        }
+
+    async def store(
+        self,
+        original_message: str,
+        enhanced_message: str,
+        response_text: str,
+        query_embedding: list,
+        catalog_version: int,
+        model_name: str = "gpt-4o-mini",
+    ):
+        collection = await self.get_collection()
+        entry_id = str(uuid.uuid4())
+        created_at = int(time.time())
+        await collection.add(
+            ids=[entry_id],
+            embeddings=[query_embedding],
+            metadatas=[{"catalog_version": catalog_version, "created_at": created_at}],
+            documents=[json.dumps({
+                "text": [{"type": "human", "content": original_message, "enhanced_content": enhanced_message}],
+                "llm_string": {"model_name": model_name, "name": "ChatOpenAI"},
+                "return_val": [{"type": "ai", "content": response_text}]
+            })]
+        )
+        await self.redis.zadd(self.index_key, {entry_id: created_at})
+        self.stats["stores"] += 1
+        await self.evict()
+
+    async def evict(self):
+        """Xóa entry hết TTL và các entry cũ nhất khi vượt `max_items`."""
+        expired = await self.redis.zrangebyscore(self.index_key, "-inf", int(time.time()) - self.ttl)
+        overflow = []
+        size = await self.redis.zcard(self.index_key) - len(expired)
+        if size > self.max_items:
+            overflow = await self.redis.zrange(
+                self.index_key, len(expired), len(expired) + size - self.max_items - 1
+            )
+        stale_ids = [i.decode() if isinstance(i, bytes) else i for i in expired + overflow]
+        if not stale_ids:
+            return
+
+        collection = await self.get_collection()
+        await collection.delete(ids=stale_ids)
+        await self.redis.zrem(self.index_key, *stale_ids)
+        self.stats["evictions"] += len(stale_ids)
+        log.info(f"[SemanticCache] Evicted {len(stale_ids)} entries")
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+        }
@@ -3,6 +3,8 @@ from sqlalchemy.future import select
 from src.models.product_models import Tag
 from src.schemas.tag_schema import TagCreateSchema, TagUpdateSchema
 from src.services.base_services import BaseServiceDBSession
+from src.tools.cache import bump_catalog_version
+from src.tools.client import async_redis_client
 from src.utils.common import update_obj_from_dict
 
 
@@ -12,6 +14,7 @@ class TagService(BaseServiceDBSession):
         self.session.add(obj)
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def get(self, obj_id: str) -> Tag | None:
@@ -26,6 +29,7 @@ class TagService(BaseServiceDBSession):
         update_obj_from_dict(obj, data.model_dump(exclude_unset=True))
         await self.session.commit()
         await self.session.refresh(obj)
+        await bump_catalog_version(async_redis_client)
         return obj
 
     async def delete(self, obj_id: str) -> bool:
@@ -35,6 +39,7 @@ class TagService(BaseServiceDBSession):
             return False
         await self.session.delete(obj)
         await self.session.commit()
+        await bump_catalog_version(async_redis_client)
         return True
 
     async def list(self, skip: int = 0, limit: int = 20) -> list[Tag]:
@@ -0,0 +1,284 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Callable
+
+import numpy as np
+
+from src.services.quantization_services import QuantizedMatrix
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+VECTOR_INDEX_MODES = ("exact", "hnsw")
+# constraints có product_ids (hierarchical search) gần như khác nhau mỗi query nên giới hạn số mask được cache
+MASK_CACHE_SIZE = 256
+
+
+class LocalVectorIndex:
+    """
+    Bản sao in-process của embedding trong product collection (chroma vẫn là source of truth).
+    - Ma trận liên tục (có thể là memmap của snapshot, các worker dùng chung page cache).
+    - Update incremental ghi vào phần delta trong memory, row cũ bị đánh dấu xóa.
+    - Distance cùng công thức với chroma theo `hnsw:space` (l2 bình phương, cosine, ip).
+    - `mode="hnsw"` dùng hnswlib (nếu được cài) cho catalog lớn, mặc định search exact bằng numpy.
+    - `quantization` (float16, int8, binary): lượt đầu search trên code lượng tử hóa trong memory,
+      rồi tính distance exact trên `limit * rescore_factor` candidate bằng vector float32 (memmap của snapshot).
+    """
+
+    def __init__(
+        self,
+        space: str = "l2",
+        mode: str = "exact",
+        hnsw_m: int = 16,
+        hnsw_ef: int = 64,
+        quantization: str = "float32",
+        rescore_factor: int = 4,
+    ):
+        self.space = space
+        self.mode = mode
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef = hnsw_ef
+        self.version = 0
+        self._reset()
+
+    def _reset(self):
+        self.ids: list[str] = []
+        self.documents: list[str] = []
+        self.metadatas: list[dict] = []
+        self.row_of: dict[str, int] = {}
+        self.base = np.zeros((0, 0), dtype=np.float32)
+        self.delta = np.zeros((0, 0), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.hnsw = None
+        self.codes: QuantizedMatrix | None = None
+        self._mask_cache: dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        return len(self.row_of)
+
+    @property
+    def dimensions(self) -> int:
+        return self.base.shape[1] if self.base.size else self.delta.shape[1] if self.delta.size else 0
+
+    def _matrix_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Vector float32 của `rows`, giữ đúng thứ tự của `rows` (row có thể nằm ở base hoặc delta)."""
+        base_rows = len(self.base)
+        if not len(self.delta):
+            return self.base[rows]
+        if not base_rows:
+            return self.delta[rows]
+        matrix = np.empty((len(rows), self.dimensions), dtype=np.float32)
+        in_base = rows < base_rows
+        matrix[in_base] = self.base[rows[in_base]]
+        matrix[~in_base] = self.delta[rows[~in_base] - base_rows]
+        return matrix
+
+    def build(self, ids: list[str], embeddings, documents: list[str], metadatas: list[dict], base=None):
+        """Build lại toàn bộ index, `base` là ma trận đã có sẵn (vd. memmap của snapshot)."""
+        self._reset()
+        self.base = base if base is not None else np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = [meta or {} for meta in metadatas]
+        self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.norms = np.einsum("ij,ij->i", self.base, self.base).astype(np.float32) if len(self.base) else self.norms
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        if self.mode == "hnsw":
+            self._build_hnsw()
+        elif self.quantization != "float32" and len(self.ids):
+            self.codes = QuantizedMatrix(self.quantization, self.dimensions)
+            self.codes.append(self.base)
+
+    def upsert(self, ids: list[str], embeddings, documents: list[str], metadatas: list[dict]):
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        self.remove(ids)
+        start = len(self.ids)
+        self.delta = vectors if not len(self.delta) else np.vstack([self.delta, vectors])
+        self.norms = np.concatenate([self.norms, np.einsum("ij,ij->i", vectors, vectors)])
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        for offset, doc_id in enumerate(ids):
+            self.row_of[doc_id] = start + offset
+        self.ids += list(ids)
+        self.documents += list(documents or [""] * len(ids))
+        self.metadatas += [meta or {} for meta in (metadatas or [None] * len(ids))]
+        self._mask_cache.clear()
+        if self.hnsw is not None:
+            self._hnsw_add(vectors, np.arange(start, start + len(ids)))
+        elif self.quantization != "float32":
+            if self.codes is None:
+                self.codes = QuantizedMatrix(self.quantization, vectors.shape[1])
+            self.codes.append(vectors)
+
+    def remove(self, ids: list[str]):
+        for doc_id in ids:
+            row = self.row_of.pop(doc_id, None)
+            if row is None:
+                continue
+            self.alive[row] = False
+            if self.hnsw is not None:
+                self.hnsw.mark_deleted(row)
+        self._mask_cache.clear()
+
+    def clear(self):
+        self._reset()
+
+    def _build_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            log.error("[VectorIndex] hnswlib is not installed, falling back to exact search")
+            self.mode = "exact"
+            self.build(self.ids, None, self.documents, self.metadatas, base=self.base)
+            return
+        self.hnsw = hnswlib.Index(space=self.space, dim=self.dimensions)
+        self.hnsw.init_index(max_elements=max(len(self.ids) * 2, 1024), M=self.hnsw_m, ef_construction=200)
+        self.hnsw.set_ef(self.hnsw_ef)
+        if len(self.ids):
+            self.hnsw.add_items(np.asarray(self.base), np.arange(len(self.ids)))
+
+    def _hnsw_add(self, vectors: np.ndarray, labels: np.ndarray):
+        needed = int(labels[-1]) + 1
+        if needed > self.hnsw.get_max_elements():
+            self.hnsw.resize_index(needed * 2)
+        self.hnsw.add_items(vectors, labels)
+
+    def _filter_mask(self, doc_filter: Callable[[dict], bool] | None, cache_key: str | None) -> np.ndarray:
+        if doc_filter is None:
+            return self.alive
+        if cache_key is not None and cache_key in self._mask_cache:
+            return self._mask_cache[cache_key]
+        mask = self.alive & np.fromiter((doc_filter(meta) for meta in self.metadatas), dtype=bool, count=len(self.ids))
+        if cache_key is not None:
+            if len(self._mask_cache) >= MASK_CACHE_SIZE:
+                self._mask_cache.pop(next(iter(self._mask_cache)))
+            self._mask_cache[cache_key] = mask
+        return mask
+
+    def _distances(self, query: np.ndarray, rows: np.ndarray, approximate: bool = False) -> np.ndarray:
+        """Distance exact trên float32, hoặc xấp xỉ từ code lượng tử hóa (binary: hamming distance)."""
+        if approximate:
+            dots = self.codes.dots(query, rows)
+            if self.quantization == "binary":
+                return dots
+        else:
+            dots = self._matrix_rows(rows) @ query
+        if self.space == "cosine":
+            denominator = np.sqrt(self.norms[rows]) * (np.linalg.norm(query) or 1.0)
+            return 1 - dots / np.where(denominator == 0, 1.0, denominator)
+        if self.space == "ip":
+            return 1 - dots
+        return self.norms[rows] + float(query @ query) - 2 * dots
+
+    def search(
+        self,
+        query_embedding: list[float],
+        limit: int = 5,
+        doc_filter: Callable[[dict], bool] = None,
+        filter_key: str = None,
+    ) -> list[tuple[str, str, dict, float]]:
+        """
+        Trả về [(id, document, metadata, distance)] theo distance tăng dần.
+        `filter_key` (vd. json của constraints) để cache mask của filter giữa các query.
+        """
+        if not self.row_of:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        mask = self._filter_mask(doc_filter, filter_key)
+        if self.hnsw is not None:
+            k = min(limit, int(mask.sum()))
+            if not k:
+                return []
+            labels, distances = self.hnsw.knn_query(query, k=k, filter=lambda label: bool(mask[label]))
+            hits = zip(labels[0].tolist(), distances[0].tolist())
+        else:
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return []
+            if self.codes is not None:
+                rescore = self.rescore_factor > 0 or self.quantization == "binary"
+                distances = self._distances(query, rows, approximate=True)
+                if rescore:
+                    rows = rows[_top_k(distances, limit * max(self.rescore_factor, 1))]
+                    distances = self._distances(query, rows)
+            else:
+                distances = self._distances(query, rows)
+            top = _top_k(distances, limit)
+            hits = zip(rows[top].tolist(), distances[top].tolist())
+        return [(self.ids[row], self.documents[row], self.metadatas[row], float(distance)) for row, distance in hits]
+
+    def memory_bytes(self) -> dict:
+        """Bytes của process (code lượng tử hóa, norm, delta) và bytes float32 nằm trong memmap (page cache dùng chung)."""
+        private = self.norms.nbytes + self.alive.nbytes + self.delta.nbytes
+        if self.codes is not None:
+            private += self.codes.nbytes
+        mapped = self.base.nbytes if isinstance(self.base, np.memmap) else 0
+        if not mapped:
+            private += self.base.nbytes
+        return {"private": private, "mapped": mapped}
+
+    def save(self, path: str):
+        """
+        Ghi snapshot (chỉ các row còn sống): `<path>.npy` cho ma trận, `<path>.json` cho id/document/metadata.
+        Ghi ra file tạm rồi rename nên reader không bao giờ thấy file ghi dở.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        rows = np.flatnonzero(self.alive)
+        matrix = self._matrix_rows(rows) if len(rows) else np.zeros((0, self.dimensions), dtype=np.float32)
+        with open(f"{path}.npy.tmp", "wb") as file:
+            np.save(file, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(f"{path}.json.tmp", "w") as file:
+            json.dump({
+                "version": self.version,
+                "space": self.space,
+                "rows": len(rows),
+                "ids": [self.ids[row] for row in rows],
+                "documents": [self.documents[row] for row in rows],
+                "metadatas": [self.metadatas[row] for row in rows],
+            }, file, ensure_ascii=False)
+        os.replace(f"{path}.npy.tmp", f"{path}.npy")
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+
+    @classmethod
+    def load(
+        cls, path: str, mode: str = "exact", quantization: str = "float32", rescore_factor: int = 4
+    ) -> "LocalVectorIndex | None":
+        """Mở snapshot bằng memmap, trả về None nếu chưa có hoặc file không khớp nhau."""
+        try:
+            with open(f"{path}.json", "r") as file:
+                meta = json.load(file)
+            matrix = np.load(f"{path}.npy", mmap_mode="r")
+        except (FileNotFoundError, ValueError) as e:
+            log.info(f"[VectorIndex] No usable snapshot at {path}: {e}")
+            return None
+        if len(matrix) != meta["rows"]:
+            log.warning(f"[VectorIndex] Snapshot {path} is inconsistent, ignoring it")
+            return None
+        index = cls(space=meta["space"], mode=mode, quantization=quantization, rescore_factor=rescore_factor)
+        index.build(meta["ids"], None, meta["documents"], meta["metadatas"], base=matrix)
+        index.version = meta["version"]
+        return index
+
+
+def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Vị trí của k distance nhỏ nhất, đã sắp xếp tăng dần."""
+    top = np.argpartition(distances, k - 1)[:k] if len(distances) > k else np.arange(len(distances))
+    return top[np.argsort(distances[top])]
+
+
+@asynccontextmanager
+async def snapshot_lock(path: str):
+    """File lock giữa các uvicorn worker trên cùng máy: một worker build snapshot, các worker khác chờ rồi đọc."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "w") as lock_file:
+        await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,5 +1,8 @@
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init
+
+from src.tools.telemetry import setup_tracing, instrument_clients
 
 
 # Configure Celery
@@ -22,10 +25,31 @@ celery_app.conf.beat_schedule = {
         'task': 'src.tasks.embedding_tasks.process_embedding_queue',
         'schedule': crontab(minute='*/5'),
     },
-    'process-unembedding-queue-every-10-mins': {
+    # thay đổi catalog đi qua CDC (listen-catalog-changes), lượt quét toàn bộ chỉ để bắt những gì bị lỡ
+    'rehash-all-embeddings-daily': {
         'task': 'src.tasks.embedding_tasks.process_unembedding_queue',
-        'schedule': crontab(minute='*/10'),
+        'schedule': crontab(hour=3, minute=30),
+        'kwargs': {'full': True},
+    },
+    'compact-semantic-cache-daily': {
+        'task': 'src.tasks.embedding_tasks.compact_semantic_cache',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'cleanup-orphan-embeddings-weekly': {
+        'task': 'src.tasks.embedding_tasks.cleanup_orphan_embeddings',
+        'schedule': crontab(day_of_week=0, hour=4, minute=30),
     },
 }
 
-celery_app.autodiscover_tasks(["src.tasks.embedding_tasks"])
+
+@worker_process_init.connect(weak=False)
+def init_worker_tracing(*args, **kwargs):
+    # provider phải tạo sau khi prefork, BatchSpanProcessor không sống sót qua fork
+    if setup_tracing("aia_faq-worker"):
+        from opentelemetry.instrumentation.celery import CeleryInstrumentor
+        from src.db import engine
+        CeleryInstrumentor().instrument()
+        instrument_clients(engine)
+
+
+celery_app.autodiscover_tasks(["src.tasks.embedding_tasks", "src.tasks.history_tasks"])
@@ -1,82 +1,112 @@
 # app/tasks/embedding_tasks.py
 import asyncio
 import logging
+import random
+import time
+import uuid
 
 from celery import shared_task
+from sqlalchemy import and_, exists, func, or_
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from src.db import AsyncSessionLocal
 from src.config import settings
-from src.tasks.queue_uitils import push_to_queue, pop_all_from_queue
+from src.constants import CATALOG_INDEX_VERSION_KEY, EMBEDDING_CLAIM_IDLE_MS
+from src.tasks.queue_uitils import (
+    push_to_queue,
+    publish_catalog_update,
+    bump_catalog_version,
+    queue_consumer_name,
+    migrate_legacy_queue,
+    read_batch,
+    claim_stale_batch,
+    touch_messages,
+    ack_messages,
+    catalog_redis_client,
+)
 from src.tasks.celery_app import celery_app
+from src.models.embedding_models import EmbeddingState
 from src.models.product_models import (
+    Brand,
+    Category,
     ProductLines,
     Product,
     ProductVariant,
+    ProductVariantTag,
+)
+from src.services.embedding_state_services import EmbeddingStateStore
+from src.services.embedding_pipeline_services import EmbeddingPipeline
+from src.services.collection_alias_services import CollectionAliases, collection_version, versioned_name
+from src.services.collection_maintenance_services import CollectionMaintenanceJob
+from src.services.semantic_cache_services import SEMANTIC_CACHE_INDEX_KEY
+from src.utils.common import (
+    content_hash,
+    generate_product_text,
+    generate_product_group_text,
+    generate_product_line_text,
+    product_metadata,
+    product_group_metadata,
 )
-from src.utils.common import generate_product_text
-from src.tools.client import embedding_client, chroma_client
+from src.tools.client import embedding_client, get_chroma_client
+from src.tools.rate_limiter import unwrap_rate_limit
+from src.tools.telemetry import tracer, links_from
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-collection = chroma_client.get_or_create_collection(settings.COLLECTION_NAME)
-chat_history_collection = chroma_client.get_or_create_collection(settings.CHAT_HISTORY_COLLECTION)
-semantic_cached_collection = chroma_client.get_or_create_collection(settings.SEMANTIC_CACHE_COLLECTION)
 
-@shared_task
-def enqueue_text(text_data: dict):
-    push_to_queue(text_data)
+collection_aliases = CollectionAliases(catalog_redis_client)
 
 
-@celery_app.task(name="src.tasks.embedding_tasks.process_embedding_queue")
-def process_embedding_queue():
-    items = pop_all_from_queue()
-    if not items:
-        log.info("No items")
-        return
-
-    for idx, batch in enumerate(items):
-        documents = []
-        ids = []
-        metadatas = []
-        embeddings = []
-
-        for it in batch:
-            documents.append(it["text"])
-            ids.append(it["id"])
-            metadatas.append({
-                "brand": it["brand"],
-                "category": it["category"],
-                **{
-                    f"tag_{key}": True for key in it["tags"]
-                }
-            })
+def catalog_collections() -> dict[str, str]:
+    """Alias của các collection catalog -> collection chroma đang phục vụ."""
+    return collection_aliases.resolve_all([settings.COLLECTION_NAME, settings.PRODUCT_GROUP_COLLECTION])
 
-        log.info(f"Processing batch {idx} with {len(documents)} texts")
-        resp = embedding_client.embeddings.create(
-            model=settings.OPENAI_EMBEDDING_MODEL,
-            input=documents
-        )
-        embeddings = [d.embedding for d in resp.data]
-        log.info(f"Processed embedding for: {len(embeddings)} vectors")
-        collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
 
-    return log.info(f"Processed {len(items)} items")
+def get_collection(name: str = settings.COLLECTION_NAME, metadata: dict = None):
+    # tên alias (vd. settings.COLLECTION_NAME) được đổi sang version đang phục vụ, tên vật lý giữ nguyên
+    return get_chroma_client().get_or_create_collection(collection_aliases.resolve(name), metadata=metadata)
 
 
-@celery_app.task(name="src.tasks.embedding_tasks.process_unembedding_queue")
-def process_unembedding_queue():
-    async def async_task():
-        result = collection.get(include=[])
-        all_ids = result.get("ids", [])
-        variants = []
+def item_collection(item: dict, collections: dict[str, str]) -> str:
+    # item có "level" là product/product line, còn lại là variant
+    return collections[settings.PRODUCT_GROUP_COLLECTION if item.get("level") else settings.COLLECTION_NAME]
 
-        async with AsyncSessionLocal() as session:
-            results = await session.execute(
-                select(ProductVariant)
-                .filter(ProductVariant.id.notin_(all_ids))
+
+def embedding_sources(collections: dict[str, str] = None) -> list[dict]:
+    """
+    Các bảng được embed: query load đủ relationship cho hàm generate text, `ids` là id của cùng tập row,
+    `changed` là điều kiện row (hoặc thứ nó phụ thuộc) được sửa sau lần kiểm tra gần nhất trong embedding_states.
+    `collections`: alias -> collection được ghi (mặc định version đang phục vụ, reindex truyền version mới).
+    """
+    collections = collections or catalog_collections()
+    variants = (
+        select(ProductVariant)
+        .join(ProductVariant.product)
+        .join(Product.product_line)
+        .join(ProductLines.brand)
+        .join(ProductLines.category)
+    )
+    products = (
+        select(Product)
+        .join(Product.product_line)
+        .join(ProductLines.brand)
+        .join(ProductLines.category)
+    )
+    lines = (
+        select(ProductLines)
+        .join(ProductLines.brand)
+        .join(ProductLines.category)
+    )
+    return [
+        {
+            "level": "variant",
+            "entity": ProductVariant,
+            "collection": collections[settings.COLLECTION_NAME],
+            "text": generate_product_text,
+            "ids": variants.with_only_columns(ProductVariant.id),
+            "query": variants
                 .options(
                     selectinload(ProductVariant.tags),
                     selectinload(ProductVariant.product)
@@ -85,34 +115,788 @@ def process_unembedding_queue():
                     selectinload(ProductVariant.product)
                         .selectinload(Product.product_line)
                         .selectinload(ProductLines.category),
+                ),
+            "changed": lambda: [
+                ProductVariant.updated_at > EmbeddingState.updated_at,
+                Product.updated_at > EmbeddingState.updated_at,
+                ProductLines.updated_at > EmbeddingState.updated_at,
+                Brand.updated_at > EmbeddingState.updated_at,
+                Category.updated_at > EmbeddingState.updated_at,
+                exists().where(
+                    ProductVariantTag.variant_id == ProductVariant.id,
+                    ProductVariantTag.created_at > EmbeddingState.updated_at,
+                ),
+            ],
+        },
+        {
+            "level": "product",
+            "entity": Product,
+            "collection": collections[settings.PRODUCT_GROUP_COLLECTION],
+            "text": generate_product_group_text,
+            "ids": products.with_only_columns(Product.id),
+            "query": products
+                .options(
+                    selectinload(Product.variants),
+                    selectinload(Product.product_line).selectinload(ProductLines.brand),
+                    selectinload(Product.product_line).selectinload(ProductLines.category),
+                ),
+            "changed": lambda: [
+                Product.updated_at > EmbeddingState.updated_at,
+                ProductLines.updated_at > EmbeddingState.updated_at,
+                Brand.updated_at > EmbeddingState.updated_at,
+                Category.updated_at > EmbeddingState.updated_at,
+                exists().where(
+                    ProductVariant.product_id == Product.id,
+                    ProductVariant.updated_at > EmbeddingState.updated_at,
+                ),
+            ],
+        },
+        {
+            "level": "line",
+            "entity": ProductLines,
+            "collection": collections[settings.PRODUCT_GROUP_COLLECTION],
+            "text": generate_product_line_text,
+            "ids": lines.with_only_columns(ProductLines.id),
+            "query": lines
+                .options(
+                    selectinload(ProductLines.products),
+                    selectinload(ProductLines.brand),
+                    selectinload(ProductLines.category),
+                ),
+            "changed": lambda: [
+                ProductLines.updated_at > EmbeddingState.updated_at,
+                Brand.updated_at > EmbeddingState.updated_at,
+                Category.updated_at > EmbeddingState.updated_at,
+                exists().where(
+                    Product.product_line_id == ProductLines.id,
+                    Product.updated_at > EmbeddingState.updated_at,
+                ),
+            ],
+        },
+    ]
+
+
+async def find_changed_items(session, source: dict, model: str, full: bool, page_size: int):
+    """Đọc theo page (keyset trên id), trả về từng page item kèm `content_hash` và hash đang lưu."""
+    entity = source["entity"]
+    stmt = source["query"].outerjoin(
+        EmbeddingState,
+        and_(EmbeddingState.entity_id == entity.id, EmbeddingState.collection == source["collection"]),
+    )
+    if not full:
+        stmt = stmt.where(or_(EmbeddingState.id.is_(None), EmbeddingState.model != model, *source["changed"]()))
+    store = EmbeddingStateStore(session, source["collection"], model)
+
+    last_id = None
+    while True:
+        page_stmt = stmt if last_id is None else stmt.where(entity.id > last_id)
+        results = await session.execute(page_stmt.order_by(entity.id).limit(page_size))
+        rows = results.scalars().unique().all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        items = [source["text"](row) for row in rows]
+        for item in items:
+            item["content_hash"] = content_hash(item["text"])
+        yield items, await store.get_hashes([item["id"] for item in items])
+
+
+@shared_task
+def enqueue_text(text_data: dict, lane: str = "background"):
+    push_to_queue(text_data, lane)
+
+
+async def find_pending_items(session, batch: list[dict]) -> dict[str, list[dict]]:
+    """
+    Item cần embed của một batch từ queue, theo collection:
+    - bỏ item có hash trùng với embedding_states (đã embed, vd. bị enqueue hai lần)
+    - item trùng id trong batch chỉ giữ bản cuối
+    """
+    collections = catalog_collections()
+    items = {}
+    for it in batch:
+        it.setdefault("content_hash", content_hash(it["text"]))
+        items[(item_collection(it, collections), it["id"])] = it
+
+    pending = {}
+    for collection_name in {collection_name for collection_name, _ in items}:
+        store = EmbeddingStateStore(session, collection_name, settings.OPENAI_EMBEDDING_MODEL)
+        candidates = [it for (name, _), it in items.items() if name == collection_name]
+        hashes = await store.get_hashes([it["id"] for it in candidates])
+        pending[collection_name] = [it for it in candidates if hashes.get(it["id"]) != it["content_hash"]]
+    return pending
+
+
+async def store_batch(idx: int, batch: list[dict], pending: dict[str, list[dict]], vectors: dict[str, asyncio.Future]):
+    """Chờ vector của batch rồi upsert vào chroma (trong thread, không chặn các request embedding khác)."""
+    total = sum(len(collection_items) for collection_items in pending.values())
+    with tracer.start_as_current_span(
+        "embedding.batch",
+        links=links_from([it.get("trace_context") for it in batch]),
+        attributes={
+            "embedding.batch_index": idx,
+            "embedding.batch_size": len(batch),
+            "embedding.changed": total,
+            "embedding.texts": len(vectors),
+        },
+    ):
+        embedded = dict(zip(vectors, await asyncio.gather(*vectors.values())))
+        async with AsyncSessionLocal() as session:
+            for collection_name, collection_items in pending.items():
+                if not collection_items:
+                    continue
+                ids = [it["id"] for it in collection_items]
+                documents = [it["text"] for it in collection_items]
+                metadatas = [
+                    product_group_metadata(it) if it.get("level") else product_metadata(it)
+                    for it in collection_items
+                ]
+                with tracer.start_as_current_span(
+                    "embedding.store", attributes={"embedding.collection": collection_name}
+                ):
+                    await asyncio.to_thread(
+                        get_collection(collection_name).upsert,
+                        ids=ids,
+                        embeddings=[embedded[it["content_hash"]] for it in collection_items],
+                        documents=documents,
+                        metadatas=metadatas,
+                    )
+                store = EmbeddingStateStore(session, collection_name, settings.OPENAI_EMBEDDING_MODEL)
+                await store.save({it["id"]: it["content_hash"] for it in collection_items})
+                # collection của version đang build (reindex) chưa phục vụ API nên không publish
+                if collection_name == collection_aliases.resolve(settings.COLLECTION_NAME):
+                    publish_catalog_update("upsert", ids, documents, metadatas)
+    log.info(f"Stored batch {idx}: {total} items")
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.process_embedding_queue")
+def process_embedding_queue(max_failures: int = 3, lanes: list[str] = None):
+    """
+    Đọc embedding stream theo batch qua consumer group, nhiều worker có thể chạy song song (at-least-once).
+    Các batch chạy theo pipeline: request embedding gom theo token của nhiều batch (EmbeddingPipeline),
+    batch nào có đủ vector thì ghi chroma ngay trong khi request của batch sau vẫn đang chạy.
+    Batch chỉ được ack sau khi đã upsert vào chroma; batch lỗi giữ pending để lần sau claim lại,
+    lỗi liên tiếp `max_failures` lần (vd. provider đang lỗi) thì dừng, để lần chạy sau thử lại.
+    Mỗi batch lấy từ lane ưu tiên cao nhất còn job, `lanes` giới hạn lane được xử lý (vd. flush lane interactive).
+    """
+    migrate_legacy_queue()
+    consumer = queue_consumer_name()
+
+    async def async_task():
+        pipeline = EmbeddingPipeline(
+            client=embedding_client,
+            model=settings.OPENAI_EMBEDDING_MODEL,
+            concurrency=settings.EMBEDDING_CONCURRENCY,
+            max_tokens=settings.EMBEDDING_REQUEST_MAX_TOKENS,
+            max_inputs=settings.EMBEDDING_REQUEST_MAX_INPUTS,
+        )
+        inflight: dict[asyncio.Task, tuple[int, list[str]]] = {}
+        processed = failures = 0
+
+        def collect(done):
+            nonlocal processed, failures
+            for task in done:
+                idx, refs = inflight.pop(task)
+                if task.exception() is not None:
+                    failures += 1
+                    log.error(f"Batch {idx} failed ({len(refs)} items left pending): {task.exception()}")
+                else:
+                    ack_messages(refs)
+                    processed += len(refs)
+                    failures = 0
+
+        def touch_running():
+            # batch đang xử lý lâu (chờ gom request, backoff): giữ cho message không bị worker khác coi là stale
+            running = sorted(ref for _, refs in inflight.values() for ref in refs)
+            if running:
+                touch_messages(consumer, running)
+
+        async def wait_inflight(return_when: str):
+            while inflight:
+                done, _ = await asyncio.wait(
+                    inflight, timeout=EMBEDDING_CLAIM_IDLE_MS / 2000, return_when=return_when
                 )
-            )
-            variants = results.scalars().unique().all()
+                collect(done)
+                if done and return_when == asyncio.FIRST_COMPLETED:
+                    return
+                touch_running()
+
+        try:
+            async with AsyncSessionLocal() as session:
+                idx = 0
+                while failures < max_failures:
+                    touch_running()
+                    # không claim lại message đang xử lý của chính worker này
+                    running = {ref for _, refs in inflight.values() for ref in refs}
+                    messages = claim_stale_batch(consumer, lanes=lanes, exclude=running) or read_batch(
+                        consumer, lanes=lanes
+                    )
+                    if not messages:
+                        break
+                    refs = [ref for ref, _ in messages]
+                    # item None: job đã được xử lý qua message ở lane khác
+                    batch = [item for _, item in messages if item is not None]
+                    try:
+                        pending = await find_pending_items(session, batch)
+                    except Exception as e:
+                        await session.rollback()
+                        failures += 1
+                        log.error(f"Batch {idx} failed ({len(messages)} items left pending): {e}")
+                        idx += 1
+                        continue
 
-        log.info(f"Processing {len(variants)} product variants for unembedding")
-        for variant in variants:
-            variant_text = generate_product_text(variant)
-            enqueue_text(variant_text)
+                    texts = {it["content_hash"]: it["text"] for it in sum(pending.values(), [])}
+                    if not texts:
+                        ack_messages(refs)
+                        processed += len(refs)
+                        idx += 1
+                        continue
+                    log.info(f"Processing batch {idx}: {len(batch)} items, {len(texts)} texts to embed")
+                    task = asyncio.create_task(store_batch(idx, batch, pending, pipeline.submit(texts)))
+                    inflight[task] = (idx, refs)
+                    idx += 1
+
+                    if len(inflight) >= settings.EMBEDDING_PIPELINE_MAX_BATCHES:
+                        # request chưa đầy cũng gửi, nếu không các batch đang chờ sẽ không bao giờ xong
+                        pipeline.flush()
+                        await wait_inflight(asyncio.FIRST_COMPLETED)
+
+            pipeline.flush()
+            await wait_inflight(asyncio.ALL_COMPLETED)
+        finally:
+            await pipeline.close()
+        log.info(f"Embedding pipeline: {pipeline.stats}")
+        return processed
+
+    processed = asyncio.run(async_task())
+    return log.info(f"Processed {processed} items")
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.process_unembedding_queue")
+def process_unembedding_queue(full: bool = False, page_size: int = 500):
+    """
+    Đưa variant/product/product line có text thay đổi (khác hash trong embedding_states) vào embedding queue.
+    Mặc định chỉ xét row mới hoặc có updated_at sau lần kiểm tra trước;
+    `full=True` hash lại toàn bộ để bắt thay đổi không cập nhật updated_at (vd. bỏ tag khỏi variant).
+    """
+    async def async_task():
+        model = settings.OPENAI_EMBEDDING_MODEL
+        async with AsyncSessionLocal() as session:
+            for source in embedding_sources():
+                store = EmbeddingStateStore(session, source["collection"], model)
+                queued = unchanged = 0
+                async for items, hashes in find_changed_items(session, source, model, full, page_size):
+                    # chưa có state (dữ liệu embed trước khi có bảng này): so với document đang lưu trong chroma
+                    missing = [item["id"] for item in items if item["id"] not in hashes]
+                    if missing:
+                        stored = get_collection(source["collection"]).get(ids=missing, include=["documents"])
+                        existing = {
+                            doc_id: content_hash(document)
+                            for doc_id, document in zip(stored.get("ids") or [], stored.get("documents") or [])
+                            if document is not None
+                        }
+                        backfill = {
+                            item["id"]: item["content_hash"]
+                            for item in items
+                            if existing.get(item["id"]) == item["content_hash"]
+                        }
+                        await store.save(backfill)
+                        hashes.update(backfill)
+
+                    same = [item["id"] for item in items if hashes.get(item["id"]) == item["content_hash"]]
+                    await store.touch(same)
+                    unchanged += len(same)
+                    for item in items:
+                        if hashes.get(item["id"]) != item["content_hash"]:
+                            enqueue_text(item)
+                            queued += 1
+                log.info(
+                    f"{source['entity'].__tablename__}: {queued} changed items queued, {unchanged} unchanged"
+                )
 
     asyncio.run(async_task())
 
 
-def clear_collection(collection_embedding):
-    ids = collection_embedding.get()["ids"]
-    if ids:
-        collection_embedding.delete(ids=ids)
+async def resolve_catalog_changes(session, events: list[dict]) -> tuple[dict[str, set], dict[str, set]]:
+    """
+    Chuyển event NOTIFY (bảng, thao tác, id) thành entity cần embed lại và document cần xóa:
+    - brand/category -> product line -> product -> variant (tên cha nằm trong text của con)
+    - variant đổi thì text mức product (options, giá) cũng đổi, product đổi thì text mức line đổi
+    Trả về ({"variant"|"product"|"line": ids cần upsert}, {collection: ids cần xóa}).
+    """
+    ids = {table: set() for table in ("brands", "categories", "tags", "product_lines", "products", "product_variants")}
+    deleted = {settings.COLLECTION_NAME: set(), settings.PRODUCT_GROUP_COLLECTION: set()}
+    parent_products, parent_lines = set(), set()
+    for event in events:
+        table, op = event["table"], event["op"]
+        if table == "product_variant_tags":
+            ids["product_variants"].add(event["variant_id"])
+            continue
+        if op == "DELETE" and table in ("product_variants", "products", "product_lines"):
+            collection = settings.COLLECTION_NAME if table == "product_variants" else settings.PRODUCT_GROUP_COLLECTION
+            deleted[collection].add(event["id"])
+        else:
+            ids[table].add(event["id"])
+        # text của product/line cha liệt kê tên các con
+        if event.get("product_id") and table == "product_variants":
+            parent_products.add(event["product_id"])
+        if event.get("product_line_id") and table == "products":
+            parent_lines.add(event["product_line_id"])
+
+    async def select_ids(column, condition) -> set[str]:
+        results = await session.execute(select(column).where(condition))
+        return {str(value) for value in results.scalars().all()}
+
+    lines = set(ids["product_lines"])
+    if ids["brands"] or ids["categories"]:
+        lines |= await select_ids(
+            ProductLines.id,
+            or_(ProductLines.brand_id.in_(ids["brands"]), ProductLines.category_id.in_(ids["categories"])),
+        )
+    products = set(ids["products"])
+    if lines:
+        products |= await select_ids(Product.id, Product.product_line_id.in_(lines))
+    variants = set(ids["product_variants"])
+    if products:
+        variants |= await select_ids(ProductVariant.id, ProductVariant.product_id.in_(products))
+    if ids["tags"]:
+        variants |= await select_ids(ProductVariantTag.variant_id, ProductVariantTag.tag_id.in_(ids["tags"]))
+
+    upserts = {
+        "variant": variants - deleted[settings.COLLECTION_NAME],
+        "product": (products | parent_products) - deleted[settings.PRODUCT_GROUP_COLLECTION],
+        "line": (lines | parent_lines) - deleted[settings.PRODUCT_GROUP_COLLECTION],
+    }
+    return upserts, deleted
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.sync_catalog_changes")
+def sync_catalog_changes(events: list[dict]):
+    """Nhận event từ catalog listener: enqueue text của entity bị ảnh hưởng, xóa document của entity đã bị xóa."""
+    # thay đổi không làm đổi text embed (vd. stock) vẫn làm câu trả lời trong semantic cache bị cũ
+    bump_catalog_version()
+
+    async def async_task():
+        model = settings.OPENAI_EMBEDDING_MODEL
+        async with AsyncSessionLocal() as session:
+            upserts, deleted = await resolve_catalog_changes(session, events)
+
+            for collection_name, entity_ids in deleted.items():
+                if not entity_ids:
+                    continue
+                entity_ids = sorted(entity_ids)
+                get_collection(collection_name).delete(ids=entity_ids)
+                await EmbeddingStateStore(session, collection_aliases.resolve(collection_name), model).delete(entity_ids)
+                if collection_name == settings.COLLECTION_NAME:
+                    publish_catalog_update("delete", entity_ids)
+
+            items = []
+            for source in embedding_sources():
+                entity_ids = upserts[source["level"]]
+                if not entity_ids:
+                    continue
+                results = await session.execute(source["query"].where(source["entity"].id.in_(entity_ids)))
+                items += [source["text"](row) for row in results.scalars().unique().all()]
+
+        # sửa lẻ đi lane interactive (flush sau vài trăm ms), thay đổi lan ra cả catalog (vd. đổi tên brand) là backfill
+        lane = "interactive" if len(items) <= settings.EMBEDDING_FLUSH_MAX_ITEMS else "background"
+        for item in items:
+            # hash không đổi (vd. chỉ updated_at đổi) thì process_embedding_queue bỏ qua
+            enqueue_text(item, lane=lane)
+        log.info(
+            f"Catalog changes: {len(events)} events, {len(items)} items queued ({lane}), "
+            f"{sum(len(ids) for ids in deleted.values())} documents deleted"
+        )
+        return lane if items else None
+
+    if asyncio.run(async_task()) == "background":
+        process_embedding_queue.delay()
+
+
+async def build_collection_version(targets: dict[str, str], page_size: int = 500) -> int:
+    """
+    Embed catalog vào các collection `targets` (version chưa phục vụ), theo embedding_states của chính collection đó:
+    lần đầu embed toàn bộ, chạy lại (tiếp tục sau lỗi, hoặc lượt bù sau khi build xong) chỉ embed row đã đổi.
+    """
+    model = settings.OPENAI_EMBEDDING_MODEL
+    pipeline = EmbeddingPipeline(
+        client=embedding_client,
+        model=model,
+        concurrency=settings.EMBEDDING_CONCURRENCY,
+        max_tokens=settings.EMBEDDING_REQUEST_MAX_TOKENS,
+        max_inputs=settings.EMBEDDING_REQUEST_MAX_INPUTS,
+    )
+    inflight = set()
+    embedded = 0
+    try:
+        async with AsyncSessionLocal() as session:
+            for source in embedding_sources(targets):
+                store = EmbeddingStateStore(session, source["collection"], model)
+                async for items, hashes in find_changed_items(session, source, model, False, page_size):
+                    await store.touch([it["id"] for it in items if hashes.get(it["id"]) == it["content_hash"]])
+                    pending = [it for it in items if hashes.get(it["id"]) != it["content_hash"]]
+                    if not pending:
+                        continue
+                    texts = {it["content_hash"]: it["text"] for it in pending}
+                    inflight.add(asyncio.create_task(
+                        store_batch(embedded, pending, {source["collection"]: pending}, pipeline.submit(texts))
+                    ))
+                    embedded += len(pending)
+                    if len(inflight) >= settings.EMBEDDING_PIPELINE_MAX_BATCHES:
+                        pipeline.flush()
+                        done, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            task.result()
+        pipeline.flush()
+        if inflight:
+            await asyncio.gather(*inflight)
+    finally:
+        await pipeline.close()
+    return embedded
+
+
+async def reconcile_collection_version(targets: dict[str, str], page_size: int = 500) -> dict:
+    """
+    Xóa document của row đã bị xóa trong lúc build (quét orphan theo page),
+    trả về {collection: expected, count, missing, removed}.
+    """
+    report = {}
+    async with AsyncSessionLocal() as session:
+        expected = {collection_name: 0 for collection_name in targets.values()}
+        for source in embedding_sources(targets):
+            expected[source["collection"]] += await session.scalar(
+                select(func.count()).select_from(source["ids"].subquery())
+            )
+    for collection_name, expected_count in expected.items():
+        progress = await prune_orphan_embeddings(collection_name, targets, page_size, resume=False)
+        count = get_collection(collection_name).count()
+        report[collection_name] = {
+            "expected": expected_count,
+            "count": count,
+            "missing": max(0, expected_count - count),
+            "removed": progress["deleted"],
+        }
+    return report
+
+
+def sample_recall(collection_name: str, sample_size: int = 50, k: int = 5) -> float | None:
+    """
+    Lấy ngẫu nhiên `sample_size` variant, dùng tên variant làm query:
+    tỉ lệ query có chính variant đó (hoặc variant cùng tên) trong top `k`.
+    """
+    collection = get_collection(collection_name)
+    total = collection.count()
+    if not total:
+        return None
+    page = collection.get(
+        include=["metadatas"], limit=sample_size, offset=random.randint(0, max(0, total - sample_size))
+    )
+    queries = [
+        (doc_id, meta["name"]) for doc_id, meta in zip(page["ids"], page["metadatas"]) if meta and meta.get("name")
+    ]
+    if not queries:
+        return None
+    with unwrap_rate_limit():
+        response = embedding_client.embeddings.create(
+            model=settings.OPENAI_EMBEDDING_MODEL, input=[name for _, name in queries]
+        )
+    vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    results = collection.query(query_embeddings=vectors, n_results=k, include=["metadatas"])
+    hits = sum(
+        1
+        for (doc_id, name), ids, metadatas in zip(queries, results["ids"], results["metadatas"])
+        if doc_id in ids or any((meta or {}).get("name") == name for meta in metadatas)
+    )
+    return hits / len(queries)
+
+
+def activate_collections(targets: dict[str, str]):
+    collection_aliases.switch(targets)
+    # API worker load lại index từ collection mới, row sửa sau lượt bù của reindex được embed vào version mới
+    publish_catalog_update("reload", [])
+    process_unembedding_queue.delay()
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.reindex_collections")
+def reindex_collections(
+    version: int = None,
+    page_size: int = 500,
+    sample_size: int = settings.REINDEX_SAMPLE_SIZE,
+    min_recall: float = settings.REINDEX_MIN_RECALL,
+    switch: bool = True,
+) -> dict:
+    """
+    Blue/green reindex product collections (sau khi đổi embedding model hoặc template text):
+    1. build `<alias>__v<version>` trong nền, API vẫn đọc version đang phục vụ; `version` để tiếp tục lần build lỗi
+    2. lượt bù cho row sửa trong lúc build, xóa document của row đã bị xóa
+    3. kiểm tra số document khớp DB và recall trên mẫu
+    4. đạt thì switch alias (atomic), version cũ giữ lại để rollback
+    """
+    live = catalog_collections()
+    version = version or collection_aliases.next_version()
+    targets = {alias: versioned_name(alias, version) for alias in live}
+    for alias, collection_name in targets.items():
+        # cùng hnsw:space với version đang phục vụ
+        get_collection(collection_name, metadata=get_collection(live[alias]).metadata or None)
+    log.info(f"Reindexing {live} into {targets}")
+
+    embedded = asyncio.run(build_collection_version(targets, page_size))
+    caught_up = asyncio.run(build_collection_version(targets, page_size))
+    collections = asyncio.run(reconcile_collection_version(targets, page_size))
+    recall = sample_recall(targets[settings.COLLECTION_NAME], sample_size)
+
+    valid = all(
+        stats["missing"] == 0 and stats["count"] == stats["expected"] for stats in collections.values()
+    ) and (recall is None or recall >= min_recall)
+    report = {
+        "version": version,
+        "live": live,
+        "targets": targets,
+        "embedded": embedded,
+        "caught_up": caught_up,
+        "collections": collections,
+        "recall": recall,
+        "valid": valid,
+        "switched": bool(valid and switch),
+    }
+    if report["switched"]:
+        activate_collections(targets)
+    elif not valid:
+        log.error(f"Reindex v{version} failed validation, still serving {live}: {report}")
+    log.info(f"Reindex report: {report}")
+    return report
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.switch_collections")
+def switch_collections(version: int) -> dict:
+    """Chuyển alias sang version đã build (vd. reindex với switch=False)."""
+    targets = {alias: versioned_name(alias, version) for alias in catalog_collections()}
+    existing = set(list_collection_names())
+    missing = [collection_name for collection_name in targets.values() if collection_name not in existing]
+    if missing:
+        raise ValueError(f"Collections {missing} do not exist")
+    activate_collections(targets)
+    return targets
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.rollback_collections")
+def rollback_collections() -> dict:
+    """Quay lại version phục vụ trước lần switch gần nhất (rollback lần nữa là về lại version mới)."""
+    if not collection_aliases.rollback():
+        raise ValueError("No previous collection version to roll back to")
+    publish_catalog_update("reload", [])
+    # các thay đổi trong lúc version mới phục vụ chưa có trong version cũ
+    process_unembedding_queue.delay()
+    return catalog_collections()
+
+
+def list_collection_names() -> list[str]:
+    return [getattr(collection, "name", collection) for collection in get_chroma_client().list_collections()]
+
+
+def collection_versions() -> dict[str, list[dict]]:
+    """Các version của từng alias trong chroma, đánh dấu version đang phục vụ và version để rollback."""
+    aliases = [settings.COLLECTION_NAME, settings.PRODUCT_GROUP_COLLECTION]
+    live = collection_aliases.resolve_all(aliases)
+    previous = collection_aliases.previous(aliases)
+    names = list_collection_names()
+    versions = {}
+    for alias in aliases:
+        versions[alias] = sorted(
+            (
+                {
+                    "version": collection_version(alias, collection_name),
+                    "collection": collection_name,
+                    "count": get_collection(collection_name).count(),
+                    "live": collection_name == live[alias],
+                    "previous": collection_name == previous[alias],
+                }
+                for collection_name in names
+                if collection_version(alias, collection_name) is not None
+            ),
+            key=lambda item: item["version"],
+        )
+    return versions
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.drop_collection_versions")
+def drop_collection_versions() -> list[str]:
+    """Xóa các version không phục vụ và không dùng để rollback (kèm embedding_states của chúng)."""
+    dropped = [
+        item["collection"]
+        for items in collection_versions().values()
+        for item in items
+        if not item["live"] and not item["previous"]
+    ]
+    for collection_name in dropped:
+        get_chroma_client().delete_collection(collection_name)
+    asyncio.run(clear_embedding_states(dropped))
+    log.info(f"Dropped collection versions {dropped}")
+    return dropped
+
+
+def maintenance_job(collection, job: str, page_size: int = None, on_delete=None) -> CollectionMaintenanceJob:
+    return CollectionMaintenanceJob(
+        collection,
+        catalog_redis_client,
+        job,
+        page_size=page_size or settings.COLLECTION_MAINTENANCE_PAGE_SIZE,
+        delete_batch_size=settings.COLLECTION_MAINTENANCE_DELETE_BATCH_SIZE,
+        on_delete=on_delete,
+    )
+
+
+def collection_cleanup(collection_name: str):
+    """
+    Dọn dữ liệu đi kèm document bị xóa khỏi `collection_name`:
+    - product collections (mọi version): xóa embedding_states để lần quét sau embed lại nếu row còn,
+      version đang phục vụ thì báo API worker bỏ document khỏi index in-process
+    - semantic cache: xóa id khỏi index TTL trong Redis
+    """
+    if collection_name == settings.SEMANTIC_CACHE_COLLECTION:
+        return lambda ids: catalog_redis_client.zrem(SEMANTIC_CACHE_INDEX_KEY, *ids)
+    aliases = [settings.COLLECTION_NAME, settings.PRODUCT_GROUP_COLLECTION]
+    if all(collection_version(alias, collection_name) is None for alias in aliases):
+        return None
+
+    async def on_delete(ids: list[str]):
+        async with AsyncSessionLocal() as session:
+            await EmbeddingStateStore(session, collection_name, settings.OPENAI_EMBEDDING_MODEL).delete(ids)
+        if collection_name == collection_aliases.resolve(settings.COLLECTION_NAME):
+            publish_catalog_update("delete", ids)
+
+    return on_delete
+
+
+def clear_collection(collection_embedding, on_delete=None, resume: bool = True) -> dict:
+    # xóa theo page (chỉ đọc id), không load document/metadata của cả collection vào memory
+    return asyncio.run(maintenance_job(collection_embedding, "clear", on_delete=on_delete).delete_where(resume=resume))
+
+
+async def prune_orphan_embeddings(
+    collection_name: str, collections: dict[str, str] = None, page_size: int = None, resume: bool = True
+) -> dict:
+    """Xóa document của `collection_name` (product collection) không còn row tương ứng trong DB."""
+    sources = [source for source in embedding_sources(collections) if source["collection"] == collection_name]
+
+    async def select_orphans(page: dict) -> list[str]:
+        valid = []
+        for doc_id in page["ids"]:
+            try:
+                valid.append(uuid.UUID(doc_id))
+            except ValueError:
+                pass
+        existing = set()
+        async with AsyncSessionLocal() as session:
+            for source in sources:
+                results = await session.execute(source["ids"].where(source["entity"].id.in_(valid)))
+                existing |= {str(entity_id) for entity_id in results.scalars().all()}
+        return [doc_id for doc_id in page["ids"] if doc_id not in existing]
+
+    job = maintenance_job(
+        get_collection(collection_name), "orphans", page_size, on_delete=collection_cleanup(collection_name)
+    )
+    return await job.prune(select_orphans, resume=resume)
+
+
+def prune_semantic_cache_index(page_size: int = None) -> int:
+    """Xóa id trong index TTL của semantic cache mà document đã không còn trong chroma (quét index bằng ZSCAN)."""
+    collection = get_collection(settings.SEMANTIC_CACHE_COLLECTION)
+    cursor, removed = 0, 0
+    while True:
+        cursor, members = catalog_redis_client.zscan(
+            SEMANTIC_CACHE_INDEX_KEY, cursor, count=page_size or settings.COLLECTION_MAINTENANCE_PAGE_SIZE
+        )
+        ids = [member.decode() if isinstance(member, bytes) else member for member, _ in members]
+        if ids:
+            stored = set(collection.get(ids=ids, include=[])["ids"])
+            missing = [entry_id for entry_id in ids if entry_id not in stored]
+            if missing:
+                catalog_redis_client.zrem(SEMANTIC_CACHE_INDEX_KEY, *missing)
+                removed += len(missing)
+        if cursor == 0:
+            return removed
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.delete_collection_entries")
+def delete_collection_entries(collection_name: str, where: dict = None, resume: bool = True) -> dict:
+    """Xóa document khớp metadata filter `where` của chroma (không có `where` là xóa trắng) theo page."""
+    collection = get_collection(collection_name)
+    job = maintenance_job(collection, "delete", on_delete=collection_cleanup(collection.name))
+    return asyncio.run(job.delete_where(where, resume))
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.compact_semantic_cache")
+def compact_semantic_cache(resume: bool = True) -> dict:
+    """
+    Xóa entry semantic cache không thể match nữa: hết TTL hoặc thuộc catalog version cũ
+    (evict lúc store chỉ xóa theo TTL/max_items, entry của catalog version cũ nằm lại tới khi hết TTL).
+    """
+    version = int(catalog_redis_client.get(CATALOG_INDEX_VERSION_KEY) or 0)
+    where = {"$or": [
+        {"created_at": {"$lt": int(time.time()) - settings.SEMANTIC_CACHE_TTL}},
+        {"catalog_version": {"$ne": version}},
+    ]}
+    collection = get_collection(settings.SEMANTIC_CACHE_COLLECTION)
+    job = maintenance_job(collection, "compact", on_delete=collection_cleanup(settings.SEMANTIC_CACHE_COLLECTION))
+    return asyncio.run(job.delete_where(where, resume))
+
+
+@celery_app.task(name="src.tasks.embedding_tasks.cleanup_orphan_embeddings")
+def cleanup_orphan_embeddings(resume: bool = True) -> dict:
+    """
+    Dọn orphan theo page:
+    - document trong product collections đang phục vụ không còn row trong DB (CDC bị lỡ event xóa)
+    - entry semantic cache không có trong index TTL (không bao giờ bị evict) và ngược lại
+    """
+    collections = catalog_collections()
+    report = {
+        collection_name: asyncio.run(prune_orphan_embeddings(collection_name, collections, resume=resume))
+        for collection_name in collections.values()
+    }
+    # entry vừa add chưa kịp ghi vào index thì chưa tính là orphan
+    indexed_before = int(time.time()) - 60
+
+    def select_unindexed(page: dict) -> list[str]:
+        pipe = catalog_redis_client.pipeline()
+        for entry_id in page["ids"]:
+            pipe.zscore(SEMANTIC_CACHE_INDEX_KEY, entry_id)
+        return [
+            entry_id
+            for entry_id, metadata, score in zip(page["ids"], page["metadatas"], pipe.execute())
+            if score is None and (metadata or {}).get("created_at", 0) < indexed_before
+        ]
+
+    collection = get_collection(settings.SEMANTIC_CACHE_COLLECTION)
+    report[settings.SEMANTIC_CACHE_COLLECTION] = asyncio.run(
+        maintenance_job(collection, "orphans").prune(select_unindexed, include=["metadatas"], resume=resume)
+    )
+    report[settings.SEMANTIC_CACHE_COLLECTION]["index_removed"] = prune_semantic_cache_index()
+    return report
+
+
+async def clear_embedding_states(collection_names: list[str]):
+    async with AsyncSessionLocal() as session:
+        for collection_name in collection_names:
+            await EmbeddingStateStore(session, collection_name, settings.OPENAI_EMBEDDING_MODEL).clear()
 
 
 @celery_app.task(name="src.tasks.embedding_tasks.clear_product_embedding")
 def clear_product_embedding():
-    clear_collection(collection)
+    clear_collection(get_collection())
+    clear_collection(get_collection(settings.PRODUCT_GROUP_COLLECTION))
+    asyncio.run(clear_embedding_states(list(catalog_collections().values())))
+    publish_catalog_update("clear", [])
 
 
 @celery_app.task(name="src.tasks.embedding_tasks.clear_history_chat_embedding")
 def clear_history_chat_embedding():
-    clear_collection(chat_history_collection)
+    clear_collection(get_collection(settings.CHAT_HISTORY_COLLECTION))
 
 
 @celery_app.task(name="src.tasks.embedding_tasks.clear_semantic_cached_embedding")
 def clear_semantic_cached_embedding():
-    clear_collection(semantic_cached_collection)
+    clear_collection(
+        get_collection(settings.SEMANTIC_CACHE_COLLECTION),
+        on_delete=collection_cleanup(settings.SEMANTIC_CACHE_COLLECTION),
+    )
@@ -0,0 +1,133 @@
+# app/tasks/history_tasks.py
+import asyncio
+import json
+import logging
+import time
+
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+
+from src.config import settings
+from src.tasks.celery_app import celery_app
+from src.services.history_services import ChatHistoryStore
+from src.tools.client import get_chroma_client
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+MIGRATION_OFFSET_KEY = "chat:history:migration_offset"
+# mốc thời gian cho document cũ không lưu created_at, cố định từ lần chạy đầu để resume cho cùng giá trị.
+# Lấy trước message sớm nhất đang có trong store để history cũ không bị xếp sau message live
+MIGRATION_STARTED_AT_KEY = "chat:history:migration_started_at"
+
+
+def source_created_at(data: dict, meta: dict | None) -> float | None:
+    """created_at gốc của message (metadata của chroma hoặc trong document), None nếu không có."""
+    for value in ((meta or {}).get("created_at"), data.get("History", {}).get("data", {}).get("created_at")):
+        try:
+            if value is not None:
+                return float(value)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+async def legacy_started_at(redis: Redis, store: ChatHistoryStore) -> float:
+    """Mốc cho document cũ không có created_at: lúc migrate, hoặc sớm hơn nếu store đã live có message trước đó."""
+    started_at = time.time()
+    async for key in redis.scan_iter(match=store.key("*"), count=1000, _type="list"):
+        first = await redis.lindex(key, 0)
+        if first:
+            started_at = min(started_at, json.loads(first).get("created_at", started_at))
+    return started_at
+
+
+async def write_page(redis: Redis, store: ChatHistoryStore, offset: int, count: int, sessions: dict) -> bool:
+    """
+    Ghi message của một page và offset mới (`offset + count`) trong một transaction, False nếu page đã được
+    lần chạy khác ghi. Session đã có message (store đã live) thì trộn theo created_at rồi ghi lại cả list,
+    để message live không bị xếp trước history cũ và bị LTRIM cắt mất.
+    """
+    keys = [store.key(session_id) for session_id in sessions if session_id]
+    while True:
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(MIGRATION_OFFSET_KEY, *keys)
+                if int(await pipe.get(MIGRATION_OFFSET_KEY) or 0) != offset:
+                    return False
+                current = {
+                    session_id: await pipe.lrange(store.key(session_id), 0, -1)
+                    for session_id in sessions if session_id
+                }
+                pipe.multi()
+                for session_id, messages in sessions.items():
+                    if not session_id:
+                        continue
+                    if current[session_id]:
+                        existing = [json.loads(item) for item in current[session_id]]
+                        messages = sorted(existing + messages, key=lambda message: message.get("created_at", 0))
+                        pipe.delete(store.key(session_id))
+                    store.queue_append(pipe, session_id, *messages)
+                pipe.set(MIGRATION_OFFSET_KEY, offset + count)
+                await pipe.execute()
+                return True
+        except WatchError:
+            # session vừa nhận message live (hoặc offset đổi): đọc lại và trộn lại
+            continue
+
+
+@celery_app.task(name="src.tasks.history_tasks.migrate_chat_history")
+def migrate_chat_history(page_size: int = 500):
+    """
+    Copy chat history từ chroma collection `CHAT_HISTORY_COLLECTION` sang Redis history store.
+    Message của một page và offset mới được ghi trong cùng một transaction, chết giữa chừng thì chạy lại
+    resume từ page chưa ghi mà không lặp message. WATCH offset nên hai lần chạy song song không ghi trùng page.
+    created_at giữ theo document gốc; document không có thì lấy mốc trước lúc migrate và trước message live sớm nhất,
+    tăng dần theo thứ tự insert.
+    Chạy được khi store đã live: session đã có message mới thì history cũ được trộn vào theo created_at.
+    """
+    async def async_task():
+        redis = Redis(host="redis", port=6379, db=0)
+        store = ChatHistoryStore(
+            redis=redis,
+            max_stored_items=settings.CHAT_HISTORY_MAX_STORED_ITEMS,
+            ttl=settings.CHAT_HISTORY_TTL,
+        )
+        collection = get_chroma_client().get_or_create_collection(settings.CHAT_HISTORY_COLLECTION)
+        total = collection.count()
+        if not await redis.exists(MIGRATION_STARTED_AT_KEY):
+            await redis.set(MIGRATION_STARTED_AT_KEY, await legacy_started_at(redis, store), nx=True)
+        started_at = float(await redis.get(MIGRATION_STARTED_AT_KEY))
+        offset = int(await redis.get(MIGRATION_OFFSET_KEY) or 0)
+        log.info(f"Migrating chat history from offset {offset}/{total}")
+
+        while offset < total:
+            # chroma trả document theo thứ tự insert nên thứ tự message trong session được giữ nguyên
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            documents = page.get("documents") or []
+            if not documents:
+                break
+            metadatas = page.get("metadatas") or [None] * len(documents)
+
+            sessions = {}
+            for position, (doc, meta) in enumerate(zip(documents, metadatas), start=offset):
+                data = json.loads(doc)
+                hist = data.get("History", {})
+                hist_data = hist.get("data", {})
+                extra = {"enhanced_content": hist_data["enhanced_content"]} if "enhanced_content" in hist_data else {}
+                created_at = source_created_at(data, meta) or started_at - (total - position) / 1000
+                message = store.build_message(
+                    hist.get("type", "human"), hist_data.get("content", ""), created_at=created_at, **extra
+                )
+                sessions.setdefault(data.get("SessionId"), []).append(message)
+
+            if not await write_page(redis, store, offset, len(documents), sessions):
+                log.warning(f"Chat history offset {offset} was migrated by another run, stopping")
+                break
+
+            offset += len(documents)
+            log.info(f"Migrated {offset}/{total} chat history documents")
+
+        await redis.aclose()
+
+    asyncio.run(async_task())
@@ -1,19 +1,340 @@
 import json
+import logging
+import os
+import socket
+import time
+
 import redis
 
-from src.constants import BATCH_EMBEDDING_SIZE
+from src.constants import (
+    BATCH_EMBEDDING_SIZE,
+    CATALOG_INDEX_VERSION_KEY,
+    CATALOG_UPDATES_CHANNEL,
+    EMBEDDING_STREAM,
+    EMBEDDING_INTERACTIVE_STREAM,
+    EMBEDDING_LANES,
+    EMBEDDING_JOBS_KEY,
+    EMBEDDING_JOB_LANES_KEY,
+    EMBEDDING_INFLIGHT_KEY,
+    EMBEDDING_FLUSH_KEY,
+    EMBEDDING_CONSUMER_GROUP,
+    EMBEDDING_DEAD_LETTER_STREAM,
+    EMBEDDING_CLAIM_IDLE_MS,
+    EMBEDDING_MAX_DELIVERIES,
+)
+from src.config import settings
+from src.tasks.celery_app import celery_app
+from src.tools.telemetry import inject_context
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
 
+# list dùng trước khi chuyển sang redis stream
+LEGACY_EMBEDDING_QUEUE = "embedding_queue"
+_group_ready = False
 
 redis_client = redis.Redis(host="redis", port=6379, db=1)
+# cùng db với async_redis_client của API
+catalog_redis_client = redis.Redis(host="redis", port=6379, db=0)
+
+
+# Ghi payload mới nhất của job, chỉ thêm message vào stream khi job chưa nằm trong lane cùng hoặc cao hơn.
+# KEYS: jobs, job lanes, stream của lane; ARGV: job key, payload, lane. Trả về 1 nếu thêm message mới.
+ENQUEUE_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+local queued = redis.call('HGET', KEYS[2], ARGV[1])
+if queued == ARGV[3] or queued == 'interactive' then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('XADD', KEYS[3], '*', 'key', ARGV[1])
+return 1
+"""
+
+# Lấy payload cho các message vừa đọc/claim: payload chuyển từ jobs sang inflight (theo lane:message_id).
+# Message của job đã được nâng lane (hoặc đã xử lý) nhận chuỗi rỗng.
+# KEYS: jobs, job lanes, inflight; ARGV: lane, rồi từng cặp message_id, job key.
+TAKE_SCRIPT = """
+local result = {}
+for i = 2, #ARGV, 2 do
+    local inflight_id = ARGV[1] .. ':' .. ARGV[i]
+    local payload = redis.call('HGET', KEYS[3], inflight_id)
+    if not payload then
+        if redis.call('HGET', KEYS[2], ARGV[i + 1]) == ARGV[1] then
+            payload = redis.call('HGET', KEYS[1], ARGV[i + 1])
+            redis.call('HDEL', KEYS[1], ARGV[i + 1])
+            redis.call('HDEL', KEYS[2], ARGV[i + 1])
+            redis.call('HSET', KEYS[3], inflight_id, payload)
+        end
+    end
+    table.insert(result, payload or '')
+end
+return result
+"""
+
+enqueue_script = redis_client.register_script(ENQUEUE_SCRIPT)
+take_script = redis_client.register_script(TAKE_SCRIPT)
+
+
+def queue_consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def ensure_consumer_group():
+    global _group_ready
+    if _group_ready:
+        return
+    for stream in EMBEDDING_LANES.values():
+        try:
+            # id "0": message được thêm trước khi tạo group vẫn được xử lý
+            redis_client.xgroup_create(stream, EMBEDDING_CONSUMER_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+    _group_ready = True
+
+
+def job_key(item: dict) -> str:
+    return f"{item.get('level', 'variant')}:{item['id']}"
+
+
+def _enqueue(item: dict, lane: str) -> bool:
+    return bool(enqueue_script(
+        keys=[EMBEDDING_JOBS_KEY, EMBEDDING_JOB_LANES_KEY, EMBEDDING_LANES[lane]],
+        args=[job_key(item), json.dumps(item), lane],
+    ))
+
+
+def push_to_queue(item: dict, lane: str = "background"):
+    """
+    Enqueue job embedding vào lane (`interactive`: sửa từ admin/CDC, `background`: backfill).
+    Job đang chờ (cùng level và id) chỉ được cập nhật payload, job background được nâng lên interactive.
+    Lane interactive hẹn một lần flush sau `EMBEDDING_FLUSH_DELAY_MS` kể từ job đầu tiên,
+    hoặc flush ngay khi lane có `EMBEDDING_FLUSH_MAX_ITEMS` job.
+    """
+    # gửi kèm trace context để span xử lý batch link về request đã tạo item
+    created = _enqueue({**item, "trace_context": inject_context()}, lane)
+    if lane != "interactive" or not created:
+        return
+    if redis_client.xlen(EMBEDDING_INTERACTIVE_STREAM) >= settings.EMBEDDING_FLUSH_MAX_ITEMS:
+        if redis_client.set(f"{EMBEDDING_FLUSH_KEY}:full", 1, nx=True, px=settings.EMBEDDING_FLUSH_DELAY_MS):
+            schedule_flush(0)
+    elif redis_client.set(EMBEDDING_FLUSH_KEY, 1, nx=True, px=settings.EMBEDDING_FLUSH_DELAY_MS):
+        schedule_flush(settings.EMBEDDING_FLUSH_DELAY_MS)
+
+
+def schedule_flush(delay_ms: int):
+    celery_app.send_task(
+        "src.tasks.embedding_tasks.process_embedding_queue",
+        kwargs={"lanes": ["interactive"]},
+        countdown=delay_ms / 1000,
+    )
+
+
+def migrate_legacy_queue() -> int:
+    """Chuyển item còn trong list `embedding_queue` cũ sang stream."""
+    moved = 0
+    while batch := redis_client.lpop(LEGACY_EMBEDDING_QUEUE, BATCH_EMBEDDING_SIZE):
+        for item in batch:
+            _enqueue(json.loads(item), "background")
+        moved += len(batch)
+    if moved:
+        log.info(f"Moved {moved} items from {LEGACY_EMBEDDING_QUEUE} to {EMBEDDING_STREAM}")
+    return moved
+
+
+def _take_messages(lane: str, messages) -> list[tuple[tuple[str, str], dict | None]]:
+    """
+    [((lane, message_id), item)], item None nếu job đã được xử lý ở lane khác (ack luôn).
+    Message ghi trước khi có lane (field `data`) mang payload trực tiếp.
+    """
+    # xautoclaim trả về (id, None) cho message đã bị xóa khỏi stream
+    messages = [(message_id.decode(), fields) for message_id, fields in messages if fields]
+    keyed = [(message_id, fields[b"key"].decode()) for message_id, fields in messages if b"key" in fields]
+    payloads = {}
+    if keyed:
+        taken = take_script(
+            keys=[EMBEDDING_JOBS_KEY, EMBEDDING_JOB_LANES_KEY, EMBEDDING_INFLIGHT_KEY],
+            args=[lane, *[value for pair in keyed for value in pair]],
+        )
+        payloads = {message_id: payload for (message_id, _), payload in zip(keyed, taken)}
+    return [
+        ((lane, message_id), json.loads(payloads.get(message_id) or fields.get(b"data") or "null"))
+        for message_id, fields in messages
+    ]
+
+
+def read_batch(
+    consumer: str, count: int = BATCH_EMBEDDING_SIZE, lanes: list[str] = None
+) -> list[tuple[tuple[str, str], dict | None]]:
+    """
+    Lấy message mới (chưa giao cho consumer nào) của lane ưu tiên cao nhất còn message,
+    message ở trạng thái pending tới khi `ack_messages`.
+    """
+    ensure_consumer_group()
+    for lane in lanes or EMBEDDING_LANES:
+        response = redis_client.xreadgroup(
+            EMBEDDING_CONSUMER_GROUP, consumer, {EMBEDDING_LANES[lane]: ">"}, count=count
+        )
+        if response and response[0][1]:
+            return _take_messages(lane, response[0][1])
+    return []
+
+
+def claim_stale_batch(
+    consumer: str,
+    count: int = BATCH_EMBEDDING_SIZE,
+    min_idle_ms: int = EMBEDDING_CLAIM_IDLE_MS,
+    lanes: list[str] = None,
+    exclude: set[tuple[str, str]] = None,
+) -> list[tuple[tuple[str, str], dict | None]]:
+    """
+    Claim message pending quá `min_idle_ms` (consumer chết giữa chừng hoặc batch lỗi trước đó).
+    Message đã giao quá `EMBEDDING_MAX_DELIVERIES` lần thì chuyển sang dead letter stream.
+    `exclude`: message worker này đang xử lý, không claim (claim làm tăng số lần giao của message).
+    """
+    ensure_consumer_group()
+    exclude = exclude or set()
+    for lane in lanes or EMBEDDING_LANES:
+        stream = EMBEDDING_LANES[lane]
+        # XPENDING trước rồi XCLAIM đúng id cần lấy, XAUTOCLAIM sẽ claim cả message đang chạy của chính worker này
+        pending = redis_client.xpending_range(
+            stream,
+            EMBEDDING_CONSUMER_GROUP,
+            min="-",
+            max="+",
+            count=count + sum(1 for ref_lane, _ in exclude if ref_lane == lane),
+            idle=min_idle_ms,
+        )
+        delivered = {
+            _text(entry["message_id"]): entry["times_delivered"] + 1
+            for entry in pending
+            if (lane, _text(entry["message_id"])) not in exclude
+        }
+        message_ids = list(delivered)[:count]
+        if not message_ids:
+            continue
+        messages = _take_messages(
+            lane, redis_client.xclaim(stream, EMBEDDING_CONSUMER_GROUP, consumer, min_idle_ms, message_ids)
+        )
+
+        dead = [message for message in messages if delivered[message[0][1]] > EMBEDDING_MAX_DELIVERIES]
+        if dead:
+            dead_letter_messages(dead, f"delivered more than {EMBEDDING_MAX_DELIVERIES} times")
+        alive = [message for message in messages if delivered[message[0][1]] <= EMBEDDING_MAX_DELIVERIES]
+        if alive:
+            return alive
+    return []
+
+
+def touch_messages(consumer: str, refs: list[tuple[str, str]]):
+    """
+    Reset idle time của message đang xử lý (XCLAIM JUSTID không tăng số lần giao),
+    batch chạy lâu hơn `EMBEDDING_CLAIM_IDLE_MS` không bị worker khác claim.
+    """
+    for lane in {lane for lane, _ in refs}:
+        message_ids = [message_id for message_lane, message_id in refs if message_lane == lane]
+        redis_client.xclaim(
+            EMBEDDING_LANES[lane], EMBEDDING_CONSUMER_GROUP, consumer, 0, message_ids, justid=True
+        )
+
+
+def _remove_messages(pipe, refs: list[tuple[str, str]]):
+    for lane in {lane for lane, _ in refs}:
+        message_ids = [message_id for message_lane, message_id in refs if message_lane == lane]
+        pipe.xack(EMBEDDING_LANES[lane], EMBEDDING_CONSUMER_GROUP, *message_ids)
+        pipe.xdel(EMBEDDING_LANES[lane], *message_ids)
+    pipe.hdel(EMBEDDING_INFLIGHT_KEY, *[f"{lane}:{message_id}" for lane, message_id in refs])
+
+
+def ack_messages(refs: list[tuple[str, str]]):
+    """Ack rồi xóa khỏi stream (và payload inflight), XLEN vì vậy luôn là số message chưa xử lý xong."""
+    if not refs:
+        return
+    pipe = redis_client.pipeline()
+    _remove_messages(pipe, refs)
+    pipe.execute()
+
+
+def dead_letter_messages(messages: list[tuple[tuple[str, str], dict | None]], error: str):
+    pipe = redis_client.pipeline()
+    for (lane, message_id), item in messages:
+        if item is None:
+            continue
+        pipe.xadd(EMBEDDING_DEAD_LETTER_STREAM, {
+            "data": json.dumps(item),
+            "message_id": message_id,
+            "lane": lane,
+            "error": error,
+        })
+    _remove_messages(pipe, [ref for ref, _ in messages])
+    pipe.execute()
+    log.warning(f"Moved {len(messages)} embedding messages to {EMBEDDING_DEAD_LETTER_STREAM}: {error}")
+
+
+def requeue_dead_letters(count: int = 1000) -> int:
+    """Đưa message trong dead letter stream về lại lane background (sau khi đã sửa nguyên nhân lỗi)."""
+    entries = redis_client.xrange(EMBEDDING_DEAD_LETTER_STREAM, count=count)
+    if not entries:
+        return 0
+    for _, fields in entries:
+        _enqueue(json.loads(fields[b"data"]), "background")
+    redis_client.xdel(EMBEDDING_DEAD_LETTER_STREAM, *[entry_id for entry_id, _ in entries])
+    return len(entries)
+
+
+def embedding_queue_stats() -> dict:
+    """
+    Theo lane:
+    - length: message chưa ack (kể cả pending)
+    - pending: đã giao cho worker nhưng chưa ack, lag: chưa giao cho worker nào
+    - oldest_age_seconds: tuổi của message chưa xử lý lâu nhất (id của stream chứa timestamp ms)
+    `jobs`: job đang chờ sau khi gộp các lần enqueue trùng.
+    """
+    ensure_consumer_group()
+    lanes = {}
+    for lane, stream in EMBEDDING_LANES.items():
+        group = next(
+            group for group in redis_client.xinfo_groups(stream)
+            if _text(group["name"]) == EMBEDDING_CONSUMER_GROUP
+        )
+        oldest = redis_client.xrange(stream, count=1)
+        oldest_age = time.time() - int(oldest[0][0].split(b"-")[0]) / 1000 if oldest else 0.0
+        lanes[lane] = {
+            "length": redis_client.xlen(stream),
+            "pending": group["pending"],
+            "lag": group.get("lag"),
+            "consumers": group["consumers"],
+            "oldest_age_seconds": round(max(oldest_age, 0.0), 3),
+        }
+    return {
+        "lanes": lanes,
+        "jobs": redis_client.hlen(EMBEDDING_JOBS_KEY),
+        "inflight": redis_client.hlen(EMBEDDING_INFLIGHT_KEY),
+        "dead_letters": redis_client.xlen(EMBEDDING_DEAD_LETTER_STREAM),
+        "legacy_queue_length": redis_client.llen(LEGACY_EMBEDDING_QUEUE),
+    }
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
 
 
-def push_to_queue(item: dict):
-    redis_client.rpush("embedding_queue", json.dumps(item))
+def bump_catalog_version() -> int:
+    """Bản sync của `src.tools.cache.bump_catalog_version` cho celery worker."""
+    return catalog_redis_client.incr(CATALOG_INDEX_VERSION_KEY)
 
 
-def pop_all_from_queue() -> list:
-    batches = []
-    while batch := redis_client.lpop("embedding_queue", BATCH_EMBEDDING_SIZE):
-        items = [json.loads(item) for item in batch]
-        batches.append(items)
-    return batches
+def publish_catalog_update(action: str, ids: list[str], documents: list[str] = None, metadatas: list[dict] = None):
+    """
+    Báo cho các API worker cập nhật index in-process (action: upsert, delete, clear, reload).
+    Mỗi lần publish tăng catalog version nên semantic cache không trả câu trả lời dựa trên embedding cũ.
+    """
+    version = bump_catalog_version()
+    redis_client.publish(CATALOG_UPDATES_CHANNEL, json.dumps({
+        "action": action,
+        "version": version,
+        "ids": ids,
+        "documents": documents or [],
+        "metadatas": metadatas or [],
+    }))
@@ -2,6 +2,11 @@ import json
 import functools
 from redis.asyncio import Redis
 
+from src.constants import CATALOG_INDEX_VERSION_KEY
+
+
+CACHE_KEY_TYPES = (str, int, float, bool)
+
 
 def redis_cache(ttl: int = 60):
     """
@@ -11,7 +16,10 @@ def redis_cache(ttl: int = 60):
         @functools.wraps(func)
         async def wrapper(*args, redis: Redis, **kwargs):
             # Make a unique cache key based on function + args
-            key_parts = [func.__name__] + list(args) + [f"{k}={v}" for k, v in kwargs.items()]
+            # (skip injected objects like db sessions, their repr changes every request)
+            key_parts = [func.__name__] + [a for a in args if isinstance(a, CACHE_KEY_TYPES)] + [
+                f"{k}={v}" for k, v in kwargs.items() if isinstance(v, CACHE_KEY_TYPES)
+            ]
             cache_key = "cache:" + ":".join(map(str, key_parts))
 
             # Try to get from Redis
@@ -28,3 +36,13 @@ def redis_cache(ttl: int = 60):
             return result
         return wrapper
     return decorator
+
+
+async def get_catalog_version(redis: Redis) -> int:
+    """Current catalog version, bumped whenever product data that answers depend on changes."""
+    version = await redis.get(CATALOG_INDEX_VERSION_KEY)
+    return int(version) if version else 0
+
+
+async def bump_catalog_version(redis: Redis) -> int:
+    return await redis.incr(CATALOG_INDEX_VERSION_KEY)
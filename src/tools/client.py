@@ -1,16 +1,19 @@
 # app/tasks/embedding_tasks.py
 import json
+from functools import lru_cache
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from google import genai
 import chromadb
 from minio import Minio
+import redis
+from redis.asyncio import Redis
 
 
 from src.config import settings
+from src.tools.rate_limiter import RateLimiter, RateLimitedGemini
 
 
-chroma_client = chromadb.HttpClient(host="chromadb", port=8000)
 minio_client = Minio(
     settings.FILE_SERVER_ENDPOINT,
     access_key=settings.FILE_SERVER_ACCESS_KEY,
@@ -30,24 +33,97 @@ minio_policy = {
     ]
 }
 
-minio_client.set_bucket_policy(
-    settings.FILE_SERVER_BUCKET_NAME, json.dumps(minio_policy)
-)
 
-if not minio_client.bucket_exists(settings.FILE_SERVER_BUCKET_NAME):
-    minio_client.make_bucket(settings.FILE_SERVER_BUCKET_NAME)
+def ensure_file_bucket():
+    """Tạo bucket ảnh sản phẩm và public policy, gọi lúc app khởi động thay vì lúc import."""
+    if not minio_client.bucket_exists(settings.FILE_SERVER_BUCKET_NAME):
+        minio_client.make_bucket(settings.FILE_SERVER_BUCKET_NAME)
+    minio_client.set_bucket_policy(
+        settings.FILE_SERVER_BUCKET_NAME, json.dumps(minio_policy)
+    )
+
+
+@lru_cache
+def get_chroma_client():
+    """HttpClient gọi server ngay khi khởi tạo nên chỉ tạo lúc cần dùng."""
+    return chromadb.HttpClient(host="chromadb", port=8000)
+
+
+async_redis_client = Redis(host="redis", port=6379, db=0)
+# rate limiter của client sync (celery worker) dùng chung bucket với API qua cùng db
+rate_limit_redis_client = redis.Redis(host="redis", port=6379, db=0)
 
+openai_rate_limiter = RateLimiter(
+    name="openai",
+    redis=rate_limit_redis_client,
+    async_redis=async_redis_client,
+    requests_per_minute=settings.OPENAI_RATE_LIMIT_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.OPENAI_RATE_LIMIT_TOKENS_PER_MINUTE,
+    background_reserve=settings.RATE_LIMIT_BACKGROUND_RESERVE,
+    max_wait={
+        "interactive": settings.RATE_LIMIT_INTERACTIVE_MAX_WAIT,
+        "background": settings.RATE_LIMIT_BACKGROUND_MAX_WAIT,
+    },
+    enabled=settings.RATE_LIMIT_ENABLED,
+)
+
+gemini_rate_limiter = RateLimiter(
+    name="gemini",
+    async_redis=async_redis_client,
+    requests_per_minute=settings.GEMINI_RATE_LIMIT_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.GEMINI_RATE_LIMIT_TOKENS_PER_MINUTE,
+    max_wait={
+        "interactive": settings.RATE_LIMIT_INTERACTIVE_MAX_WAIT,
+        "background": settings.RATE_LIMIT_BACKGROUND_MAX_WAIT,
+    },
+    enabled=settings.RATE_LIMIT_ENABLED,
+)
 
+# client sync chỉ dùng trong celery worker (backfill embedding): priority background.
+# Mọi client có rate limit hook đều tắt retry của SDK: SDK coi RateLimitExceeded raise trong hook là lỗi kết nối
+# và gửi lại, retry do EmbeddingPipeline/LLMRouter lo.
 embedding_client = OpenAI(
     base_url=settings.OPENAI_ENDPOINT,
     api_key=settings.OPENAI_EMBEDDING_API_KEY,
+    max_retries=0,
+    http_client=DefaultHttpxClient(event_hooks=openai_rate_limiter.httpx_hooks("background")),
 )
 
 llm_client = OpenAI(
     base_url=settings.OPENAI_ENDPOINT,
     api_key=settings.OPENAI_LLM_API_KEY,
+    max_retries=0,
+    http_client=DefaultHttpxClient(event_hooks=openai_rate_limiter.httpx_hooks("background")),
 )
 
 gemini_client = genai.Client(
     api_key=settings.GEMINI_API_KEY,
 )
+
+async_embedding_client = AsyncOpenAI(
+    base_url=settings.OPENAI_ENDPOINT,
+    api_key=settings.OPENAI_EMBEDDING_API_KEY,
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(event_hooks=openai_rate_limiter.async_httpx_hooks("interactive")),
+)
+
+# retry/fallback do LLMRouter lo, SDK retry sẽ ăn hết deadline của mỗi lần gọi
+async_llm_client = AsyncOpenAI(
+    base_url=settings.OPENAI_ENDPOINT,
+    api_key=settings.OPENAI_LLM_API_KEY,
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(event_hooks=openai_rate_limiter.async_httpx_hooks("interactive")),
+)
+
+# async gemini calls go through `gemini_client.aio`
+async_gemini_client = RateLimitedGemini(gemini_client.aio, gemini_rate_limiter, "interactive")
+
+_async_chroma_client = None
+
+
+async def get_async_chroma_client():
+    """Lazily create the async chroma client, it can only be built inside a running loop."""
+    global _async_chroma_client
+    if _async_chroma_client is None:
+        _async_chroma_client = await chromadb.AsyncHttpClient(host="chromadb", port=8000)
+    return _async_chroma_client
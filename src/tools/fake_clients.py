@@ -0,0 +1,321 @@
+import asyncio
+import hashlib
+import math
+import random
+import re
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.utils.common import tokenize
+
+FAKE_EMBEDDING_DIMENSIONS = 256
+USER_QUESTION_PATTERN = re.compile(r"User question:\s*(.+)")
+ANSWER_WORDS = "Mình gợi ý bạn tham khảo sản phẩm này vì cấu hình tốt giá hợp lý và đang còn hàng".split()
+
+
+class FakeServiceError(Exception):
+    """Lỗi giả lập của backend (tương đương 5xx / mất kết nối)."""
+
+
+class LatencyProfile:
+    """
+    Latency theo phân phối log-normal xác định bởi median và p99 (ms), kèm tỉ lệ lỗi.
+    Cùng `seed` thì cùng chuỗi latency/lỗi, kết quả benchmark lặp lại được.
+    """
+
+    def __init__(self, median_ms: float = 0.0, p99_ms: float = None, error_rate: float = 0.0, seed: int = 0):
+        self.median_ms = median_ms
+        self.p99_ms = p99_ms or median_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        # z của p99 trong phân phối chuẩn
+        self.sigma = math.log(self.p99_ms / median_ms) / 2.326 if median_ms > 0 and self.p99_ms > median_ms else 0.0
+
+    @classmethod
+    def parse(cls, value: str, seed: int = 0) -> "LatencyProfile":
+        """`"median_ms,p99_ms,error_rate"`, vd. `"800,3000,0.01"`; có thể bỏ bớt phần sau."""
+        parts = [float(part) for part in value.split(",") if part.strip()]
+        median_ms = parts[0] if parts else 0.0
+        p99_ms = parts[1] if len(parts) > 1 else median_ms
+        error_rate = parts[2] if len(parts) > 2 else 0.0
+        return cls(median_ms, p99_ms, error_rate, seed)
+
+    def sample(self) -> float:
+        """Latency (giây) cho một lần gọi."""
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms * math.exp(self.random.gauss(0, self.sigma)) / 1000
+
+    async def wait(self, name: str):
+        await asyncio.sleep(self.sample())
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise FakeServiceError(f"{name} simulated failure")
+
+
+def hashed_embedding(text: str, dimensions: int = FAKE_EMBEDDING_DIMENSIONS) -> list[float]:
+    """
+    Embedding xác định theo bag-of-words đã băm: text gần nhau cho vector gần nhau,
+    đủ để retrieval và semantic cache chạy đúng đường code như khi dùng model thật.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for term in tokenize(text):
+        digest = hashlib.md5(term.encode()).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] % 2 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+
+def fake_reply(messages: list[dict], answer_tokens: int = 120) -> str:
+    """Câu trả lời xác định theo loại prompt mà pipeline gửi (intent check, rewrite, summary, generate)."""
+    prompt = messages[-1]["content"] if messages else ""
+    if 'Respond with "yes" or "no"' in prompt:
+        return "yes"
+    if "standalone question" in prompt:
+        match = USER_QUESTION_PATTERN.search(prompt)
+        return match.group(1).strip() if match else prompt
+    if "Tóm tắt ngắn gọn cuộc trò chuyện" in prompt:
+        return "Khách đang tìm hiểu sản phẩm và đã được tư vấn một vài lựa chọn."
+    return " ".join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(answer_tokens))
+
+
+class FakeOpenAI:
+    """Thay cho `AsyncOpenAI`: hỗ trợ `chat.completions.create` (kể cả stream) và `embeddings.create`."""
+
+    def __init__(
+        self,
+        latency: LatencyProfile = None,
+        answer_tokens: int = 120,
+        token_delay_ms: float = 0.0,
+        dimensions: int = FAKE_EMBEDDING_DIMENSIONS,
+    ):
+        self.latency = latency or LatencyProfile()
+        self.answer_tokens = answer_tokens
+        self.token_delay_ms = token_delay_ms
+        self.dimensions = dimensions
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.embeddings = SimpleNamespace(create=self._create_embedding)
+
+    async def _create_completion(self, model: str, messages: list[dict], stream: bool = False, **kwargs):
+        self.calls += 1
+        await self.latency.wait("openai.chat")
+        content = fake_reply(messages, self.answer_tokens)
+        if not stream:
+            message = SimpleNamespace(content=content)
+            return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message)])
+        return self._stream(content)
+
+    async def _stream(self, content: str):
+        for word in content.split(" "):
+            if self.token_delay_ms:
+                await asyncio.sleep(self.token_delay_ms / 1000)
+            delta = SimpleNamespace(content=word + " ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    async def _create_embedding(self, model: str, input: str | list[str], **kwargs):
+        self.calls += 1
+        await self.latency.wait("openai.embeddings")
+        texts = [input] if isinstance(input, str) else input
+        return SimpleNamespace(
+            model=model,
+            data=[SimpleNamespace(index=i, embedding=hashed_embedding(text, self.dimensions)) for i, text in enumerate(texts)],
+        )
+
+
+class FakeGemini:
+    """Thay cho `genai.Client(...).aio`: hỗ trợ `models.generate_content` và `models.generate_content_stream`."""
+
+    def __init__(self, latency: LatencyProfile = None, answer_tokens: int = 120, token_delay_ms: float = 0.0):
+        self.latency = latency or LatencyProfile()
+        self.answer_tokens = answer_tokens
+        self.token_delay_ms = token_delay_ms
+        self.calls = 0
+        self.models = SimpleNamespace(
+            generate_content=self._generate_content,
+            generate_content_stream=self._generate_content_stream,
+        )
+
+    def _reply(self, contents: list[dict]) -> str:
+        messages = [{"content": " ".join(part["text"] for part in item["parts"])} for item in contents]
+        return fake_reply(messages, self.answer_tokens)
+
+    async def _generate_content(self, model: str, contents: list[dict], config: dict = None):
+        self.calls += 1
+        await self.latency.wait("gemini.generate_content")
+        return SimpleNamespace(text=self._reply(contents))
+
+    async def _generate_content_stream(self, model: str, contents: list[dict], config: dict = None):
+        self.calls += 1
+        await self.latency.wait("gemini.generate_content_stream")
+        return self._stream(self._reply(contents))
+
+    async def _stream(self, content: str):
+        for word in content.split(" "):
+            if self.token_delay_ms:
+                await asyncio.sleep(self.token_delay_ms / 1000)
+            yield SimpleNamespace(text=word + " ")
+
+
+def matches_where(metadata: dict, where: dict | None) -> bool:
+    """Đánh giá `where` filter theo cú pháp chroma ($and, $or, $in, $nin, $eq, $ne, $gt, $gte, $lt, $lte)."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, expected in condition.items():
+            if operator == "$eq" and value != expected:
+                return False
+            if operator == "$ne" and value == expected:
+                return False
+            if operator == "$in" and value not in expected:
+                return False
+            if operator == "$nin" and value in expected:
+                return False
+            if operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if operator == "$gt" and not value > expected:
+                    return False
+                if operator == "$gte" and not value >= expected:
+                    return False
+                if operator == "$lt" and not value < expected:
+                    return False
+                if operator == "$lte" and not value <= expected:
+                    return False
+    return True
+
+
+class FakeCollection:
+    """Collection in-memory cùng interface async với chroma `AsyncCollection` (brute-force search)."""
+
+    def __init__(self, name: str, metadata: dict = None, latency: LatencyProfile = None):
+        self.name = name
+        self.metadata = metadata or {}
+        self.latency = latency or LatencyProfile()
+        self.ids: list[str] = []
+        self.embeddings: list[list[float]] = []
+        self.documents: list[str] = []
+        self.metadatas: list[dict] = []
+
+    def _distances(self, query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        space = self.metadata.get("hnsw:space", "l2")
+        if space == "cosine":
+            norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+            return 1 - matrix @ query / np.where(norms == 0, 1.0, norms)
+        if space == "ip":
+            return 1 - matrix @ query
+        # chroma dùng squared l2
+        return ((matrix - query) ** 2).sum(axis=1)
+
+    def _select(self, indices: list[int], include: list[str]) -> dict:
+        return {
+            "ids": [self.ids[i] for i in indices],
+            "documents": [self.documents[i] for i in indices] if "documents" in include else None,
+            "metadatas": [self.metadatas[i] for i in indices] if "metadatas" in include else None,
+            "embeddings": [self.embeddings[i] for i in indices] if "embeddings" in include else None,
+        }
+
+    async def count(self) -> int:
+        await self.latency.wait(f"chroma.{self.name}.count")
+        return len(self.ids)
+
+    async def add(self, ids: list[str], embeddings: list = None, documents: list[str] = None, metadatas: list[dict] = None):
+        await self.latency.wait(f"chroma.{self.name}.add")
+        for i, doc_id in enumerate(ids):
+            if doc_id in self.ids:
+                continue
+            self.ids.append(doc_id)
+            self.embeddings.append(list(embeddings[i]) if embeddings is not None else [])
+            self.documents.append(documents[i] if documents else None)
+            self.metadatas.append((metadatas[i] if metadatas else None) or {})
+
+    async def upsert(self, ids: list[str], embeddings: list = None, documents: list[str] = None, metadatas: list[dict] = None):
+        await self.delete(ids=ids)
+        await self.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    async def delete(self, ids: list[str] = None, where: dict = None):
+        await self.latency.wait(f"chroma.{self.name}.delete")
+        keep = [
+            i for i in range(len(self.ids))
+            if not ((ids is None or self.ids[i] in ids) and matches_where(self.metadatas[i], where))
+        ]
+        self.ids = [self.ids[i] for i in keep]
+        self.embeddings = [self.embeddings[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+
+    async def get(
+        self,
+        ids: list[str] = None,
+        where: dict = None,
+        limit: int = None,
+        offset: int = None,
+        include: list[str] = ("documents", "metadatas"),
+    ) -> dict:
+        await self.latency.wait(f"chroma.{self.name}.get")
+        indices = [
+            i for i in range(len(self.ids))
+            if (ids is None or self.ids[i] in ids) and matches_where(self.metadatas[i], where)
+        ]
+        start = offset or 0
+        indices = indices[start:start + limit] if limit is not None else indices[start:]
+        return self._select(indices, include)
+
+    async def query(
+        self,
+        query_embeddings: list,
+        n_results: int = 10,
+        where: dict = None,
+        include: list[str] = ("documents", "metadatas", "distances"),
+    ) -> dict:
+        await self.latency.wait(f"chroma.{self.name}.query")
+        candidates = [i for i in range(len(self.ids)) if matches_where(self.metadatas[i], where)]
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_embedding in query_embeddings:
+            if not candidates:
+                selected, distances = [], []
+            else:
+                matrix = np.asarray([self.embeddings[i] for i in candidates], dtype=np.float32)
+                scores = self._distances(np.asarray(query_embedding, dtype=np.float32), matrix)
+                order = np.argsort(scores)[:n_results]
+                selected = [candidates[i] for i in order]
+                distances = [float(scores[i]) for i in order]
+            picked = self._select(selected, include)
+            result["ids"].append(picked["ids"])
+            result["documents"].append(picked["documents"])
+            result["metadatas"].append(picked["metadatas"])
+            result["distances"].append(distances)
+        return result
+
+
+class FakeChroma:
+    """Thay cho chroma `AsyncHttpClient`, collection giữ trong memory của process."""
+
+    def __init__(self, latency: LatencyProfile = None):
+        self.latency = latency or LatencyProfile()
+        self.collections: dict[str, FakeCollection] = {}
+
+    async def get_or_create_collection(self, name: str, metadata: dict = None, **kwargs) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, metadata, self.latency)
+        return self.collections[name]
+
+    async def get_collection(self, name: str, **kwargs) -> FakeCollection:
+        return self.collections[name]
+
+    async def delete_collection(self, name: str):
+        self.collections.pop(name, None)
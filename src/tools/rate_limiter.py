@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+import httpx
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from src.utils.common import estimate_tokens
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "background")
+# request chat không đặt max_tokens: ước lượng phần completion để trừ vào token bucket
+DEFAULT_COMPLETION_TOKENS = 256
+# 429 không kèm header nào cho biết thời gian chờ
+DEFAULT_BLOCK_MS = 1000
+
+# Bucket (hash) refill liên tục theo limit mỗi phút, thời gian lấy từ redis để mọi worker dùng chung một đồng hồ.
+# ARGV[1], ARGV[2]: limit request/token mặc định khi chưa học được từ header của provider.
+_LOAD_BUCKET = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts', 'request_limit', 'token_limit', 'blocked_until')
+local request_limit = tonumber(state[4]) or tonumber(ARGV[1])
+local token_limit = tonumber(state[5]) or tonumber(ARGV[2])
+local requests = tonumber(state[1]) or request_limit
+local tokens = tonumber(state[2]) or token_limit
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+requests = math.min(request_limit, requests + elapsed * request_limit / 60000)
+tokens = math.min(token_limit, tokens + elapsed * token_limit / 60000)
+local blocked_until = tonumber(state[6]) or 0
+"""
+
+_SAVE_BUCKET = """
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'ts', now,
+    'request_limit', request_limit, 'token_limit', token_limit, 'blocked_until', blocked_until)
+redis.call('PEXPIRE', KEYS[1], 300000)
+"""
+
+# ARGV[3]: token của request, ARGV[4]: phần bucket phải để lại (priority thấp không được lấy).
+# Trả về 0 nếu đã lấy được, ngược lại số ms cần chờ.
+ACQUIRE_SCRIPT = _LOAD_BUCKET + """
+local reserve = tonumber(ARGV[4])
+local cost = math.min(tonumber(ARGV[3]), token_limit * (1 - reserve))
+local wait = math.max(0, blocked_until - now)
+local missing_requests = 1 + reserve * request_limit - requests
+local missing_tokens = cost + reserve * token_limit - tokens
+if missing_requests > 0 then wait = math.max(wait, missing_requests * 60000 / request_limit) end
+if missing_tokens > 0 then wait = math.max(wait, missing_tokens * 60000 / token_limit) end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+""" + _SAVE_BUCKET + """
+return math.ceil(wait)
+"""
+
+# ARGV[3..6]: limit và remaining (request, token) từ header, -1 nếu không có; ARGV[7]: ms phải dừng (429).
+OBSERVE_SCRIPT = _LOAD_BUCKET + """
+if tonumber(ARGV[3]) > 0 then request_limit = tonumber(ARGV[3]) end
+if tonumber(ARGV[4]) > 0 then token_limit = tonumber(ARGV[4]) end
+if tonumber(ARGV[5]) >= 0 then requests = math.min(requests, tonumber(ARGV[5])) end
+if tonumber(ARGV[6]) >= 0 then tokens = math.min(tokens, tonumber(ARGV[6])) end
+if tonumber(ARGV[7]) > 0 then blocked_until = math.max(blocked_until, now + tonumber(ARGV[7])) end
+""" + _SAVE_BUCKET + """
+return 0
+"""
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def rate_limit_exceeded(error: BaseException) -> RateLimitExceeded | None:
+    """
+    RateLimitExceeded gốc của `error` nếu có: SDK openai bọc lỗi raise trong httpx hook thành APIConnectionError,
+    lỗi gốc nằm ở `__cause__`.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, RateLimitExceeded):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+@contextmanager
+def unwrap_rate_limit():
+    """Raise lại RateLimitExceeded gốc thay cho APIConnectionError của SDK, để caller không coi là lỗi kết nối."""
+    try:
+        yield
+    except Exception as e:
+        limited = rate_limit_exceeded(e)
+        if limited is None or limited is e:
+            raise
+        raise limited from None
+
+
+def parse_duration_ms(value: str | None) -> float | None:
+    """Header reset của OpenAI dạng `1s`, `6m0s`, `20ms`."""
+    if not value:
+        return None
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 1, "s": 1000, "m": 60_000, "h": 3_600_000}[unit]
+    return total or None
+
+
+def _header_number(headers, name: str) -> float:
+    try:
+        return float(headers.get(name, -1))
+    except ValueError:
+        return -1
+
+
+def block_ms(status_code: int, headers) -> float:
+    """Thời gian mọi worker phải dừng gửi: chỉ khi provider trả 429."""
+    if status_code != 429:
+        return 0
+    if headers.get("retry-after-ms"):
+        return _header_number(headers, "retry-after-ms")
+    if headers.get("retry-after"):
+        return _header_number(headers, "retry-after") * 1000
+    resets = [
+        parse_duration_ms(headers.get(name))
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+    ]
+    return max([reset for reset in resets if reset] or [DEFAULT_BLOCK_MS])
+
+
+def text_tokens(value) -> int:
+    if isinstance(value, str):
+        return estimate_tokens(value)
+    if isinstance(value, list):
+        # input embedding có thể là list token id
+        return len(value) if value and isinstance(value[0], int) else sum(text_tokens(item) for item in value)
+    if isinstance(value, dict):
+        return sum(text_tokens(item) for key, item in value.items() if key in ("content", "text", "parts"))
+    return 0
+
+
+def request_cost(request: httpx.Request) -> tuple[str, int]:
+    """(model, token ước lượng) của request tới OpenAI: input embedding, hoặc messages + max token completion."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except ValueError:
+        return request.url.path, 0
+    model = body.get("model") or request.url.path
+    if "input" in body:
+        return model, text_tokens(body["input"])
+    completion = body.get("max_completion_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return model, text_tokens(body.get("messages", [])) + completion
+
+
+class RateLimiter:
+    """
+    Token bucket trên redis dùng chung cho mọi process gọi một provider (API worker, celery worker):
+    - mỗi model một bucket, đếm cả số request và số token mỗi phút.
+    - priority `background` (embedding backfill) không được lấy phần `background_reserve` cuối của bucket,
+      phần đó chỉ dành cho `interactive` (chat).
+    - limit/remaining thật lấy từ header x-ratelimit-* của response, 429 chặn tất cả worker tới khi hết retry-after.
+    - chờ quá `max_wait` của priority thì raise RateLimitExceeded; redis lỗi thì cho request đi (fail open).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        redis: Redis = None,
+        async_redis: AsyncRedis = None,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 200_000,
+        background_reserve: float = 0.3,
+        max_wait: dict[str, float] = None,
+        enabled: bool = True,
+    ):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.reserve = {"interactive": 0.0, "background": background_reserve}
+        self.max_wait = max_wait or {"interactive": 2.0, "background": 60.0}
+        self.enabled = enabled
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT) if redis is not None else None
+        self._observe = redis.register_script(OBSERVE_SCRIPT) if redis is not None else None
+        self._async_acquire = async_redis.register_script(ACQUIRE_SCRIPT) if async_redis is not None else None
+        self._async_observe = async_redis.register_script(OBSERVE_SCRIPT) if async_redis is not None else None
+        self.stats = {
+            priority: {"requests": 0, "throttled": 0, "wait_ms": 0.0, "rejected": 0} for priority in PRIORITIES
+        }
+        self.stats["rate_limited"] = 0
+
+    def key(self, model: str) -> str:
+        return f"ratelimit:{self.name}:{model}"
+
+    def _acquire_args(self, tokens: int, priority: str) -> list:
+        return [self.requests_per_minute, self.tokens_per_minute, tokens, self.reserve[priority]]
+
+    def _observe_args(self, status_code: int, headers) -> list:
+        return [
+            self.requests_per_minute,
+            self.tokens_per_minute,
+            _header_number(headers, "x-ratelimit-limit-requests"),
+            _header_number(headers, "x-ratelimit-limit-tokens"),
+            _header_number(headers, "x-ratelimit-remaining-requests"),
+            _header_number(headers, "x-ratelimit-remaining-tokens"),
+            block_ms(status_code, headers),
+        ]
+
+    def _record(self, priority: str, waited: float):
+        self.stats[priority]["requests"] += 1
+        if waited:
+            self.stats[priority]["throttled"] += 1
+            self.stats[priority]["wait_ms"] += waited * 1000
+
+    def _reject(self, model: str, priority: str, wait_ms: int):
+        self.stats[priority]["rejected"] += 1
+        raise RateLimitExceeded(f"[RateLimiter] {self.name}:{model} needs {wait_ms}ms, over {priority} max wait")
+
+    def acquire(self, model: str, tokens: int, priority: str = "background"):
+        if not self.enabled or self._acquire is None:
+            return
+        deadline = time.monotonic() + self.max_wait[priority]
+        waited = 0.0
+        while True:
+            try:
+                wait_ms = self._acquire(keys=[self.key(model)], args=self._acquire_args(tokens, priority))
+            except Exception as e:
+                log.warning(f"[RateLimiter] Redis unavailable, not limiting: {e}")
+                return
+            if not wait_ms:
+                return self._record(priority, waited)
+            if time.monotonic() + wait_ms / 1000 > deadline:
+                self._reject(model, priority, wait_ms)
+            time.sleep(wait_ms / 1000)
+            waited += wait_ms / 1000
+
+    async def aacquire(self, model: str, tokens: int, priority: str = "interactive"):
+        if not self.enabled or self._async_acquire is None:
+            return
+        deadline = time.monotonic() + self.max_wait[priority]
+        waited = 0.0
+        while True:
+            try:
+                wait_ms = await self._async_acquire(keys=[self.key(model)], args=self._acquire_args(tokens, priority))
+            except Exception as e:
+                log.warning(f"[RateLimiter] Redis unavailable, not limiting: {e}")
+                return
+            if not wait_ms:
+                return self._record(priority, waited)
+            if time.monotonic() + wait_ms / 1000 > deadline:
+                self._reject(model, priority, wait_ms)
+            await asyncio.sleep(wait_ms / 1000)
+            waited += wait_ms / 1000
+
+    def observe(self, model: str, status_code: int, headers):
+        if not self.enabled or self._observe is None:
+            return
+        if status_code == 429:
+            self.stats["rate_limited"] += 1
+        try:
+            self._observe(keys=[self.key(model)], args=self._observe_args(status_code, headers))
+        except Exception as e:
+            log.warning(f"[RateLimiter] Redis unavailable, rate limit headers ignored: {e}")
+
+    async def aobserve(self, model: str, status_code: int, headers):
+        if not self.enabled or self._async_observe is None:
+            return
+        if status_code == 429:
+            self.stats["rate_limited"] += 1
+        try:
+            await self._async_observe(keys=[self.key(model)], args=self._observe_args(status_code, headers))
+        except Exception as e:
+            log.warning(f"[RateLimiter] Redis unavailable, rate limit headers ignored: {e}")
+
+    def httpx_hooks(self, priority: str) -> dict:
+        """
+        event_hooks cho httpx.Client (client openai sync).
+        RateLimitExceeded từ hook bị SDK bọc thành APIConnectionError và retry: client dùng hook phải đặt
+        `max_retries=0`, caller gọi trong `unwrap_rate_limit()`.
+        """
+        def on_request(request: httpx.Request):
+            self.acquire(*request_cost(request), priority)
+
+        def on_response(response: httpx.Response):
+            self.observe(request_cost(response.request)[0], response.status_code, response.headers)
+
+        return {"request": [on_request], "response": [on_response]}
+
+    def async_httpx_hooks(self, priority: str) -> dict:
+        """event_hooks cho httpx.AsyncClient (client openai async)."""
+        async def on_request(request: httpx.Request):
+            await self.aacquire(*request_cost(request), priority)
+
+        async def on_response(response: httpx.Response):
+            await self.aobserve(request_cost(response.request)[0], response.status_code, response.headers)
+
+        return {"request": [on_request], "response": [on_response]}
+
+    def metrics(self) -> dict:
+        return self.stats
+
+
+class RateLimitedGeminiModels:
+    """Bọc `client.aio.models` của google-genai (không đi qua httpx hook, và gemini không trả header rate limit)."""
+
+    def __init__(self, models, limiter: RateLimiter, priority: str = "interactive"):
+        self._models = models
+        self.limiter = limiter
+        self.priority = priority
+
+    async def _call(self, method, model: str, contents, **kwargs):
+        await self.limiter.aacquire(model, text_tokens(contents) + DEFAULT_COMPLETION_TOKENS, self.priority)
+        try:
+            return await method(model=model, contents=contents, **kwargs)
+        except Exception as e:
+            if getattr(e, "code", None) == 429:
+                await self.limiter.aobserve(model, 429, {})
+            raise
+
+    async def generate_content(self, model: str, contents, **kwargs):
+        return await self._call(self._models.generate_content, model, contents, **kwargs)
+
+    async def generate_content_stream(self, model: str, contents, **kwargs):
+        return await self._call(self._models.generate_content_stream, model, contents, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class RateLimitedGemini:
+    """`genai.Client(...).aio` với `models` đã bọc rate limiter, các thuộc tính khác giữ nguyên."""
+
+    def __init__(self, client, limiter: RateLimiter, priority: str = "interactive"):
+        self._client = client
+        self.models = RateLimitedGeminiModels(client.models, limiter, priority)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,159 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+from src.config import settings
+
+log = logging.getLogger(__name__)
+
+tracer = trace.get_tracer("aia_faq")
+
+# (stage, duration ms) của request hiện tại, ServerTimingMiddleware đọc để ghi header
+_server_timings: contextvars.ContextVar[list | None] = contextvars.ContextVar("server_timings", default=None)
+_configured = False
+
+
+def setup_tracing(service_name: str):
+    """
+    Cấu hình TracerProvider theo OTEL_EXPORTER:
+    - none: không export (stage timing / Server-Timing vẫn hoạt động)
+    - console: in span ra stdout
+    - file: ghi mỗi span một dòng JSON vào OTEL_EXPORTER_FILE, dùng được khi offline
+    - otlp: gửi tới collector (endpoint lấy từ OTEL_EXPORTER_OTLP_ENDPOINT)
+    """
+    global _configured
+    if _configured or settings.OTEL_EXPORTER == "none":
+        return False
+
+    if settings.OTEL_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif settings.OTEL_EXPORTER == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(settings.OTEL_EXPORTER_FILE, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    else:
+        exporter = ConsoleSpanExporter()
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _configured = True
+    log.info(f"[Telemetry] Tracing enabled for {service_name} with {settings.OTEL_EXPORTER} exporter")
+    return True
+
+
+def instrument_clients(engine=None):
+    """Tạo span cho lệnh Redis và câu query SQLAlchemy (dùng chung cho API và Celery worker)."""
+    from opentelemetry.instrumentation.redis import RedisInstrumentor
+    from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+
+    RedisInstrumentor().instrument()
+    if engine is not None:
+        SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine)
+
+
+@contextmanager
+def stage(name: str, activate: bool = True, **attributes):
+    """
+    Span cho một stage của pipeline chat, thời gian chạy được cộng vào Server-Timing.
+    `activate=False` khi stage bao quanh `yield` của async generator (không gắn span vào context hiện tại).
+    """
+    started = time.perf_counter()
+    if activate:
+        with tracer.start_as_current_span(f"chat.{name}", attributes=attributes) as span:
+            try:
+                yield span
+            finally:
+                record_timing(name, started)
+    else:
+        span = tracer.start_span(f"chat.{name}", attributes=attributes)
+        try:
+            yield span
+        finally:
+            span.end()
+            record_timing(name, started)
+
+
+def record_timing(name: str, started: float):
+    timings = _server_timings.get()
+    if timings is not None:
+        timings.append((name, (time.perf_counter() - started) * 1000))
+
+
+@contextmanager
+def collect_timings():
+    """Gom stage timing của mọi thứ chạy bên trong block (dùng cho middleware và benchmark)."""
+    timings = []
+    token = _server_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _server_timings.reset(token)
+
+
+def current_timings() -> dict:
+    """Tổng thời gian (ms) theo stage của request hiện tại."""
+    result = {}
+    for name, duration in _server_timings.get() or []:
+        result[name] = round(result.get(name, 0.0) + duration, 2)
+    return result
+
+
+def format_server_timing(timings: dict, total: float) -> str:
+    return ", ".join([f"{name};dur={duration:.1f}" for name, duration in timings.items()] + [f"total;dur={total:.1f}"])
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware ghi header `Server-Timing` từ các stage đã chạy trước khi response bắt đầu.
+    Với response stream, header chỉ có các stage trước token đầu tiên; timing đầy đủ nằm trong event `done`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                header = format_server_timing(current_timings(), (time.perf_counter() - started) * 1000)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        with collect_timings():
+            await self.app(scope, receive, send_with_timing)
+
+
+def inject_context() -> dict:
+    """Serialize trace context hiện tại (traceparent) để gửi kèm item qua Redis queue."""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def links_from(carriers: list[dict]) -> list[trace.Link]:
+    """
+    Một batch embedding gom item từ nhiều request khác nhau,
+    nên mỗi request được gắn vào span của batch bằng link thay vì parent.
+    """
+    links = []
+    for carrier in carriers:
+        if not carrier:
+            continue
+        span_context = trace.get_current_span(propagate.extract(carrier)).get_span_context()
+        if span_context.is_valid:
+            links.append(trace.Link(span_context))
+    return links
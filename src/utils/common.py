@@ -1,6 +1,9 @@
+import hashlib
+import math
 import uuid
 from uuid import UUID
 import re
+import unicodedata
 import itertools
 from typing import Generator
 
@@ -31,6 +34,45 @@ def slugify(text: str) -> str:
     return text
 
 
+def fold_diacritics(text: str) -> str:
+    """Remove Vietnamese diacritics, e.g. "điện thoại" -> "dien thoai"."""
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d").replace("Đ", "D")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, fold diacritics and collapse whitespace so texts can be matched loosely."""
+    text = fold_diacritics(unicodedata.normalize("NFC", text or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split normalized (diacritic-folded) text into alphanumeric terms.
+    Mixed terms like "128gb" also emit their parts so "128 gb" and "128gb" match each other.
+    """
+    terms = []
+    for term in re.findall(r"[a-z0-9]+", normalize_text(text)):
+        terms.append(term)
+        parts = re.findall(r"[a-z]+|[0-9]+", term)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+def content_hash(text: str) -> str:
+    """sha256 của text, dùng để biết document đã embed có thay đổi không."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def estimate_tokens(text: str, chars_per_token: float = 3.0) -> int:
+    """Approximate token count without a tokenizer, ~3 chars per token for mixed Vietnamese/English text."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / chars_per_token)
+
+
 def building_slug(text: str, texts: list[str]) -> str:
     if slugify(text) not in texts:
         texts.append(slugify(text))
@@ -81,6 +123,10 @@ def generate_product_text(product_variant_model: object) -> str:
     """
     return {
         "id": str(product_variant_model.id),
+        "name": product_variant_model.name,
+        "product_id": str(product_variant_model.product_id),
+        "product_line_id": str(product_variant_model.product.product_line_id),
+        "product_name": product_variant_model.product.name,
         "brand": brand_name,
         "category": category_name,
         "price": product_variant_model.price,
@@ -89,6 +135,88 @@ def generate_product_text(product_variant_model: object) -> str:
     }
 
 
+def generate_product_group_text(product_model: object) -> dict:
+    """Text mức product (gộp mọi variant) cho lượt retrieval đầu của hierarchical search."""
+    product_line = product_model.product_line
+    prices = [variant.price for variant in product_model.variants if variant.price is not None]
+    product_desc = f"""
+        Product Line: {product_line.name}
+        Product: {product_model.name}
+        Product Description: {product_model.description}
+        Options: {", ".join(variant.name for variant in product_model.variants)}
+    """
+    return {
+        "id": str(product_model.id),
+        "level": "product",
+        "name": product_model.name,
+        "product_id": str(product_model.id),
+        "product_line_id": str(product_model.product_line_id),
+        "brand": product_line.brand.name,
+        "category": product_line.category.name,
+        "min_price": min(prices) if prices else None,
+        "max_price": max(prices) if prices else None,
+        "text": product_desc,
+    }
+
+
+def generate_product_line_text(product_line_model: object) -> dict:
+    """Text mức product line, một hit ở đây mở rộng ra mọi product của line."""
+    product_line_desc = f"""
+        Product Line: {product_line_model.name}
+        Brand: {product_line_model.brand.name}
+        Category: {product_line_model.category.name}
+        Description: {product_line_model.description}
+        Products: {", ".join(product.name for product in product_line_model.products)}
+    """
+    return {
+        "id": str(product_line_model.id),
+        "level": "line",
+        "name": product_line_model.name,
+        "product_line_id": str(product_line_model.id),
+        "brand": product_line_model.brand.name,
+        "category": product_line_model.category.name,
+        "text": product_line_desc,
+    }
+
+
+def product_group_metadata(item: dict) -> dict:
+    """Metadata của product/product line trong group collection (chroma không nhận giá trị None)."""
+    return {
+        key: item[key]
+        for key in ("level", "name", "product_id", "product_line_id", "brand", "category", "min_price", "max_price")
+        if item.get(key) is not None
+    }
+
+
+def product_metadata(item: dict) -> dict:
+    """Metadata lưu cùng embedding của variant (output của `generate_product_text`), dùng để filter khi search."""
+    return {
+        "name": item.get("name", ""),
+        # để gộp các variant của cùng product khi trả kết quả
+        **{key: item[key] for key in ("product_id", "product_line_id", "product_name") if item.get(key)},
+        "brand": item["brand"],
+        "category": item["category"],
+        # giá dạng số để filter khoảng giá ngay trong chroma
+        **({"price": float(item["price"])} if item.get("price") is not None else {}),
+        **{
+            f"tag_{key}": True for key in item["tags"]
+        }
+    }
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def percentile(samples, ratio: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(ratio * (len(ordered) - 1))]
+
+
 def is_valid_uuid4(value: str | UUID) -> bool:
     value = str(value).strip()
     try:
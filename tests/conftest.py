@@ -0,0 +1,23 @@
+import os
+
+# src.config đọc các biến bắt buộc lúc import, test không gọi service thật nên giá trị giả là đủ
+for name in (
+    "OPENAI_ENDPOINT",
+    "OPENAI_LLM_API_KEY",
+    "OPENAI_LLM_MODEL",
+    "OPENAI_EMBEDDING_API_KEY",
+    "OPENAI_EMBEDDING_MODEL",
+    "OPENAI_API_VERSION",
+    "GEMINI_API_KEY",
+    "GEMINI_MODEL",
+    "ENVIRONMENT",
+    "POSTGRES_HOST",
+    "POSTGRES_USER",
+    "POSTGRES_PASSWORD",
+    "POSTGRES_DB",
+    "FILE_SERVER_ENDPOINT",
+    "FILE_SERVER_ACCESS_KEY",
+    "FILE_SERVER_SECRET_KEY",
+):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("POSTGRES_PORT", "5432")
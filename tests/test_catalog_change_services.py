@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from src.services.catalog_change_services import CatalogChangeListener
+
+
+class FakeConnection:
+    async def fetchval(self, query):
+        return 1
+
+
+def notify(listener: CatalogChangeListener, event: dict):
+    listener._on_notify(None, 0, "catalog_changes", json.dumps(event))
+
+
+def run_listener(listener: CatalogChangeListener, until, scenario):
+    async def run():
+        task = asyncio.create_task(listener._listen(FakeConnection()))
+        try:
+            await scenario()
+            for _ in range(200):
+                if until():
+                    return
+                await asyncio.sleep(0.01)
+            raise AssertionError("listener did not dispatch in time")
+        finally:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def test_failed_dispatch_is_retried_with_events_received_meanwhile():
+    attempts, dispatched = [], []
+
+    def on_changes(events):
+        attempts.append(events)
+        if len(attempts) == 1:
+            raise ConnectionError("broker down")
+        dispatched.extend(events)
+
+    listener = CatalogChangeListener("", on_changes, debounce_ms=10, dispatch_retry_delay=0.2)
+    brand = {"table": "brands", "op": "UPDATE", "id": 1}
+    variant = {"table": "product_variants", "op": "DELETE", "id": 7}
+
+    async def scenario():
+        notify(listener, brand)
+        notify(listener, brand)
+        while not attempts:
+            await asyncio.sleep(0.01)
+        # tới trong lúc chờ backoff: gửi cùng batch lỗi
+        notify(listener, variant)
+
+    run_listener(listener, lambda: dispatched, scenario)
+    assert attempts[0] == [brand]
+    assert sorted(dispatched, key=lambda event: event["id"]) == [brand, variant]
+    assert listener._failed == {}
+
+
+def test_retry_delay_backs_off_up_to_the_limit():
+    listener = CatalogChangeListener("", lambda events: None, dispatch_retry_delay=1, max_dispatch_retry_delay=5)
+    delays = []
+    for failures in range(1, 6):
+        listener._dispatch_failures = failures
+        delays.append(listener._dispatch_backoff())
+    assert delays == [1, 2, 4, 5, 5]
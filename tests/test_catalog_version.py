@@ -0,0 +1,41 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from src.constants import CATALOG_INDEX_VERSION_KEY
+from src.services.collection_alias_services import CollectionAliases
+from src.tasks import embedding_tasks, queue_uitils
+from src.tools.cache import bump_catalog_version, get_catalog_version
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+    sync_redis = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(queue_uitils, "redis_client", sync_redis)
+    monkeypatch.setattr(queue_uitils, "catalog_redis_client", sync_redis)
+    monkeypatch.setattr(embedding_tasks, "catalog_redis_client", sync_redis)
+    monkeypatch.setattr(embedding_tasks, "collection_aliases", CollectionAliases(sync_redis))
+    monkeypatch.setattr(embedding_tasks.process_unembedding_queue, "delay", lambda *args, **kwargs: None)
+    return server
+
+
+def catalog_version(server) -> int:
+    return asyncio.run(get_catalog_version(fakeredis.FakeAsyncRedis(server=server)))
+
+
+def test_embedding_updates_and_admin_edits_share_one_catalog_version(redis_server):
+    queue_uitils.publish_catalog_update("upsert", ["a"], ["doc"], [{}])
+    assert catalog_version(redis_server) == 1
+    asyncio.run(bump_catalog_version(fakeredis.FakeAsyncRedis(server=redis_server)))
+    queue_uitils.publish_catalog_update("delete", ["a"])
+    assert catalog_version(redis_server) == 3
+    assert int(fakeredis.FakeRedis(server=redis_server).get(CATALOG_INDEX_VERSION_KEY)) == 3
+
+
+def test_collection_switch_and_rollback_bump_catalog_version(redis_server):
+    embedding_tasks.activate_collections({"product_variants": "product_variants__v1"})
+    assert catalog_version(redis_server) == 1
+    embedding_tasks.rollback_collections()
+    assert catalog_version(redis_server) == 2
@@ -0,0 +1,50 @@
+import asyncio
+
+from src.services.chat_services import RAG, GuardedRAGAgent
+from src.services.lexical_index_services import BM25Index
+
+
+def make_rag() -> RAG:
+    index = BM25Index()
+    index.add_many(
+        ["iphone", "galaxy"],
+        ["Điện thoại iPhone 15 Pro 256GB", "Điện thoại Samsung Galaxy S24 Ultra"],
+        [{"name": "iPhone 15 Pro"}, {"name": "Galaxy S24 Ultra"}],
+    )
+    return RAG("product_variants", lexical_index=index)
+
+
+def make_agent(**kwargs) -> GuardedRAGAgent:
+    return GuardedRAGAgent(rag=make_rag(), embedding_client=None, embedding_model="test", **kwargs)
+
+
+def test_keyword_search_keeps_bm25_score_out_of_distance():
+    results = asyncio.run(make_rag().keyword_search("galaxy ultra"))
+    assert results[0]["_id"] == "galaxy"
+    assert results[0]["distance"] is None
+    assert results[0]["score"] > 0
+
+
+def test_fusion_keeps_vector_distance_and_bm25_score():
+    rag = make_rag()
+    vector = [rag._format_document("iphone", "", {}, distance=0.9)]
+    keyword = [rag._format_document("galaxy", "", {}, score=4.2), rag._format_document("iphone", "", {}, score=1.5)]
+    fused = {r["_id"]: r for r in rag.reciprocal_rank_fusion([vector, keyword])}
+    assert (fused["iphone"]["distance"], fused["iphone"]["score"]) == (0.9, 1.5)
+    assert (fused["galaxy"]["distance"], fused["galaxy"]["score"]) == (None, 4.2)
+
+
+def test_plan_applies_each_threshold_to_its_own_scale():
+    agent = make_agent(similarity_threshold=0.8, keyword_score_threshold=2.0)
+    rag = agent.rag
+    results = [
+        rag._format_document("vector_hit", "", {}, distance=0.85),
+        rag._format_document("vector_miss", "", {}, distance=0.5, score=1.0),
+        # BM25 score lớn hơn ngưỡng cosine nhưng dưới ngưỡng BM25
+        rag._format_document("keyword_miss", "", {}, score=1.2),
+        rag._format_document("keyword_hit", "", {}, score=3.5),
+    ]
+    assert [r["_id"] for r in results if agent._is_relevant(r)] == ["vector_hit", "keyword_hit"]
+
+    plan = agent._build_plan("q", None, "q", [0.0], None, [results[2]])
+    assert plan["route"] == "empty"
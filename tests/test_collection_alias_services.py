@@ -0,0 +1,51 @@
+import asyncio
+
+import fakeredis
+
+from src.services.collection_alias_services import (
+    CollectionAliases,
+    collection_version,
+    resolve_collection_aliases,
+    versioned_name,
+)
+
+VARIANTS, GROUPS = "product_variants", "product_groups"
+
+
+def test_unaliased_collection_is_version_zero():
+    aliases = CollectionAliases(fakeredis.FakeRedis())
+    assert aliases.resolve(VARIANTS) == VARIANTS
+    assert aliases.previous([VARIANTS]) == {VARIANTS: None}
+    assert not aliases.rollback()
+    assert collection_version(VARIANTS, VARIANTS) == 0
+    assert collection_version(VARIANTS, versioned_name(VARIANTS, 3)) == 3
+    assert collection_version(VARIANTS, "other__v3") is None
+
+
+def test_switch_moves_all_aliases_and_keeps_previous():
+    aliases = CollectionAliases(fakeredis.FakeRedis())
+    aliases.switch({VARIANTS: versioned_name(VARIANTS, 1), GROUPS: versioned_name(GROUPS, 1)})
+    aliases.switch({VARIANTS: versioned_name(VARIANTS, 2), GROUPS: versioned_name(GROUPS, 2)})
+    assert aliases.resolve_all([VARIANTS, GROUPS]) == {VARIANTS: "product_variants__v2", GROUPS: "product_groups__v2"}
+    assert aliases.previous([VARIANTS, GROUPS]) == {VARIANTS: "product_variants__v1", GROUPS: "product_groups__v1"}
+
+
+def test_rollback_swaps_and_a_second_rollback_restores():
+    server = fakeredis.FakeServer()
+    aliases = CollectionAliases(fakeredis.FakeRedis(server=server))
+    aliases.switch({VARIANTS: versioned_name(VARIANTS, 1)})
+
+    assert aliases.rollback()
+    assert aliases.resolve(VARIANTS) == VARIANTS
+    assert aliases.previous([VARIANTS]) == {VARIANTS: "product_variants__v1"}
+
+    assert aliases.rollback()
+    assert aliases.resolve(VARIANTS) == "product_variants__v1"
+    # API worker đọc alias qua client async
+    resolved = asyncio.run(resolve_collection_aliases(fakeredis.FakeAsyncRedis(server=server), [VARIANTS, GROUPS]))
+    assert resolved == {VARIANTS: "product_variants__v1", GROUPS: GROUPS}
+
+
+def test_next_version_is_monotonic():
+    aliases = CollectionAliases(fakeredis.FakeRedis())
+    assert [aliases.next_version() for _ in range(3)] == [1, 2, 3]
@@ -0,0 +1,67 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from src.services.collection_maintenance_services import CollectionMaintenanceJob
+
+
+class FakeCollection:
+    name = "product_variants"
+
+    def __init__(self, ids: list[str], fail_deletes_after: int = None):
+        self.ids = list(ids)
+        self.fail_deletes_after = fail_deletes_after
+        self.delete_calls = 0
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include, limit, offset=0, where=None):
+        return {"ids": self.ids[offset:offset + limit]}
+
+    def delete(self, ids):
+        if self.fail_deletes_after is not None and self.delete_calls >= self.fail_deletes_after:
+            raise RuntimeError("worker killed")
+        self.delete_calls += 1
+        self.ids = [doc_id for doc_id in self.ids if doc_id not in ids]
+
+
+def orphans(page: dict) -> list[str]:
+    return [doc_id for doc_id in page["ids"] if doc_id.startswith("orphan")]
+
+
+def make_job(collection: FakeCollection, redis) -> CollectionMaintenanceJob:
+    return CollectionMaintenanceJob(collection, redis, "orphans", page_size=4, delete_batch_size=1)
+
+
+def documents() -> list[str]:
+    # page đầu có 2 orphan, orphan cuối nằm ở page sau
+    return ["keep0", "orphan0", "keep1", "orphan1", "keep2", "keep3", "orphan2", "keep4"]
+
+
+def test_prune_deletes_orphans_and_keeps_the_rest():
+    collection = FakeCollection(documents())
+    progress = asyncio.run(make_job(collection, fakeredis.FakeRedis()).prune(orphans))
+    assert collection.ids == ["keep0", "keep1", "keep2", "keep3", "keep4"]
+    assert (progress["scanned"], progress["deleted"], progress["status"]) == (8, 3, "done")
+
+
+@pytest.mark.parametrize("fail_deletes_after", [0, 1])
+def test_prune_crash_during_delete_resumes_without_skipping(fail_deletes_after):
+    redis = fakeredis.FakeRedis()
+    collection = FakeCollection(documents(), fail_deletes_after=fail_deletes_after)
+    with pytest.raises(RuntimeError):
+        asyncio.run(make_job(collection, redis).prune(orphans))
+
+    collection.fail_deletes_after = None
+    asyncio.run(make_job(collection, redis).prune(orphans))
+    assert collection.ids == ["keep0", "keep1", "keep2", "keep3", "keep4"]
+    assert redis.hget(make_job(collection, redis).key, "pending") is None
+
+
+def test_delete_where_clears_collection():
+    collection = FakeCollection(documents())
+    progress = asyncio.run(make_job(collection, fakeredis.FakeRedis()).delete_where())
+    assert collection.ids == []
+    assert progress["deleted"] == 8
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+from openai import APIConnectionError, APIStatusError
+
+from src.services.embedding_pipeline_services import EmbeddingPipeline, is_retryable
+
+
+class FakeEmbeddingClient:
+    """Client openai sync giả, request đầu tiên chặn tới khi `release` được set."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.embeddings = self
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create(self, model, input):
+        self.calls.append(list(input))
+        if len(self.calls) == 1:
+            self.release.wait(5)
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        )
+
+
+def test_sends_immediately_when_idle_and_packs_while_busy():
+    client = FakeEmbeddingClient()
+
+    async def run():
+        pipeline = EmbeddingPipeline(client, "test", max_tokens=10_000)
+        first = pipeline.submit({"a": "aaaa"})
+        await asyncio.sleep(0.05)
+        # request đầu đang chạy: text mới chờ trong pack
+        second = pipeline.submit({"b": "bb"})
+        third = pipeline.submit({"c": "c"})
+        client.release.set()
+        vectors = await asyncio.wait_for(asyncio.gather(first["a"], second["b"], third["c"]), 5)
+        await pipeline.close()
+        return vectors
+
+    assert asyncio.run(run()) == [[4.0], [2.0], [1.0]]
+    assert client.calls == [["aaaa"], ["bb", "c"]]
+
+
+def test_retries_only_transient_errors():
+    request = httpx.Request("POST", "http://openai.test/v1/embeddings")
+
+    def status_error(code: int) -> APIStatusError:
+        return APIStatusError("error", response=httpx.Response(code, request=request), body=None)
+
+    assert is_retryable(APIConnectionError(request=request))
+    assert is_retryable(status_error(429))
+    assert is_retryable(status_error(503))
+    assert not is_retryable(status_error(400))
+    assert not is_retryable(ValueError("bad input"))
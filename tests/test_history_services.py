@@ -0,0 +1,91 @@
+import asyncio
+
+import fakeredis
+
+from src.services.history_services import ChatHistoryStore, HistoryCompactor, message_tokens
+
+
+def history(messages: int, summary: dict = None) -> dict:
+    return {
+        "session_id": "s1",
+        "messages": [
+            ChatHistoryStore.build_message("human" if i % 2 == 0 else "ai", f"tin nhắn số {i} " * 10, created_at=i + 1)
+            for i in range(messages)
+        ],
+        "summary": summary,
+    }
+
+
+def tokens(result: list[dict]) -> int:
+    return sum(message_tokens(m) for m in result)
+
+
+def test_everything_fits_without_summary():
+    compactor = HistoryCompactor(ChatHistoryStore(fakeredis.FakeAsyncRedis()))
+    data = history(4)
+    result = compactor.compact(data, budget=10_000)
+    assert [m["content"] for m in result] == [m["content"] for m in data["messages"]]
+
+
+def test_keeps_newest_messages_within_budget():
+    compactor = HistoryCompactor(ChatHistoryStore(fakeredis.FakeAsyncRedis()))
+    data = history(20)
+    budget = tokens(data["messages"][-5:])
+    dropped, kept = compactor.split(data, budget)
+    assert kept == data["messages"][-5:]
+    assert dropped == data["messages"][:-5]
+    assert tokens(compactor.compact(data, budget)) <= budget
+
+
+def test_summary_counts_against_budget_and_replaces_dropped_messages():
+    compactor = HistoryCompactor(ChatHistoryStore(fakeredis.FakeAsyncRedis()))
+    data = history(20, summary={"summary": "khách hỏi về laptop gaming " * 10, "until": 10})
+    budget = message_tokens(data["messages"][0]) * 5
+    result = compactor.compact(data, budget)
+    assert result[0]["role"] == "system" and "laptop gaming" in result[0]["content"]
+    assert len(result) - 1 < 5
+    assert tokens(result) <= budget
+
+
+def test_refresh_summarizes_only_messages_after_previous_summary():
+    redis = fakeredis.FakeAsyncRedis()
+    store = ChatHistoryStore(redis)
+    prompts = []
+
+    async def summarizer(messages):
+        prompts.append(messages[0]["content"])
+        return "tóm tắt mới"
+
+    compactor = HistoryCompactor(store, summarizer=summarizer, refresh_min_tokens=1)
+    data = history(20, summary={"summary": "cũ", "until": 10})
+    budget = message_tokens(data["messages"][0]) * 5
+
+    async def run():
+        compactor.schedule_refresh(data, budget)
+        await compactor.drain()
+        return await store.get_summary("s1")
+
+    summary = asyncio.run(run())
+    dropped, _ = compactor.split(data, budget)
+    assert summary == {"summary": "tóm tắt mới", "until": dropped[-1]["created_at"]}
+    assert "tin nhắn số 9 " not in prompts[0]
+    assert "tin nhắn số 10 " in prompts[0]
+
+
+def test_no_refresh_below_min_tokens():
+    called = []
+
+    async def summarizer(messages):
+        called.append(messages)
+        return ""
+
+    compactor = HistoryCompactor(
+        ChatHistoryStore(fakeredis.FakeAsyncRedis()), summarizer=summarizer, refresh_min_tokens=10_000
+    )
+
+    async def run():
+        compactor.schedule_refresh(history(20), budget=100)
+        await compactor.drain()
+
+    asyncio.run(run())
+    assert called == []
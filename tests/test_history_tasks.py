@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+from src.services.history_services import ChatHistoryStore
+from src.tasks import history_tasks
+
+
+class FakeCollection:
+    def __init__(self, documents: list[str], metadatas: list[dict | None], fail_at_offset: int = None):
+        self.documents = documents
+        self.metadatas = metadatas
+        self.fail_at_offset = fail_at_offset
+
+    def count(self):
+        return len(self.documents)
+
+    def get(self, limit, offset, include):
+        if offset == self.fail_at_offset:
+            raise RuntimeError("chroma down")
+        return {
+            "documents": self.documents[offset:offset + limit],
+            "metadatas": self.metadatas[offset:offset + limit],
+        }
+
+
+def history_document(session_id: str, role: str, content: str) -> str:
+    return json.dumps({"SessionId": session_id, "History": {"type": role, "data": {"type": role, "content": content}}})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(history_tasks, "Redis", lambda **kwargs: fakeredis.FakeAsyncRedis(server=server))
+    return server
+
+
+def use_collection(monkeypatch, collection: FakeCollection):
+    class Client:
+        def get_or_create_collection(self, name):
+            return collection
+
+    monkeypatch.setattr(history_tasks, "get_chroma_client", lambda: Client())
+
+
+def stored(server, session_id: str) -> list[dict]:
+    store = ChatHistoryStore(fakeredis.FakeAsyncRedis(server=server))
+    return asyncio.run(store.last(session_id, 100))
+
+
+def build_collection(fail_at_offset: int = None) -> FakeCollection:
+    documents, metadatas = [], []
+    for i in range(5):
+        documents.append(history_document("s1", "human" if i % 2 == 0 else "ai", f"m{i}"))
+        metadatas.append({"created_at": 1_700_000_000 + i} if i < 2 else None)
+    return FakeCollection(documents, metadatas, fail_at_offset)
+
+
+def test_crash_between_pages_resumes_without_duplicates(server, monkeypatch):
+    use_collection(monkeypatch, build_collection(fail_at_offset=2))
+    with pytest.raises(RuntimeError):
+        history_tasks.migrate_chat_history(page_size=2)
+    assert [m["content"] for m in stored(server, "s1")] == ["m0", "m1"]
+
+    use_collection(monkeypatch, build_collection())
+    history_tasks.migrate_chat_history(page_size=2)
+    history_tasks.migrate_chat_history(page_size=2)
+    assert [m["content"] for m in stored(server, "s1")] == ["m0", "m1", "m2", "m3", "m4"]
+
+
+def test_keeps_source_timestamps_and_order(server, monkeypatch):
+    use_collection(monkeypatch, build_collection())
+    history_tasks.migrate_chat_history(page_size=2)
+    created = [m["created_at"] for m in stored(server, "s1")]
+    started_at = float(fakeredis.FakeRedis(server=server).get(history_tasks.MIGRATION_STARTED_AT_KEY))
+
+    assert created[:2] == [1_700_000_000, 1_700_000_001]
+    # document không có created_at: trước lúc migrate, giữ thứ tự insert
+    assert created[2] < created[3] < created[4] < started_at
+
+
+def test_merges_with_live_messages_by_created_at(server, monkeypatch):
+    monkeypatch.setattr(history_tasks.settings, "CHAT_HISTORY_MAX_STORED_ITEMS", 4)
+    store = ChatHistoryStore(fakeredis.FakeAsyncRedis(server=server), max_stored_items=4)
+    live = [store.build_message("human", "live question"), store.build_message("ai", "live answer")]
+    asyncio.run(store.append("s1", *live))
+
+    use_collection(monkeypatch, build_collection())
+    history_tasks.migrate_chat_history(page_size=2)
+
+    # history cũ xếp trước, bị trim là message cũ nhất chứ không phải message live
+    assert [m["content"] for m in stored(server, "s1")] == ["m3", "m4", "live question", "live answer"]
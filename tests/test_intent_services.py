@@ -0,0 +1,58 @@
+import pytest
+
+from src.services.intent_services import AhoCorasick, ProductIntentClassifier
+
+CATALOG_KEYWORDS = ["Apple", "Samsung", "iPhone 15", "Galaxy S24", "Điện thoại"]
+
+
+@pytest.fixture
+def classifier():
+    return ProductIntentClassifier()
+
+
+@pytest.mark.parametrize("query", [
+    "gia đình mình khỏe",
+    "tham gia ko",
+    "mình mới tham gia nhóm",
+    "đi mau lên bạn ơi",
+    "rẽ trái ở đâu",
+    "xin chào",
+    "cảm ơn bạn nhé",
+    "hôm nay thời tiết thế nào",
+])
+def test_small_talk_is_not_classified_as_product_query(classifier, query):
+    assert classifier.classify(query, CATALOG_KEYWORDS) is not True
+
+
+@pytest.mark.parametrize("query", [
+    "giá bao nhiêu vậy",
+    "gia bao nhieu",
+    "cho mình xem bảng giá",
+    "có máy nào giá rẻ không",
+    "laptop nào pin trâu",
+    "máy 8gb ram",
+    "mua trả góp được không",
+])
+def test_product_hints_classify_without_llm(classifier, query):
+    assert classifier.classify(query, CATALOG_KEYWORDS) is True
+
+
+@pytest.mark.parametrize("query", ["iphone 15 con hang khong", "so sánh galaxy s24"])
+def test_catalog_keyword_match_is_product_query(classifier, query):
+    assert classifier.classify(query, CATALOG_KEYWORDS) is True
+    assert classifier.stats["catalog_match"] == 1
+
+
+def test_greetings_are_small_talk(classifier):
+    assert classifier.classify("xin chào, bạn là ai", CATALOG_KEYWORDS) is False
+
+
+def test_ambiguous_query_is_escalated(classifier):
+    assert classifier.classify("màu này đẹp không", CATALOG_KEYWORDS) is None
+    assert classifier.metrics()["escalation_rate"] == 1.0
+
+
+def test_aho_corasick_matches_whole_words_only():
+    matcher = AhoCorasick(["ram", "pin", "may tinh", "may tinh bang"])
+    assert matcher.find_words("program pinned") == set()
+    assert matcher.find_words("may tinh bang 8gb ram") == {"may tinh", "may tinh bang", "ram"}
@@ -0,0 +1,43 @@
+from src.services.lexical_index_services import BM25Index
+
+
+def build_index() -> BM25Index:
+    index = BM25Index()
+    index.add_many(
+        ["iphone", "galaxy", "case", "macbook"],
+        [
+            "Điện thoại iPhone 15 Pro 256GB màu titan",
+            "Điện thoại Samsung Galaxy S24 Ultra 512GB",
+            "Ốp lưng iPhone 15 Pro silicon, phụ kiện điện thoại iPhone",
+            "Laptop MacBook Air M3 16GB",
+        ],
+        [{"brand": "Apple"}, {"brand": "Samsung"}, {"brand": "Apple"}, {"brand": "Apple"}],
+    )
+    return index
+
+
+def test_rare_terms_outrank_common_terms():
+    hits = build_index().search("galaxy điện thoại")
+    assert hits[0][0] == "galaxy"
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+def test_accents_and_units_match_either_way():
+    index = build_index()
+    assert index.search("dien thoai iphone 256 gb")[0][0] == "iphone"
+    assert index.search("macbook 16gb")[0][0] == "macbook"
+
+
+def test_doc_filter_applies_before_ranking():
+    hits = build_index().search("điện thoại", doc_filter=lambda meta: meta["brand"] == "Samsung")
+    assert [doc_id for doc_id, _ in hits] == ["galaxy"]
+
+
+def test_update_and_remove_keep_index_consistent():
+    index = build_index()
+    index.add("galaxy", "Máy tính bảng Galaxy Tab S9")
+    assert "galaxy" not in [doc_id for doc_id, _ in index.search("ultra")]
+    index.remove("galaxy")
+    assert "galaxy" not in index
+    assert index.search("galaxy") == []
+    assert index.total_length == sum(index.doc_lengths.values())
@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+
+from src.services.llm_router_services import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    LLMRouter,
+    LLMUnavailableError,
+)
+
+
+class FakeProvider:
+    def __init__(self, answer: str, delay: float = 0.0, fail: bool = False):
+        self.answer = answer
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def chat(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.answer} down")
+        return self.answer
+
+    async def chat_stream(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.answer} down")
+        for token in self.answer.split():
+            yield token
+
+
+MESSAGES = [{"role": "human", "content": "chào"}]
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    # probe lỗi thì mở lại ngay, không chờ đủ threshold
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED and breaker.failures == 0
+
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_falls_back_and_skips_open_provider():
+    primary, secondary = FakeProvider("openai", fail=True), FakeProvider("gemini")
+    router = LLMRouter([("openai", primary), ("gemini", secondary)], failure_threshold=2, recovery_timeout=60)
+
+    async def run():
+        return [await router.chat(MESSAGES) for _ in range(3)]
+
+    assert asyncio.run(run()) == ["gemini"] * 3
+    # mở circuit sau 2 lỗi, lần thứ 3 không gọi openai nữa
+    assert primary.calls == 2
+    assert router.providers[0].breaker.state == CIRCUIT_OPEN
+    assert router.providers[0].stats["skipped"] == 1
+    assert router.stats["fallbacks"] == 2
+
+
+def test_deadline_counts_as_failure():
+    router = LLMRouter(
+        [("openai", FakeProvider("openai", delay=1)), ("gemini", FakeProvider("gemini"))], timeout=0.05
+    )
+    assert asyncio.run(router.chat(MESSAGES)) == "gemini"
+    assert router.providers[0].stats["timeouts"] == 1
+    assert router.providers[0].breaker.failures == 1
+
+
+def test_all_providers_failing_raises_unavailable():
+    router = LLMRouter([("openai", FakeProvider("openai", fail=True)), ("gemini", FakeProvider("gemini", fail=True))])
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(router.chat(MESSAGES))
+
+
+def test_hedges_slow_provider_and_cancels_the_loser():
+    router = LLMRouter(
+        [("openai", FakeProvider("openai", delay=1)), ("gemini", FakeProvider("gemini", delay=0.01))],
+        hedging=True,
+        hedge_delay=0.05,
+    )
+    started = time.monotonic()
+    assert asyncio.run(router.chat(MESSAGES)) == "gemini"
+    assert time.monotonic() - started < 0.5
+    openai = router.providers[0]
+    assert router.stats["hedged"] == 1
+    assert openai.stats["cancelled"] == 1
+    # thua hedge không phải lỗi của provider
+    assert openai.breaker.failures == 0
+
+
+def test_no_hedge_when_primary_is_fast():
+    secondary = FakeProvider("gemini")
+    router = LLMRouter([("openai", FakeProvider("openai")), ("gemini", secondary)], hedging=True, hedge_delay=0.5)
+    assert asyncio.run(router.chat(MESSAGES)) == "openai"
+    assert secondary.calls == 0
+    assert router.stats["hedged"] == 0
+
+
+def test_stream_falls_back_before_first_token():
+    router = LLMRouter([("openai", FakeProvider("openai", fail=True)), ("gemini", FakeProvider("xin chào bạn"))])
+
+    async def run():
+        return [token async for token in router.chat_stream(MESSAGES)]
+
+    assert asyncio.run(run()) == ["xin", "chào", "bạn"]
+    assert router.providers[0].breaker.failures == 1
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import uuid
+from types import SimpleNamespace
+
+from src.schemas.product_variant_schemas import ProductVariantUpdateSchema
+from src.services import product_variant_services
+from src.services.product_variant_services import ProductVariantService
+
+
+class FakeResult:
+    def __init__(self, obj):
+        self.obj = obj
+
+    def scalar_one_or_none(self):
+        return self.obj
+
+    def scalar_one(self):
+        return self.obj
+
+
+class FakeSession:
+    """Trả về kết quả theo thứ tự các câu query của `ProductVariantService.update`."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+        self.commits = 0
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult(self.results.pop(0))
+
+    async def commit(self):
+        self.commits += 1
+
+    async def refresh(self, obj, attribute_names=None):
+        pass
+
+
+def make_variant():
+    brand = SimpleNamespace(name="Apple")
+    category = SimpleNamespace(name="Điện thoại")
+    product_line = SimpleNamespace(description="Dòng iPhone", brand=brand, category=category)
+    product = SimpleNamespace(
+        id=uuid.uuid4(), name="iPhone 15", description="iPhone 15", product_line=product_line, product_line_id=uuid.uuid4()
+    )
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        name="iPhone 15 128GB",
+        product_id=product.id,
+        product=product,
+        price=20_000_000,
+        stock=3,
+        specs={"ram": "6GB"},
+        url=None,
+        slug=None,
+        tags=[SimpleNamespace(name="5g")],
+    )
+
+
+def test_update_enqueues_interactive_embedding_off_the_event_loop(monkeypatch):
+    variant = make_variant()
+    session = FakeSession(variant, variant.product, variant)
+    enqueued = []
+    bumped = []
+
+    async def bump_catalog_version(redis):
+        bumped.append(redis)
+
+    def enqueue_text(text_data, lane="background"):
+        enqueued.append((text_data, lane, threading.current_thread()))
+
+    monkeypatch.setattr(product_variant_services, "bump_catalog_version", bump_catalog_version, raising=False)
+    monkeypatch.setattr(product_variant_services, "enqueue_text", enqueue_text)
+
+    service = ProductVariantService(session)
+    obj = asyncio.run(service.update(str(variant.id), ProductVariantUpdateSchema(price=18_000_000)))
+
+    assert obj is variant
+    assert variant.price == 18_000_000
+    assert variant.url == f"/product-variants/{variant.slug}"
+    assert session.commits == 1
+    assert len(enqueued) == 1
+    text_data, lane, thread = enqueued[0]
+    assert lane == "interactive"
+    assert thread is not threading.main_thread()
+    assert text_data["id"] == str(variant.id)
+    assert text_data["price"] == 18_000_000
+    assert text_data["brand"] == "Apple"
+    assert text_data["tags"] == ["5g"]
+    assert "Price: 18000000" in text_data["text"]
+
+
+def test_update_missing_variant_does_not_enqueue(monkeypatch):
+    enqueued = []
+    monkeypatch.setattr(product_variant_services, "enqueue_text", lambda *args: enqueued.append(args))
+    service = ProductVariantService(FakeSession(None))
+    assert asyncio.run(service.update(str(uuid.uuid4()), ProductVariantUpdateSchema(price=1))) is None
+    assert not enqueued
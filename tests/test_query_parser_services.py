@@ -0,0 +1,124 @@
+import pytest
+
+from src.services.query_parser_services import QueryParser
+
+FACETS = {
+    "brands": ["Samsung", "Apple", "LG"],
+    "categories": ["smartphone", "laptop", "headphones"],
+    "tags": ["gaming", "wireless"],
+}
+
+
+@pytest.fixture
+def parser() -> QueryParser:
+    parser = QueryParser()
+    parser.update_facets(FACETS)
+    return parser
+
+
+def test_brand_category_and_max_price(parser):
+    constraints = parser.parse("Điện thoại Samsung dưới 10 triệu")
+    assert constraints == {
+        "brands": ["Samsung"],
+        "categories": ["smartphone"],
+        "tags": [],
+        "min_price": None,
+        "max_price": 10_000_000,
+    }
+
+
+@pytest.mark.parametrize(
+    "query, min_price, max_price",
+    [
+        ("laptop chơi game từ 15 đến 20tr", 15_000_000, 20_000_000),
+        ("tai nghe trên 500k", 500_000, None),
+        ("iphone tầm 20 triệu", 17_000_000, 23_000_000),
+        ("laptop cho văn phòng", None, None),
+    ],
+)
+def test_price_ranges(parser, query, min_price, max_price):
+    constraints = parser.parse(query)
+    assert constraints["min_price"] == pytest.approx(min_price)
+    assert constraints["max_price"] == pytest.approx(max_price)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "laptop có 16 GB RAM không",
+        "dưới 16gb có bản nào",
+        "từ 8 đến 16 GB ram",
+        "pin trên 4000 mAh",
+        "màn hình tầm 6.1 inch",
+        "Samsung có 5 màu không",
+        "có 2 phiên bản nào",
+        "Galaxy S23 từ 2023 không",
+        "iphone giá 2023",
+    ],
+)
+def test_specs_counts_and_years_are_not_prices(parser, query):
+    constraints = parser.parse(query)
+    assert (constraints["min_price"], constraints["max_price"]) == (None, None)
+
+
+def test_from_needs_a_price_unit_or_price_word(parser):
+    assert parser.parse("từ 10 triệu")["min_price"] == 10_000_000
+    assert parser.parse("giá từ 15 đến 20")["min_price"] == 15_000_000
+    assert parser.parse("laptop từ 15 đến 20")["min_price"] is None
+
+
+def test_spec_number_does_not_hide_the_real_price(parser):
+    constraints = parser.parse("laptop từ 8 đến 16 GB giá dưới 20 triệu")
+    assert (constraints["min_price"], constraints["max_price"]) == (None, 20_000_000)
+
+
+def test_query_without_constraints_keeps_an_empty_where(parser):
+    assert QueryParser.to_chroma_where(parser.parse("có 2 phiên bản nào")) is None
+    assert QueryParser.to_chroma_where(parser.parse("Samsung có 5 màu không")) == {"brand": {"$in": ["Samsung"]}}
+
+
+def test_synonyms_map_to_catalog_names_only(parser):
+    constraints = parser.parse("tai nghe không dây chơi game")
+    assert constraints["categories"] == ["headphones"]
+    assert constraints["tags"] == ["gaming", "wireless"]
+    # "máy ảnh" -> camera nhưng catalog không có category camera
+    assert parser.parse("máy ảnh")["categories"] == []
+
+
+def test_names_match_whole_words(parser):
+    assert parser.parse("pineapple flagship")["brands"] == []
+    assert parser.parse("màn hình LG")["brands"] == ["LG"]
+
+
+def test_chroma_where_and_local_matches_agree(parser):
+    constraints = parser.parse("điện thoại Samsung hoặc Apple chơi game dưới 10 triệu")
+    assert QueryParser.to_chroma_where(constraints) == {
+        "$and": [
+            {"brand": {"$in": ["Apple", "Samsung"]}},
+            {"category": {"$in": ["smartphone"]}},
+            {"tag_gaming": True},
+            {"price": {"$lte": 10_000_000}},
+        ]
+    }
+    base = {"brand": "Samsung", "category": "smartphone", "tag_gaming": True, "price": 8_000_000}
+    assert QueryParser.matches(base, constraints)
+    assert not QueryParser.matches({**base, "brand": "LG"}, constraints)
+    assert not QueryParser.matches({**base, "price": 12_000_000}, constraints)
+    assert not QueryParser.matches({**base, "tag_gaming": False}, constraints)
+    assert not QueryParser.matches({key: value for key, value in base.items() if key != "price"}, constraints)
+
+
+def test_empty_constraints_do_not_filter(parser):
+    constraints = parser.parse("xin chào")
+    assert QueryParser.is_empty(constraints)
+    assert QueryParser.to_chroma_where(constraints) is None
+    assert QueryParser.matches({"brand": "LG"}, constraints)
+
+
+def test_product_scope_is_an_or(parser):
+    constraints = {"product_ids": ["p1"], "product_line_ids": ["l1"]}
+    assert QueryParser.to_chroma_where(constraints) == {
+        "$or": [{"product_id": {"$in": ["p1"]}}, {"product_line_id": {"$in": ["l1"]}}]
+    }
+    assert QueryParser.matches({"product_line_id": "l1"}, constraints)
+    assert not QueryParser.matches({"product_id": "p2", "product_line_id": "l2"}, constraints)
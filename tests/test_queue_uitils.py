@@ -0,0 +1,119 @@
+import json
+import time
+
+import fakeredis
+import pytest
+
+from src.constants import (
+    EMBEDDING_CONSUMER_GROUP,
+    EMBEDDING_DEAD_LETTER_STREAM,
+    EMBEDDING_INFLIGHT_KEY,
+    EMBEDDING_JOBS_KEY,
+    EMBEDDING_LANES,
+    EMBEDDING_MAX_DELIVERIES,
+)
+from src.tasks import queue_uitils
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(queue_uitils, "redis_client", redis)
+    monkeypatch.setattr(queue_uitils, "enqueue_script", redis.register_script(queue_uitils.ENQUEUE_SCRIPT))
+    monkeypatch.setattr(queue_uitils, "take_script", redis.register_script(queue_uitils.TAKE_SCRIPT))
+    monkeypatch.setattr(queue_uitils, "_group_ready", False)
+    flushes = []
+    monkeypatch.setattr(queue_uitils, "schedule_flush", flushes.append)
+    redis.flushes = flushes
+    return redis
+
+
+def item(entity_id: str, text: str = "text", level: str = None) -> dict:
+    return {"id": entity_id, "text": text, **({"level": level} if level else {})}
+
+
+def claim(consumer: str, **kwargs):
+    # min_idle_ms=0: message vừa giao cũng được claim, chờ 1 chút để idle time khác 0
+    time.sleep(0.005)
+    return queue_uitils.claim_stale_batch(consumer, min_idle_ms=0, **kwargs)
+
+
+def times_delivered(redis, lane: str) -> dict[str, int]:
+    pending = redis.xpending_range(EMBEDDING_LANES[lane], EMBEDDING_CONSUMER_GROUP, min="-", max="+", count=100)
+    return {entry["message_id"].decode(): entry["times_delivered"] for entry in pending}
+
+
+def test_enqueue_coalesces_jobs_and_keeps_latest_payload(queue):
+    queue_uitils.push_to_queue(item("a", "v1"))
+    queue_uitils.push_to_queue(item("a", "v2"))
+    queue_uitils.push_to_queue(item("a", "product", level="product"))
+
+    assert queue.xlen(EMBEDDING_LANES["background"]) == 2
+    messages = queue_uitils.read_batch("w1")
+    assert [(it["id"], it.get("level"), it["text"]) for _, it in messages] == [
+        ("a", None, "v2"),
+        ("a", "product", "product"),
+    ]
+    assert queue.hlen(EMBEDDING_JOBS_KEY) == 0
+    assert queue.hlen(EMBEDDING_INFLIGHT_KEY) == 2
+
+
+def test_interactive_enqueue_upgrades_waiting_background_job(queue):
+    queue_uitils.push_to_queue(item("a", "old"))
+    queue_uitils.push_to_queue(item("a", "new"), lane="interactive")
+    queue_uitils.push_to_queue(item("a", "newest"))
+
+    assert queue.flushes == [queue_uitils.settings.EMBEDDING_FLUSH_DELAY_MS]
+    interactive = queue_uitils.read_batch("w1", lanes=["interactive"])
+    assert [(ref[0], it["text"]) for ref, it in interactive] == [("interactive", "newest")]
+    # message cũ ở lane background không còn payload, job đã được xử lý qua lane interactive
+    background = queue_uitils.read_batch("w1", lanes=["background"])
+    assert [it for _, it in background] == [None]
+
+
+def test_ack_removes_messages_and_inflight_payloads(queue):
+    for entity_id in "abc":
+        queue_uitils.push_to_queue(item(entity_id))
+    messages = queue_uitils.read_batch("w1")
+    queue_uitils.ack_messages([ref for ref, _ in messages])
+    assert queue.xlen(EMBEDDING_LANES["background"]) == 0
+    assert queue.hlen(EMBEDDING_INFLIGHT_KEY) == 0
+    assert queue_uitils.read_batch("w1") == []
+
+
+def test_claim_skips_messages_the_worker_is_still_processing(queue):
+    for entity_id in "abc":
+        queue_uitils.push_to_queue(item(entity_id))
+    refs = [ref for ref, _ in queue_uitils.read_batch("w1")]
+
+    assert claim("w1", exclude=set(refs)) == []
+    assert set(times_delivered(queue, "background").values()) == {1}
+
+    claimed = claim("w1", exclude=set(refs[:2]))
+    assert [ref for ref, _ in claimed] == refs[2:]
+    assert [it["id"] for _, it in claimed] == ["c"]
+    assert times_delivered(queue, "background")[refs[2][1]] == 2
+
+
+def test_claim_moves_messages_to_dead_letters_after_max_deliveries(queue):
+    queue_uitils.push_to_queue(item("a"))
+    queue_uitils.read_batch("w1")
+    for _ in range(EMBEDDING_MAX_DELIVERIES - 1):
+        assert len(claim("w2")) == 1
+    assert claim("w2") == []
+
+    dead = queue.xrange(EMBEDDING_DEAD_LETTER_STREAM)
+    assert len(dead) == 1
+    assert json.loads(dead[0][1][b"data"])["id"] == "a"
+    assert queue.xlen(EMBEDDING_LANES["background"]) == 0
+
+    assert queue_uitils.requeue_dead_letters() == 1
+    assert [it["id"] for _, it in queue_uitils.read_batch("w1")] == ["a"]
+
+
+def test_touch_resets_idle_time_without_counting_a_delivery(queue):
+    queue_uitils.push_to_queue(item("a"))
+    refs = [ref for ref, _ in queue_uitils.read_batch("w1")]
+    queue_uitils.touch_messages("w1", refs)
+    assert times_delivered(queue, "background") == {refs[0][1]: 1}
+    assert queue_uitils.claim_stale_batch("w2", min_idle_ms=60_000) == []
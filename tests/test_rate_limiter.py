@@ -0,0 +1,137 @@
+import asyncio
+
+import fakeredis
+import httpx
+import pytest
+from openai import APIConnectionError, AsyncOpenAI
+
+from src.services.chat_services import OpenAiClient
+from src.services.embedding_pipeline_services import is_retryable
+from src.services.llm_router_services import CIRCUIT_CLOSED, LLMRouter
+from src.tools.rate_limiter import RateLimiter, RateLimitExceeded, rate_limit_exceeded
+
+MODEL = "gpt-4o-mini"
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_limiter(server, requests_per_minute=2, background_reserve=0.0, max_wait=0.05) -> RateLimiter:
+    return RateLimiter(
+        name="openai",
+        redis=fakeredis.FakeRedis(server=server),
+        async_redis=fakeredis.FakeAsyncRedis(server=server),
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=100_000,
+        background_reserve=background_reserve,
+        max_wait={"interactive": max_wait, "background": max_wait},
+    )
+
+
+def completion(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(
+        200,
+        json={
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": MODEL,
+            "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "xin chào"}}
+            ],
+        },
+    )
+
+
+def openai_client(limiter: RateLimiter, sent: list) -> AsyncOpenAI:
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request)
+        return completion(request)
+
+    return AsyncOpenAI(
+        api_key="test",
+        base_url="http://openai.test/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(
+            transport=httpx.MockTransport(handler), event_hooks=limiter.async_httpx_hooks("interactive")
+        ),
+    )
+
+
+def test_acquire_takes_from_bucket_until_empty(server):
+    limiter = make_limiter(server)
+    limiter.acquire(MODEL, 10, "interactive")
+    limiter.acquire(MODEL, 10, "interactive")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(MODEL, 10, "interactive")
+    assert limiter.stats["interactive"]["requests"] == 2
+    assert limiter.stats["interactive"]["rejected"] == 1
+
+
+def test_background_cannot_take_the_interactive_reserve(server):
+    limiter = make_limiter(server, requests_per_minute=4, background_reserve=0.5)
+    limiter.acquire(MODEL, 10, "background")
+    limiter.acquire(MODEL, 10, "background")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(MODEL, 10, "background")
+    limiter.acquire(MODEL, 10, "interactive")
+
+
+def test_provider_429_blocks_every_worker(server):
+    limiter = make_limiter(server, requests_per_minute=100)
+    limiter.observe(MODEL, 429, {"retry-after-ms": "5000"})
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(limiter.aacquire(MODEL, 10, "interactive"))
+    assert limiter.stats["rate_limited"] == 1
+
+
+def test_hook_rejection_reaches_caller_as_rate_limit_exceeded(server):
+    limiter = make_limiter(server, requests_per_minute=1)
+    sent = []
+    client = OpenAiClient(openai_client(limiter, sent))
+
+    async def run():
+        assert await client.chat([{"role": "human", "content": "chào"}]) == "xin chào"
+        with pytest.raises(RateLimitExceeded):
+            await client.chat([{"role": "human", "content": "chào"}])
+
+    asyncio.run(run())
+    assert len(sent) == 1
+
+
+def test_wrapped_hook_rejection_is_not_retryable(server):
+    limiter = make_limiter(server, requests_per_minute=1)
+    limiter.acquire(MODEL, 10, "interactive")
+    client = openai_client(limiter, [])
+
+    async def run():
+        with pytest.raises(APIConnectionError) as error:
+            await client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": "chào"}])
+        return error.value
+
+    error = asyncio.run(run())
+    assert isinstance(rate_limit_exceeded(error), RateLimitExceeded)
+    assert not is_retryable(error)
+
+
+def test_router_falls_back_without_counting_local_rate_limit(server):
+    limiter = make_limiter(server, requests_per_minute=1)
+    limiter.acquire(MODEL, 10, "interactive")
+    sent = []
+
+    class Fallback:
+        async def chat(self, messages):
+            return "fallback"
+
+    router = LLMRouter(
+        [("openai", OpenAiClient(openai_client(limiter, sent))), ("gemini", Fallback())], failure_threshold=1
+    )
+    assert asyncio.run(router.chat([{"role": "human", "content": "chào"}])) == "fallback"
+
+    openai = router.providers[0]
+    assert sent == []
+    assert openai.breaker.state == CIRCUIT_CLOSED
+    assert openai.stats["rate_limited"] == 1
+    assert openai.stats["failures"] == 0
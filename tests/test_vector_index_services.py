@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from src.services.vector_index_services import LocalVectorIndex
+
+
+def exact_distances(space: str, query: np.ndarray, vectors: dict[str, np.ndarray]) -> dict[str, float]:
+    distances = {}
+    for doc_id, vector in vectors.items():
+        if space == "cosine":
+            distances[doc_id] = 1 - float(vector @ query) / (np.linalg.norm(vector) * np.linalg.norm(query))
+        else:
+            distances[doc_id] = float((vector - query) @ (vector - query))
+    return distances
+
+
+def build_index(quantization: str, space: str = "l2", base_size: int = 150, delta_size: int = 50, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = {f"doc-{i}": rng.normal(size=32).astype(np.float32) for i in range(base_size)}
+    index = LocalVectorIndex(space=space, quantization=quantization, rescore_factor=4)
+    ids = list(vectors)
+    index.build(ids, [vectors[i] for i in ids], ids, [{"n": n} for n in range(base_size)])
+    # upsert cả document mới lẫn document đã có trong base, row mới nằm ở phần delta
+    updated = {f"doc-{i}": rng.normal(size=32).astype(np.float32) for i in range(base_size - 20, base_size + delta_size - 20)}
+    index.upsert(list(updated), list(updated.values()), list(updated), [{} for _ in updated])
+    vectors.update(updated)
+    return index, vectors, rng
+
+
+@pytest.mark.parametrize("quantization", ["float32", "float16", "int8", "binary"])
+@pytest.mark.parametrize("space", ["l2", "cosine"])
+def test_search_distances_match_ids_after_upsert(quantization, space):
+    index, vectors, rng = build_index(quantization, space)
+    for _ in range(10):
+        query = rng.normal(size=32).astype(np.float32)
+        expected = exact_distances(space, query, vectors)
+        hits = index.search(query.tolist(), limit=25)
+        assert len(hits) == 25
+        for doc_id, _, _, distance in hits:
+            assert distance == pytest.approx(expected[doc_id], rel=1e-3, abs=1e-3)
+        assert [hit[3] for hit in hits] == sorted(hit[3] for hit in hits)
+
+
+def test_exact_search_returns_true_nearest_neighbours():
+    index, vectors, rng = build_index("float32")
+    query = rng.normal(size=32).astype(np.float32)
+    expected = sorted(exact_distances("l2", query, vectors).items(), key=lambda item: item[1])[:5]
+    assert [hit[0] for hit in index.search(query.tolist(), limit=5)] == [doc_id for doc_id, _ in expected]
+
+
+def test_removed_documents_are_not_returned():
+    index, vectors, rng = build_index("int8")
+    removed = ["doc-0", "doc-149", "doc-170"]
+    index.remove(removed)
+    query = vectors["doc-0"]
+    hits = index.search(query.tolist(), limit=len(vectors))
+    assert not {hit[0] for hit in hits} & set(removed)
+    assert len(index) == len(vectors) - len(removed)
+
+
+def test_snapshot_round_trip_keeps_upserted_rows(tmp_path):
+    index, vectors, rng = build_index("float32")
+    path = str(tmp_path / "index")
+    index.save(path)
+    loaded = LocalVectorIndex.load(path, quantization="int8")
+    query = rng.normal(size=32).astype(np.float32)
+    expected = exact_distances("l2", query, vectors)
+    for doc_id, _, _, distance in loaded.search(query.tolist(), limit=10):
+        assert distance == pytest.approx(expected[doc_id], rel=1e-3, abs=1e-3)